@@ -0,0 +1,77 @@
+"""Benchmark the latency of concatenating the chapters of a recording with run_ffmpeg.
+
+The chapters are encoded once from ffmpeg's test sources, then joined `--repeat`
+times with the in-process MP4 join and with ffmpeg's concat demuxer
+(native_concat = no). Each run writes to a fresh output directory.
+
+Usage:
+    python benchmarks/bench_concat.py --chapters 4 --seconds 10 --size 1920x1080 --json concat.json
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict
+
+from fixtures import create_playable_clips, ffmpeg_available, isolate_state
+from results import report, timed, write
+
+import config  # pylint: disable=wrong-import-order
+from video_append import run_ffmpeg  # pylint: disable=wrong-import-order
+
+
+def bench_mode(input_directory: str, clips: list, root: str, repeat: int, native: bool) -> Dict[str, object]:
+    """Join the clips `repeat` times and return the latencies in seconds."""
+    config.config['DEFAULT']['native_concat'] = 'yes' if native else 'no'
+    outputs = []
+
+    def join() -> None:
+        output_directory = tempfile.mkdtemp(dir=root)
+        outputs.append(output_directory)
+        run_ffmpeg(input_directory, output_directory, False, video_files=clips)
+
+    try:
+        median, seconds = timed(join, repeat)
+        written = [name for name in os.listdir(outputs[-1]) if name.startswith('output')]
+        if not written:
+            raise RuntimeError("run_ffmpeg did not write an output file")
+        return {'median_seconds': median, 'min_seconds': min(seconds), 'runs': seconds,
+                'output_bytes': os.path.getsize(os.path.join(outputs[-1], written[0]))}
+    finally:
+        for output_directory in outputs:
+            shutil.rmtree(output_directory, ignore_errors=True)
+
+
+def main() -> Dict[str, object]:
+    """Run the concat benchmark and print the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--directory', default=tempfile.gettempdir(), help="Directory for the fixtures")
+    parser.add_argument('--chapters', type=int, default=4, help="Number of chapters to join")
+    parser.add_argument('--seconds', type=float, default=5.0, help="Length of each chapter")
+    parser.add_argument('--size', default='1280x720', help="Frame size of the chapters")
+    parser.add_argument('--repeat', type=int, default=5, help="Joins per mode; the median is reported")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results to this file")
+    args = parser.parse_args()
+    if not ffmpeg_available():
+        sys.exit("ffmpeg is needed to encode the fixtures and was not found on the PATH")
+
+    root = tempfile.mkdtemp(dir=args.directory)
+    try:
+        isolate_state(os.path.join(root, 'state'))
+        input_directory = os.path.join(root, 'chapters')
+        clips = create_playable_clips(input_directory, args.chapters, args.seconds, args.size)
+        results = {mode: bench_mode(input_directory, clips, root, args.repeat, native)
+                   for mode, native in (('native', True), ('ffmpeg', False))}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    document = report('concat', {key: value for key, value in vars(args).items() if key != 'json'},
+                      results)
+    write(document, args.json)
+    return document
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark import throughput: single-file copies and moves, parallel transfers and whole imports.
+
+Usage:
+    python benchmarks/bench_import.py --destination /mnt/nvme/bench --files 8 --size-mb 256 --json import.json
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+from fixtures import MB, create_chapters, isolate_state
+from results import report, write
+
+from transfer import TransferSettings  # pylint: disable=wrong-import-order
+from video_import import (ImportSettings, import_videos,  # pylint: disable=wrong-import-order
+                          move_file_with_progress, transfer_files)
+
+
+def create_fixtures(directory: str, count: int, size_mb: int, sparse: bool = False) -> List[str]:
+    """Create the chapters to import in a fresh directory."""
+    return create_chapters(directory, count, size_mb, sparse)
+
+
+def _mbps(total_bytes: int, seconds: float) -> float:
+    return total_bytes / MB / seconds if seconds else 0.0
+
+
+def bench_single(source_root: str, destination_root: str, count: int, size_mb: int, sparse: bool,
+                 move: bool) -> float:
+    """Copy or move fixtures one at a time with move_file_with_progress and return MB/s."""
+    source = tempfile.mkdtemp(dir=source_root)
+    destination = tempfile.mkdtemp(dir=destination_root)
+    try:
+        sources = create_fixtures(source, count, size_mb, sparse)
+        start = time.perf_counter()
+        for path in sources:
+            move_file_with_progress(path, os.path.join(destination, os.path.basename(path)),
+                                    progress=lambda num_bytes: None,
+                                    settings=TransferSettings(move=move))
+        return _mbps(count * size_mb * MB, time.perf_counter() - start)
+    finally:
+        shutil.rmtree(source, ignore_errors=True)
+        shutil.rmtree(destination, ignore_errors=True)
+
+
+def run_benchmark(source_root: str, destination_root: str, count: int, size_mb: int, workers: int,
+                  sparse: bool = False) -> float:
+    """Transfer a fresh set of fixtures with transfer_files and return the aggregate MB/s."""
+    source = tempfile.mkdtemp(dir=source_root)
+    destination = tempfile.mkdtemp(dir=destination_root)
+    try:
+        sources = create_fixtures(source, count, size_mb, sparse)
+        transfers = [(path, os.path.join(destination, os.path.basename(path))) for path in sources]
+        stats = transfer_files(transfers, workers)
+        return stats.aggregate_mbps
+    finally:
+        shutil.rmtree(source, ignore_errors=True)
+        shutil.rmtree(destination, ignore_errors=True)
+
+
+def bench_import_videos(source_root: str, destination_root: str, count: int, size_mb: int,
+                        sparse: bool, verify: bool) -> float:
+    """Run a whole import_videos, including fingerprinting and the journal, and return MB/s."""
+    source = tempfile.mkdtemp(dir=source_root)
+    destination = tempfile.mkdtemp(dir=destination_root)
+    state = tempfile.mkdtemp()
+    try:
+        isolate_state(state)
+        create_fixtures(source, count, size_mb, sparse)
+        start = time.perf_counter()
+        import_videos(source, settings=ImportSettings(resume=False, verify=verify,
+                                                      delete_source=False,
+                                                      output_directory=destination))
+        return _mbps(count * size_mb * MB, time.perf_counter() - start)
+    finally:
+        for directory in (source, destination, state):
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main() -> Dict[str, object]:
+    """Run the import benchmarks and print the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=tempfile.gettempdir(), help="Directory for source fixtures")
+    parser.add_argument('--destination', default=tempfile.gettempdir(), help="Directory to import into")
+    parser.add_argument('--files', type=int, default=8, help="Number of clips")
+    parser.add_argument('--size-mb', type=int, default=64,
+                        help="Size of each clip in MB; cameras write 4000 MB chapters")
+    parser.add_argument('--sparse', action='store_true',
+                        help="Use sparse fixtures, which are created instantly but may be copied without I/O")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help="Worker counts to test")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    single = {mode: {'mbps': bench_single(args.source, args.destination, args.files, args.size_mb,
+                                          args.sparse, move)}
+              for mode, move in (('copy', False), ('move', True))}
+    scaling = {str(workers): {'mbps': run_benchmark(args.source, args.destination, args.files,
+                                                    args.size_mb, workers, args.sparse)}
+               for workers in args.workers}
+    baseline = scaling[str(args.workers[0])]['mbps'] or 1.0
+    for result in scaling.values():
+        result['scaling'] = result['mbps'] / baseline
+    imports = {mode: {'mbps': bench_import_videos(args.source, args.destination, args.files,
+                                                  args.size_mb, args.sparse, verify)}
+               for mode, verify in (('copy', False), ('verified', True))}
+
+    document = report('import', {key: value for key, value in vars(args).items() if key != 'json'},
+                      {'move_file_with_progress': single, 'transfer_files': scaling,
+                       'import_videos': imports})
+    write(document, args.json)
+    return document
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark organizing clips by capture date, in files per second.
+
+For each clip count, a flat directory of metadata-only clips is planned with an
+empty media catalog (every clip is opened), planned again with a warm catalog,
+and finally organized, which moves every clip into its date folder.
+
+Usage:
+    python benchmarks/bench_organize.py --counts 1000 10000 100000 --json organize.json
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+from typing import Dict
+
+from fixtures import create_metadata_clips, isolate_state
+from results import report, write
+
+from organize import organize_videos_by_date, plan_organize  # pylint: disable=wrong-import-order
+
+
+def bench_count(root: str, count: int, workers: int) -> Dict[str, object]:
+    """Organize `count` clips and return files/s for each phase."""
+    directory = tempfile.mkdtemp(dir=root)
+    state = tempfile.mkdtemp(dir=root)
+    try:
+        isolate_state(state)
+        create_metadata_clips(directory, count)
+
+        results: Dict[str, object] = {}
+        for phase in ('plan_cold', 'plan_warm'):
+            start = time.perf_counter()
+            plan = plan_organize(directory, workers=workers)
+            seconds = time.perf_counter() - start
+            results[phase] = {'seconds': seconds, 'files_per_second': count / seconds}
+        results['date_folders'] = len(plan.directories)
+
+        start = time.perf_counter()
+        organize_videos_by_date(directory)
+        seconds = time.perf_counter() - start
+        results['organize'] = {'seconds': seconds, 'files_per_second': count / seconds}
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        shutil.rmtree(state, ignore_errors=True)
+
+
+def main() -> Dict[str, object]:
+    """Run the organize benchmark for each clip count and print the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--directory', default=tempfile.gettempdir(), help="Directory for the fixtures")
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Numbers of clips to organize")
+    parser.add_argument('--workers', type=int, default=8, help="Clips read at once")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = {str(count): bench_count(args.directory, count, args.workers) for count in args.counts}
+    document = report('organize', {key: value for key, value in vars(args).items() if key != 'json'},
+                      results)
+    write(document, args.json)
+    return document
+
+
+if __name__ == '__main__':
+    main()
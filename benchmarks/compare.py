@@ -0,0 +1,52 @@
+"""Compare two benchmark results files, for example before and after a change.
+
+Usage:
+    python benchmarks/compare.py baseline.json candidate.json
+"""
+
+import argparse
+import json
+import sys
+
+from results import flatten
+
+# Measurements where a smaller number is better; everything else is a rate
+LOWER_IS_BETTER = ('seconds', 'bytes')
+
+
+def main() -> int:
+    """Print every measurement of both files side by side with the relative change."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline', help="Results of the reference version")
+    parser.add_argument('candidate', help="Results of the version to compare")
+    parser.add_argument('--threshold', type=float, default=5.0,
+                        help="Flag changes for the worse larger than this many percent")
+    args = parser.parse_args()
+
+    documents = []
+    for path in (args.baseline, args.candidate):
+        with open(path, encoding='utf-8') as f:
+            documents.append(json.load(f))
+    if documents[0]['benchmark'] != documents[1]['benchmark']:
+        sys.exit(f"Cannot compare {documents[0]['benchmark']} results with {documents[1]['benchmark']} results")
+    if documents[0]['parameters'] != documents[1]['parameters']:
+        print("Warning: the benchmarks were run with different parameters", file=sys.stderr)
+
+    baseline, candidate = (flatten(document['results']) for document in documents)
+    print(f"{'measurement':<40} {documents[0]['revision'] or 'baseline':>12} "
+          f"{documents[1]['revision'] or 'candidate':>12} {'change':>8}")
+    regressions = 0
+    for name in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[name], candidate[name]
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if not name.endswith(LOWER_IS_BETTER) else change
+        flag = ''
+        if worse > args.threshold:
+            flag = ' !'
+            regressions += 1
+        print(f"{name:<40} {before:>12.3f} {after:>12.3f} {change:>+7.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
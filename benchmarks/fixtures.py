@@ -0,0 +1,149 @@
+"""Synthetic footage for the benchmarks.
+
+Three kinds of fixtures are generated, from cheapest to most realistic:
+
+- chapter files of a camera's chapter size with random or sparse content, for
+  copy throughput;
+- metadata-only clips: a valid ftyp/moov with the capture time, camera model and
+  video format a camera records, written with box writers and no media, for
+  anything that only reads moov (organizing, the catalog);
+- playable clips encoded by ffmpeg from its lavfi test sources, for concatenation.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from typing import List
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIRECTORY)
+
+import config  # pylint: disable=wrong-import-position
+
+MB = 1024 * 1024
+MP4_EPOCH = datetime(1904, 1, 1)
+# Cameras split recordings into chapters of about 4 GB
+CHAPTER_SIZE_MB = 4000
+
+
+def isolate_state(directory: str) -> None:
+    """Keep config.ini and every cache and index of a benchmark in a scratch directory.
+
+    The import index, media catalog and other state files live next to config.ini,
+    so results would otherwise depend on, and pollute, the user's own state.
+    """
+    os.makedirs(directory, exist_ok=True)
+    config.config_file = os.path.join(directory, 'config.ini')
+    config.config['DEFAULT'] = {'input_directory': '', 'output_directory': ''}
+
+
+def chapter_name(recording: int, chapter: int = 1) -> str:
+    """Name a chapter the way a GoPro HERO6 or later does, e.g. GX010042.MP4."""
+    return f"GX{chapter:02d}{recording:04d}.MP4"
+
+
+def create_chapters(directory: str, count: int, size_mb: int, sparse: bool = False) -> List[str]:
+    """Create chapter files of a given size.
+
+    Random content cannot be short-circuited by compression or deduplication; sparse
+    files are created instantly but file systems may copy them without reading data.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    block = os.urandom(MB)
+    for index in range(count):
+        path = os.path.join(directory, chapter_name(index))
+        with open(path, 'wb') as f:
+            if sparse:
+                f.truncate(size_mb * MB)
+            else:
+                for _ in range(size_mb):
+                    f.write(block)
+        paths.append(path)
+    return paths
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type: bytes, payload: bytes) -> bytes:
+    return _box(box_type, b'\0\0\0\0' + payload)
+
+
+def metadata_clip(captured: datetime, camera: str = 'HERO12 Black', width: int = 3840,
+                  height: int = 2160, seconds: int = 60, media_bytes: int = 1024) -> bytes:
+    """Build a small MP4 whose moov records what a camera records about a clip.
+
+    The sample tables are empty, so the clip does not play, but mvhd, tkhd, hdlr,
+    the avc1 sample entry and udta/©mod are laid out as in camera files.
+    """
+    creation = int((captured - MP4_EPOCH).total_seconds())
+    timescale = 1000
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = _full_box(b'mvhd', struct.pack('>IIII', creation, creation, timescale, seconds * timescale)
+                     + struct.pack('>IH10x', 0x10000, 0x100) + matrix + b'\0' * 24 + struct.pack('>I', 2))
+    tkhd = _full_box(b'tkhd', struct.pack('>IIIII', creation, creation, 1, 0, seconds * timescale)
+                     + b'\0' * 16 + matrix + struct.pack('>II', width << 16, height << 16))
+    mdhd = _full_box(b'mdhd', struct.pack('>IIIIHH', creation, creation, 90000, seconds * 90000, 0x55c4, 0))
+    hdlr = _full_box(b'hdlr', struct.pack('>I4s12x', 0, b'vide') + b'GoPro AVC\0')
+    avc1 = _box(b'avc1', b'\0' * 6 + struct.pack('>H', 1) + b'\0' * 16
+                + struct.pack('>HHIIIH', width, height, 0x480000, 0x480000, 0, 1)
+                + b'\0' * 32 + struct.pack('>Hh', 0x18, -1))
+    stsd = _full_box(b'stsd', struct.pack('>I', 1) + avc1)
+    stbl = _box(b'stbl', stsd + b''.join(_full_box(box_type, struct.pack('>I', 0))
+                                         for box_type in (b'stts', b'stsc', b'stco'))
+                + _full_box(b'stsz', struct.pack('>II', 0, 0)))
+    minf = _box(b'minf', _full_box(b'vmhd', b'\0' * 8) + stbl)
+    trak = _box(b'trak', tkhd + _box(b'mdia', mdhd + hdlr + minf))
+    model = camera.encode('utf-8')
+    udta = _box(b'udta', _box(b'\xa9mod', struct.pack('>HH', len(model), 0x55c4) + model))
+    ftyp = _box(b'ftyp', b'mp41' + struct.pack('>I', 0x13000000) + b'mp41isom')
+    return ftyp + _box(b'mdat', os.urandom(media_bytes)) + _box(b'moov', mvhd + trak + udta)
+
+
+def create_metadata_clips(directory: str, count: int, days: int = 30,
+                          start: datetime = datetime(2024, 6, 1, 9, 0)) -> List[str]:
+    """Create clips of different recordings spread over a number of capture days."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    per_day = max(1, count // max(1, days))
+    for index in range(count):
+        captured = start + timedelta(days=index // per_day, seconds=index % per_day * 60)
+        path = os.path.join(directory, chapter_name(index % 10000, 1 + index // 10000))
+        with open(path, 'wb') as f:
+            f.write(metadata_clip(captured))
+        paths.append(path)
+    return paths
+
+
+def ffmpeg_available() -> bool:
+    """Whether ffmpeg is on the PATH to encode playable fixtures."""
+    return shutil.which('ffmpeg') is not None
+
+
+def create_playable_clips(directory: str, count: int, seconds: float = 2.0, size: str = '320x240',
+                          rate: int = 30) -> List[str]:
+    """Encode the chapters of one recording from ffmpeg's test pattern and a sine tone.
+
+    Every chapter has the same stream parameters, like chapters from a camera, so
+    they can be concatenated without re-encoding.
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg fails.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, chapter_name(42, index + 1))
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}:duration={seconds}',
+                        '-f', 'lavfi', '-i', f'sine=frequency={440 + index * 110}:duration={seconds}',
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(rate), '-pix_fmt', 'yuv420p',
+                        '-c:a', 'aac', '-shortest', path],
+                       check=True)
+        paths.append(path)
+    return paths
@@ -0,0 +1,84 @@
+"""JSON benchmark results that can be compared across versions.
+
+A results file records the benchmark parameters and measurements together with
+the git revision and machine they were taken on:
+
+    {"benchmark": "import", "revision": "b9b3f52", "machine": {...},
+     "parameters": {...}, "results": {"copy": {"mbps": 812.4}, ...}}
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_revision() -> Optional[str]:
+    """Get the checked-out commit, with a + suffix when the tree has local changes."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPOSITORY,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ('+' if dirty else '')
+
+
+def machine() -> Dict[str, object]:
+    """Describe the machine the benchmark ran on."""
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def timed(function: Callable[[], object], repeat: int = 1) -> Tuple[float, List[float]]:
+    """Run a function `repeat` times and return the median and all wall-clock seconds."""
+    seconds = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds), seconds
+
+
+def report(benchmark: str, parameters: Dict[str, object], results: Dict[str, object]) -> Dict[str, object]:
+    """Wrap measurements into a results document."""
+    return {
+        'benchmark': benchmark,
+        'revision': git_revision(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine(),
+        'parameters': parameters,
+        'results': results,
+    }
+
+
+def write(document: Dict[str, object], path: Optional[str]) -> None:
+    """Print a results document, and write it to `path` when given."""
+    text = json.dumps(document, indent=2)
+    print(text)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+def flatten(results: Dict[str, object], prefix: str = '') -> Dict[str, float]:
+    """Flatten nested results into {'copy.mbps': 812.4, ...}, keeping only numbers."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
@@ -0,0 +1,411 @@
+"""Module to keep an indexed catalog of the clips in the video directories."""
+
+import json
+import os
+import sqlite3
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from rich.console import Console
+from rich.table import Table
+from config import get_config_int, get_state_path
+from logging_setup import setup_logger
+from mp4 import ClipMetadata, Mp4Error, read_metadata
+from proxies import proxy_directory_name
+
+logger = setup_logger(__name__)
+
+CATALOG_FILENAME = "media_catalog.db"
+DEFAULT_CATALOG_WORKERS = 8
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+CAPTURED_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+EntryState = Tuple[int, int, int, int]
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS clips (path TEXT PRIMARY KEY, directory TEXT NOT NULL, "
+    "name TEXT NOT NULL, inode INTEGER, size INTEGER, mtime INTEGER, captured TEXT, camera TEXT, "
+    "duration REAL, width INTEGER, height INTEGER, codec TEXT, device INTEGER)",
+    "CREATE INDEX IF NOT EXISTS clips_directory ON clips (directory, name)",
+    "CREATE INDEX IF NOT EXISTS clips_captured ON clips (captured)",
+    "CREATE INDEX IF NOT EXISTS clips_camera ON clips (camera COLLATE NOCASE, captured)",
+    "CREATE INDEX IF NOT EXISTS clips_duration ON clips (duration)",
+    "CREATE INDEX IF NOT EXISTS clips_resolution ON clips (height, width)",
+    "CREATE INDEX IF NOT EXISTS clips_state ON clips (inode, size, mtime)",
+    "CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, inode INTEGER, mtime INTEGER, "
+    "children TEXT NOT NULL)",
+)
+
+
+class CatalogEntry(NamedTuple):
+    """A clip in the catalog.
+
+    Attributes:
+        path (str): The absolute path of the clip.
+        captured (Optional[datetime]): When the clip was shot, from the camera's metadata
+            or else the file's ctime.
+        camera (Optional[str]): The camera model.
+        duration (Optional[float]): The duration in seconds.
+        width (Optional[int]): The video width in pixels.
+        height (Optional[int]): The video height in pixels.
+        codec (Optional[str]): The video sample entry type, e.g. "avc1" or "hvc1".
+        size (int): The file size in bytes.
+    """
+    path: str
+    captured: Optional[datetime]
+    camera: Optional[str]
+    duration: Optional[float]
+    width: Optional[int]
+    height: Optional[int]
+    codec: Optional[str]
+    size: int
+
+
+class ClipFilter(NamedTuple):
+    """Which clips a catalog query returns. Filters that are None are ignored.
+
+    Attributes:
+        directory (Optional[str]): Only clips directly in this directory.
+        under (Optional[str]): Only clips anywhere below this directory.
+        camera (Optional[str]): Only clips from this camera model, ignoring case.
+        since (Optional[datetime]): Only clips shot at or after this time.
+        until (Optional[datetime]): Only clips shot before this time.
+        min_width (Optional[int]): Only clips at least this wide, e.g. 3840 for 4K.
+        min_height (Optional[int]): Only clips at least this tall.
+        min_duration (Optional[float]): Only clips at least this many seconds long.
+        max_duration (Optional[float]): Only clips at most this many seconds long.
+    """
+    directory: Optional[str] = None
+    under: Optional[str] = None
+    camera: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    min_width: Optional[int] = None
+    min_height: Optional[int] = None
+    min_duration: Optional[float] = None
+    max_duration: Optional[float] = None
+
+
+def is_video(name: str) -> bool:
+    """Whether a file name has one of the VIDEO_EXTENSIONS."""
+    return os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+
+
+def _state(stat_result: os.stat_result) -> EntryState:
+    return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+def _read(path: str) -> ClipMetadata:
+    try:
+        return read_metadata(path)
+    except (OSError, IndexError, OverflowError, Mp4Error, struct.error) as e:
+        logger.debug("Could not read metadata of %s: %s", path, e)
+        return ClipMetadata(None, None, None)
+
+
+def _read_all(paths: List[str], workers: Optional[int] = None) -> Dict[str, ClipMetadata]:
+    """Read the metadata of clips in parallel, by default with catalog_workers threads."""
+    workers = workers or get_config_int('catalog_workers', DEFAULT_CATALOG_WORKERS)
+    with ThreadPoolExecutor(max_workers=max(1, workers),
+                            thread_name_prefix="catalog") as executor:
+        return dict(zip(paths, executor.map(_read, paths)))
+
+
+class _Changes(NamedTuple):
+    """What a scan found: changed clips, vanished clips and trees, and directories listed."""
+    changed: List[Tuple[str, os.stat_result]]
+    gone_files: List[str]
+    gone_trees: List[str]
+    listed: int
+
+
+class MediaCatalog:
+    """SQLite catalog of clips with their capture time, camera, duration and resolution.
+
+    Clips are keyed by path and remember their device, inode, size and mtime, so
+    only new or changed files are opened when the catalog is refreshed. Directories
+    remember their mtime and subdirectories, so an unchanged directory is not
+    listed again while its subdirectories are still visited; the clips cataloged
+    in it are only stat'ed, to catch files rewritten in place.
+    """
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self._conn = sqlite3.connect(db_path or get_state_path(CATALOG_FILENAME))
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(clips)")]
+        if 'device' not in columns:
+            # Catalogs written before the device was recorded; their clips are read once more
+            self._conn.execute("ALTER TABLE clips ADD COLUMN device INTEGER")
+        self._conn.commit()
+
+    def refresh(self, root: str, recursive: bool = True, workers: Optional[int] = None) -> int:
+        """Bring the catalog of a directory up to date.
+
+        Hidden directories and proxy folders are skipped. A file that was moved
+        within the catalog keeps its metadata: it is recognized by its device, inode,
+        size and mtime and is not opened again.
+
+        Args:
+            root (str): The directory to scan.
+            recursive (bool): Whether to scan its subdirectories too.
+            workers (Optional[int]): The number of clips read at once. Defaults to the
+                catalog_workers setting.
+
+        Returns:
+            int: The number of clips that were added or updated.
+        """
+        root = os.path.abspath(root)
+        changes = self._scan(root, recursive)
+        # Look up moved files before the rows of the paths they left are deleted
+        moved, to_read = self._find_moved(changes.changed)
+        self._conn.executemany("DELETE FROM clips WHERE path = ?",
+                               [(path,) for path in changes.gone_files])
+        for path in changes.gone_trees:
+            self._forget_tree(path)
+        self._store(changes.changed, moved, _read_all(to_read, workers))
+        self._conn.commit()
+        logger.info("Refreshed catalog of %s: listed %d directories, read %d clips, %d moved",
+                    root, changes.listed, len(to_read), len(moved))
+        return len(changes.changed)
+
+    def _scan(self, root: str, recursive: bool) -> _Changes:
+        """Find the clips and directories that changed or disappeared below a directory."""
+        proxy_folder = proxy_directory_name()
+        changed: List[Tuple[str, os.stat_result]] = []
+        gone_files: List[str] = []
+        gone_trees: List[str] = []
+        listed = 0
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                gone_trees.append(path)
+                continue
+            known = self._directory(path)
+            if known is not None and known[:2] == (stat_result.st_ino, stat_result.st_mtime_ns):
+                self._restat(path, changed, gone_files)
+                children = known[2]
+            else:
+                listed += 1
+                children = self._list(path, stat_result, proxy_folder, changed, gone_files)
+                if known is not None:
+                    gone_trees.extend(set(known[2]) - set(children))
+            if recursive:
+                stack.extend(children)
+        return _Changes(changed, gone_files, gone_trees, listed)
+
+    def _list(self, path: str, stat_result: os.stat_result, proxy_folder: str,
+              changed: List[Tuple[str, os.stat_result]], gone_files: List[str]) -> List[str]:
+        """List a directory that changed since it was cataloged, and record it.
+
+        Returns:
+            List[str]: Its subdirectories, other than hidden and proxy folders.
+        """
+        children = []
+        seen = set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.') and entry.name != proxy_folder:
+                        children.append(entry.path)
+                elif is_video(entry.name) and entry.is_file():
+                    seen.add(entry.path)
+                    entry_stat = entry.stat()
+                    if self._file_state(entry.path) != _state(entry_stat):
+                        changed.append((entry.path, entry_stat))
+        gone_files.extend(set(self._paths_in(path)) - seen)
+        self._conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)",
+                           (path, stat_result.st_ino, stat_result.st_mtime_ns,
+                            json.dumps(children)))
+        return children
+
+    def _find_moved(self, changed: List[Tuple[str, os.stat_result]]
+                    ) -> Tuple[Dict[str, tuple], List[str]]:
+        """Split changed clips into files moved within the catalog and files to read."""
+        moved: Dict[str, tuple] = {}
+        to_read = []
+        for path, stat_result in changed:
+            row = self._conn.execute(
+                "SELECT captured, camera, duration, width, height, codec FROM clips "
+                "WHERE device = ? AND inode = ? AND size = ? AND mtime = ? AND path != ?",
+                _state(stat_result) + (path,)).fetchone()
+            if row:
+                moved[path] = row
+            else:
+                to_read.append(path)
+        return moved, to_read
+
+    def _store(self, changed: List[Tuple[str, os.stat_result]], moved: Dict[str, tuple],
+               metadata: Dict[str, ClipMetadata]) -> None:
+        for path, stat_result in changed:
+            if path in moved:
+                details = moved[path]
+            else:
+                clip = metadata[path]
+                captured = clip.creation_time or datetime.fromtimestamp(stat_result.st_ctime)
+                details = (captured.strftime(CAPTURED_FORMAT), clip.camera_model, clip.duration,
+                           clip.width, clip.height, clip.video_codec)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO clips (path, directory, name, device, inode, size, mtime, "
+                "captured, camera, duration, width, height, codec) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, os.path.dirname(path), os.path.basename(path))
+                + _state(stat_result) + tuple(details))
+
+    def _directory(self, path: str) -> Optional[Tuple[int, int, List[str]]]:
+        row = self._conn.execute("SELECT inode, mtime, children FROM directories WHERE path = ?",
+                                 (path,)).fetchone()
+        return (row[0], row[1], json.loads(row[2])) if row else None
+
+    def _file_state(self, path: str) -> Optional[EntryState]:
+        row = self._conn.execute("SELECT device, inode, size, mtime FROM clips WHERE path = ?",
+                                 (path,)).fetchone()
+        return tuple(row) if row else None
+
+    def _restat(self, directory: str, changed: List[Tuple[str, os.stat_result]],
+                gone_files: List[str]) -> None:
+        """Check the clips of a directory that was not listed again.
+
+        Rewriting a file in place does not change its directory's mtime, so each
+        cataloged clip is stat'ed; a stat is much cheaper than opening the clip.
+        """
+        rows = self._conn.execute(
+            "SELECT path, device, inode, size, mtime FROM clips WHERE directory = ?",
+            (directory,)).fetchall()
+        for path, *state in rows:
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                gone_files.append(path)
+                continue
+            if tuple(state) != _state(stat_result):
+                changed.append((path, stat_result))
+
+    def _paths_in(self, directory: str) -> List[str]:
+        return [row[0] for row in self._conn.execute("SELECT path FROM clips WHERE directory = ?",
+                                                     (directory,))]
+
+    def _forget_tree(self, path: str) -> None:
+        """Forget a directory that no longer exists, with everything below it."""
+        low, high = _subtree_bounds(path)
+        self._conn.execute("DELETE FROM clips WHERE directory = ? OR (path > ? AND path < ?)",
+                           (path, low, high))
+        self._conn.execute("DELETE FROM directories WHERE path = ? OR (path > ? AND path < ?)",
+                           (path, low, high))
+
+    def list_directory(self, directory: str) -> List[str]:
+        """Get the names of the clips directly in a directory, in name order."""
+        return [row[0] for row in self._conn.execute(
+            "SELECT name FROM clips WHERE directory = ? ORDER BY name",
+            (os.path.abspath(directory),))]
+
+    def subdirectories(self, directory: str) -> List[str]:
+        """Get the names of the cataloged subdirectories of a directory."""
+        known = self._directory(os.path.abspath(directory))
+        return [os.path.basename(child) for child in known[2]] if known else []
+
+    def cameras(self) -> List[str]:
+        """Get the camera models in the catalog."""
+        return [row[0] for row in self._conn.execute(
+            "SELECT DISTINCT camera FROM clips WHERE camera IS NOT NULL ORDER BY camera")]
+
+    def query(self, clip_filter: ClipFilter) -> List[CatalogEntry]:
+        """Find clips by location, camera, capture time, resolution and duration.
+
+        Every filter is answered from an index.
+
+        Args:
+            clip_filter (ClipFilter): The filters the clips have to pass.
+
+        Returns:
+            List[CatalogEntry]: The clips, in the order they were shot.
+        """
+        conditions = []
+        parameters: List[object] = []
+        if clip_filter.directory is not None:
+            conditions.append("directory = ?")
+            parameters.append(os.path.abspath(clip_filter.directory))
+        if clip_filter.under is not None:
+            conditions.append("path > ? AND path < ?")
+            parameters.extend(_subtree_bounds(os.path.abspath(clip_filter.under)))
+        if clip_filter.camera:
+            conditions.append("camera = ? COLLATE NOCASE")
+            parameters.append(clip_filter.camera)
+        if clip_filter.since is not None:
+            conditions.append("captured >= ?")
+            parameters.append(clip_filter.since.strftime(CAPTURED_FORMAT))
+        if clip_filter.until is not None:
+            conditions.append("captured < ?")
+            parameters.append(clip_filter.until.strftime(CAPTURED_FORMAT))
+        for column, operator, value in (('width', '>=', clip_filter.min_width),
+                                        ('height', '>=', clip_filter.min_height),
+                                        ('duration', '>=', clip_filter.min_duration),
+                                        ('duration', '<=', clip_filter.max_duration)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                parameters.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._conn.execute(
+            "SELECT path, captured, camera, duration, width, height, codec, size FROM clips"
+            f"{where} ORDER BY captured, path", parameters)
+        return [CatalogEntry(path, _captured(captured), camera, duration, width, height, codec,
+                             size)
+                for path, captured, camera, duration, width, height, codec, size in rows]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._conn.close()
+
+
+def _captured(text: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(text, CAPTURED_FORMAT) if text else None
+
+
+def _subtree_bounds(path: str) -> Tuple[str, str]:
+    """The range of paths strictly below a directory, for an indexed range query."""
+    prefix = path.rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def print_entries(entries: List[CatalogEntry], console: Console) -> None:
+    """Show clips found in the catalog.
+
+    Args:
+        entries (List[CatalogEntry]): The clips returned by MediaCatalog.query.
+        console (Console): The rich console instance for printing messages.
+    """
+    table = Table(title=f"{len(entries)} clips")
+    table.add_column("Shot")
+    table.add_column("Clip")
+    table.add_column("Camera")
+    table.add_column("Resolution", justify="right")
+    table.add_column("Duration", justify="right")
+    for entry in entries:
+        table.add_row(entry.captured.strftime('%Y-%m-%d %H:%M') if entry.captured else "",
+                      os.path.basename(entry.path), entry.camera or "",
+                      f"{entry.width}x{entry.height}" if entry.width else "",
+                      f"{entry.duration:.1f}s" if entry.duration is not None else "")
+    console.print(table)
+
+
+def list_video_files(directory: str) -> List[str]:
+    """Get the names of the clips in a directory from the catalog, refreshing it first.
+
+    The directory is only listed again if it changed since it was last cataloged.
+
+    Args:
+        directory (str): The directory.
+
+    Returns:
+        List[str]: The clip names, in name order.
+    """
+    catalog = MediaCatalog()
+    try:
+        catalog.refresh(directory, recursive=False)
+        return catalog.list_directory(directory)
+    finally:
+        catalog.close()
@@ -0,0 +1,125 @@
+"""Module to group the chapter files cameras split long recordings into."""
+
+import os
+import re
+import struct
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from logging_setup import setup_logger
+from mp4 import Mp4Error, read_metadata
+
+logger = setup_logger(__name__)
+
+# HERO6 and later: GH/GX/GL + 2-digit chapter + 4-digit file number, e.g. GX010042.MP4
+GOPRO_CHAPTER = re.compile(r'^(G[HXL])(\d{2})(\d{4})\.mp4$', re.IGNORECASE)
+# HERO5 and earlier: GOPR0042.MP4 is the first chapter, GP010042.MP4 the second
+GOPRO_LEGACY_FIRST = re.compile(r'^GOPR(\d{4})\.mp4$', re.IGNORECASE)
+GOPRO_LEGACY_CHAPTER = re.compile(r'^GP(\d{2})(\d{4})\.mp4$', re.IGNORECASE)
+# DJI Action/Osmo: DJI_20240501123000_0007_D.MP4; chapters are consecutive files
+DJI_FILE = re.compile(r'^DJI_(\d{14})_(\d{4})_([A-Z])\.mp4$', re.IGNORECASE)
+DJI_TIME_FORMAT = '%Y%m%d%H%M%S'
+# Seconds of slack allowed between the end of a DJI chapter and the start of the next
+DJI_GAP_SECONDS = 2.0
+
+
+class Recording(NamedTuple):
+    """One recording and its chapter files in playback order.
+
+    Attributes:
+        name (str): A name for the joined recording, e.g. "GX0042".
+        chapters (List[str]): The chapter file paths in order.
+    """
+    name: str
+    chapters: List[str]
+
+
+def chapter_key(filename: str) -> Optional[Tuple[str, int]]:
+    """Get the recording a GoPro chapter file belongs to and its chapter number.
+
+    Args:
+        filename (str): The file name without directory.
+
+    Returns:
+        Optional[Tuple[str, int]]: The recording name and chapter number, or None if
+        the name does not follow a GoPro chaptering scheme.
+    """
+    match = GOPRO_CHAPTER.match(filename)
+    if match:
+        prefix, chapter, number = match.groups()
+        return f"{prefix.upper()}{number}", int(chapter)
+    match = GOPRO_LEGACY_FIRST.match(filename)
+    if match:
+        return f"GOPR{match.group(1)}", 0
+    match = GOPRO_LEGACY_CHAPTER.match(filename)
+    if match:
+        chapter, number = match.groups()
+        return f"GOPR{number}", int(chapter)
+    return None
+
+
+def _dji_recordings(paths: List[str]) -> List[Recording]:
+    """Chain consecutive DJI files whose start times continue the previous file."""
+    files = []
+    for path in paths:
+        match = DJI_FILE.match(os.path.basename(path))
+        files.append((match.group(3).upper(), int(match.group(2)),
+                      datetime.strptime(match.group(1), DJI_TIME_FORMAT), path))
+    files.sort()
+
+    recordings: List[Recording] = []
+    previous = None
+    for suffix, number, start, path in files:
+        if previous is not None:
+            prev_suffix, prev_number, prev_start, prev_duration = previous
+            continues = (suffix == prev_suffix and number == prev_number + 1 and prev_duration
+                         and abs((start - prev_start).total_seconds() - prev_duration)
+                         <= DJI_GAP_SECONDS)
+            if continues:
+                recordings[-1].chapters.append(path)
+                previous = (suffix, number, start, _duration(path))
+                continue
+        recordings.append(Recording(os.path.splitext(os.path.basename(path))[0], [path]))
+        previous = (suffix, number, start, _duration(path))
+    return recordings
+
+
+def _duration(path: str) -> Optional[float]:
+    try:
+        return read_metadata(path).duration
+    except (OSError, IndexError, OverflowError, Mp4Error, struct.error) as e:
+        logger.debug("Could not read duration of %s: %s", path, e)
+        return None
+
+
+def group_recordings(paths: List[str]) -> List[Recording]:
+    """Group chapter files into recordings.
+
+    GoPro chapters are grouped by file number and ordered by chapter number. DJI
+    files are joined when their numbers are consecutive and each starts where the
+    previous one ended. Any other file is a recording of its own.
+
+    Args:
+        paths (List[str]): The video files, in any order.
+
+    Returns:
+        List[Recording]: The recordings, ordered by their first file name.
+    """
+    gopro: Dict[str, List[Tuple[int, str]]] = {}
+    dji = []
+    recordings = []
+    for path in paths:
+        filename = os.path.basename(path)
+        key = chapter_key(filename)
+        if key is not None:
+            gopro.setdefault(key[0], []).append((key[1], path))
+        elif DJI_FILE.match(filename):
+            dji.append(path)
+        else:
+            recordings.append(Recording(os.path.splitext(filename)[0], [path]))
+
+    for name, chapters in gopro.items():
+        recordings.append(Recording(name, [path for _, path in sorted(chapters)]))
+    recordings.extend(_dji_recordings(dji))
+    recordings.sort(key=lambda recording: os.path.basename(recording.chapters[0]).upper())
+    logger.info("Grouped %d files into %d recordings", len(paths), len(recordings))
+    return recordings
@@ -0,0 +1,225 @@
+"""Module to run the commands from the command line, without menus, prompts or dialogs.
+
+Usage:
+    python src/cli.py import [SOURCE ...] [--output DIR] [--organize] [--delete-source]
+    python src/cli.py organize [DIR] [--dry-run] [--incremental]
+    python src/cli.py concat [--input DIR] [--output DIR] [--chapters | --reencode] [FILE ...]
+    python src/cli.py settings [KEY [VALUE]]
+
+Directories default to the input_directory and output_directory settings. The
+modules behind each command are only imported when that command runs, so
+`--help` and argument errors return at once.
+"""
+
+# pylint: disable=import-outside-toplevel
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_INTERRUPTED = 130
+
+
+def _fail(message: str) -> int:
+    print(f"Error: {message}", file=sys.stderr)
+    return EXIT_ERROR
+
+
+def _directory(value: Optional[str], config_key: str, directory_type: str) -> Optional[str]:
+    """Get a directory from the command line or the configuration, if it exists."""
+    from config import get_config_value
+    directory = value or get_config_value(config_key)
+    if not directory:
+        _fail(f"No {directory_type} directory given and {config_key} is not set.")
+        return None
+    if not os.path.isdir(directory):
+        _fail(f"The {directory_type} directory '{directory}' does not exist.")
+        return None
+    return directory
+
+
+def run_import(args: argparse.Namespace) -> int:
+    """Import the clips of one or more source directories."""
+    sources = args.sources or [_directory(None, 'input_directory', 'input')]
+    if not all(sources):
+        return EXIT_ERROR
+    missing = [source for source in sources if not os.path.isdir(source)]
+    if missing:
+        return _fail(f"Source directory does not exist: {', '.join(missing)}")
+    output_directory = _directory(args.output, 'output_directory', 'output')
+    if not output_directory:
+        return EXIT_ERROR
+
+    from rich.console import Console
+    from video_import import ImportSettings, import_videos
+    import_videos(sources, Console(), organize_by_date=args.organize,
+                  settings=ImportSettings(resume=args.resume, verify=args.verify,
+                                          delete_source=args.delete_source,
+                                          output_directory=output_directory))
+    return EXIT_OK
+
+
+def run_organize(args: argparse.Namespace) -> int:
+    """Organize the clips of a directory into folders by date."""
+    directory = _directory(args.directory, 'output_directory', 'output')
+    if not directory:
+        return EXIT_ERROR
+
+    from rich.console import Console
+    from organize import organize_videos_by_date
+    plan = organize_videos_by_date(directory, dry_run=args.dry_run, console=Console(),
+                                   incremental=args.incremental)
+    if plan is None:
+        return EXIT_ERROR
+    if not args.dry_run:
+        print(f"Moved {len(plan.moves)} files in {directory}.")
+    if plan.conflicts:
+        print(f"Left {len(plan.conflicts)} files in place because their date folder already has "
+              "a file of the same name.", file=sys.stderr)
+    return EXIT_OK
+
+
+def run_concat(args: argparse.Namespace) -> int:
+    """Join clips losslessly, join every recording's chapters, or re-encode clips into one file."""
+    input_directory = _directory(args.input, 'input_directory', 'input')
+    output_directory = _directory(args.output, 'output_directory', 'output')
+    if not input_directory or not output_directory:
+        return EXIT_ERROR
+    video_files = [os.path.abspath(path) for path in args.files] or None
+    missing = [path for path in video_files or [] if not os.path.isfile(path)]
+    if missing:
+        return _fail(f"File does not exist: {', '.join(missing)}")
+
+    if args.chapters:
+        from video_append import batch_concat
+        written = batch_concat(input_directory, output_directory, workers=args.workers)
+        print(f"Joined {len(written)} recordings into {output_directory}.")
+    elif args.reencode:
+        from video_append import reencode_videos
+        from encode import EncodeOptions
+        output_file = reencode_videos(input_directory, output_directory, video_files=video_files,
+                                      options=EncodeOptions(codec=args.codec, crf=args.crf,
+                                                            workers=args.workers))
+        if not output_file:
+            return _fail(f"No video files found in {input_directory}.")
+        print(f"Re-encoded video saved to {output_file}.")
+    else:
+        from video_append import run_ffmpeg
+        run_ffmpeg(input_directory, output_directory, False, video_files=video_files)
+    return EXIT_OK
+
+
+def run_settings(args: argparse.Namespace) -> int:
+    """List the settings, print one, or change one."""
+    from config import config, get_config_value, save_config
+    if args.key is None:
+        for key, value in config['DEFAULT'].items():
+            print(f"{key} = {value}")
+    elif args.value is None:
+        if args.key not in config['DEFAULT']:
+            return _fail(f"{args.key} is not set.")
+        print(get_config_value(args.key))
+    else:
+        save_config(args.key, args.value)
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser of the command line interface."""
+    parser = argparse.ArgumentParser(prog="actioncam",
+                                     description="Import, organize and join action camera footage.")
+    parser.add_argument('--log-level',
+                        help="the log level, e.g. DEBUG or WARNING; overrides log_level")
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    import_parser = subparsers.add_parser('import',
+                                          help="import clips into the output directory")
+    import_parser.add_argument('sources', nargs='*', metavar='SOURCE',
+                               help="source directories (default: input_directory)")
+    import_parser.add_argument('-o', '--output',
+                               help="the output directory (default: output_directory)")
+    import_parser.add_argument('--organize', action='store_true',
+                               help="organize the output directory by date first")
+    import_parser.add_argument('--delete-source', action='store_true',
+                               help="move the clips instead of copying them")
+    import_parser.add_argument('--verify', action='store_true', default=None,
+                               help="verify each copy before deleting its source "
+                                    "(default: verify_imports)")
+    import_parser.add_argument('--no-resume', dest='resume', action='store_false',
+                               help="start over instead of resuming an interrupted import")
+    import_parser.set_defaults(handler=run_import)
+
+    organize_parser = subparsers.add_parser('organize',
+                                            help="sort clips into folders by capture date")
+    organize_parser.add_argument('directory', nargs='?',
+                                 help="the directory (default: output_directory)")
+    organize_parser.add_argument('-n', '--dry-run', action='store_true',
+                                 help="print the planned moves without moving anything")
+    organize_parser.add_argument('--incremental', action='store_true',
+                                 help="walk the whole tree, looking only at what changed since "
+                                      "the last run")
+    organize_parser.set_defaults(handler=run_organize)
+
+    concat_parser = subparsers.add_parser('concat', help="join clips into one file")
+    concat_parser.add_argument('files', nargs='*', metavar='FILE',
+                               help="the clips in order "
+                                    "(default: every clip in the input directory)")
+    concat_parser.add_argument('-i', '--input',
+                               help="the input directory (default: input_directory)")
+    concat_parser.add_argument('-o', '--output',
+                               help="the output directory (default: output_directory)")
+    mode = concat_parser.add_mutually_exclusive_group()
+    mode.add_argument('--chapters', action='store_true',
+                      help="join the chapters of every recording into its own file")
+    mode.add_argument('--reencode', action='store_true',
+                      help="re-encode the clips, for clips that cannot be joined losslessly")
+    concat_parser.add_argument('--codec', choices=['libx264', 'libx265'],
+                               help="the codec to re-encode with (default: encode_codec)")
+    concat_parser.add_argument('--crf', type=int,
+                               help="the quality to re-encode at (default: encode_crf)")
+    concat_parser.add_argument('-j', '--workers', type=int, help="the number of jobs run at once")
+    concat_parser.set_defaults(handler=run_concat)
+
+    settings_parser = subparsers.add_parser('settings', help="list, print or change settings")
+    settings_parser.add_argument('key', nargs='?', help="the setting to print or change")
+    settings_parser.add_argument('value', nargs='?', help="the new value")
+    settings_parser.set_defaults(handler=run_settings)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run a command given on the command line.
+
+    Args:
+        argv (Optional[List[str]]): The arguments. Defaults to sys.argv.
+
+    Returns:
+        int: The exit status: 0 on success, 1 on errors, 130 when interrupted.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'concat' and (args.codec or args.crf is not None) and not args.reencode:
+        parser.error("--codec and --crf require --reencode")
+
+    from config import load_config
+    from logging_setup import configure_logging, setup_logger
+    load_config()
+    if args.log_level:
+        configure_logging(args.log_level)
+    logger = setup_logger(__name__)
+    logger.info("Running command: %s", args.command)
+    try:
+        return args.handler(args)
+    except KeyboardInterrupt:
+        print("Interrupted.", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("Error running %s: %s", args.command, e, exc_info=True)
+        return _fail(str(e))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,26 @@
 """Module containing command handling functions."""
 
 import os
+from datetime import datetime, timedelta
+import ffmpeg
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
+from catalog import ClipFilter, MediaCatalog, print_entries
 from config import get_config_value, save_config
+from ffmpeg_job import JobCancelled
 from logging_setup import setup_logger
 from organize import organize_videos_by_date
-from utils import change_directory, check_directory_exists
-from video_append import run_ffmpeg
+from keyframes import parse_timestamp, trim_clip
+from mp4 import Mp4Error
+from utils import change_directory, check_directory_exists, get_unique_filename
+from video_append import (
+    batch_concat,
+    open_output_directory,
+    reencode_videos,
+    run_ffmpeg,
+    select_files,
+)
 from video_import import import_videos, select_directory
 
 console = Console()
@@ -16,6 +28,10 @@ logger = setup_logger(__name__)
 
 breadcrumb_path = ["Main Menu"]
 
+# What a video job raises when ffmpeg fails, a file cannot be read or is not a
+# well-formed clip, or the job is cancelled
+_JOB_ERRORS = (ffmpeg.Error, OSError, ValueError, JobCancelled)
+
 
 def update_breadcrumb(action: str) -> None:
     """Update the breadcrumb path with the current action.
@@ -47,7 +63,7 @@ def get_directory(config_key: str, directory_type: str) -> str:
     directory = get_config_value(config_key)
     if not directory or not check_directory_exists(directory, directory_type):
         console.print(
-            f"No valid {directory_type} directory set. Please select option 3 to set the {directory_type} directory.", style="bold red")
+            f"No valid {directory_type} directory set. Please select option 4 to set the {directory_type} directory.", style="bold red")
         return ""
     return directory
 
@@ -85,9 +101,13 @@ def handle_concatenate_videos() -> None:
         console.print(
             "1. Select specific video files through the native file browser")
         console.print("2. Automatically append all video files")
-        console.print("3. Back to main menu")
+        console.print("3. Join the chapters of every recording in the input directory")
+        console.print("4. Trim a clip without re-encoding")
+        console.print("5. Re-encode all video files into one file")
+        console.print("6. Join clips found in the media catalog")
+        console.print("7. Back to main menu")
 
-        choice = Prompt.ask("Enter your choice", choices=["1", "2", "3"])
+        choice = Prompt.ask("Enter your choice", choices=["1", "2", "3", "4", "5", "6", "7"])
 
         if choice == "1":
             update_breadcrumb("Select Specific Files")
@@ -103,6 +123,22 @@ def handle_concatenate_videos() -> None:
             handle_automatic_append(output_directory)
             break
         elif choice == "3":
+            handle_join_chapters(input_directory, output_directory)
+            break
+        elif choice == "4":
+            update_breadcrumb("Trim Clip")
+            handle_trim_clip(output_directory)
+            breadcrumb_path.pop()
+            break
+        elif choice == "5":
+            handle_reencode_videos(input_directory, output_directory)
+            break
+        elif choice == "6":
+            update_breadcrumb("Join Catalog Clips")
+            handle_catalog_join(input_directory, output_directory)
+            breadcrumb_path.pop()
+            break
+        elif choice == "7":
             breadcrumb_path.pop()
             break
 
@@ -111,6 +147,125 @@ def handle_concatenate_videos() -> None:
     breadcrumb_path.pop()
     clear_screen()  # Clear the screen before returning to the main menu
 
+
+def handle_join_chapters(input_directory: str, output_directory: str) -> None:
+    """Handle joining the chapters of every recording in the input directory.
+
+    Args:
+        input_directory (str): The directory holding the chapters.
+        output_directory (str): The directory to write the joined recordings to.
+    """
+    update_breadcrumb("Join Chapters")
+    try:
+        written = batch_concat(input_directory, output_directory)
+        console.print(f"Joined {len(written)} recordings into {output_directory}.",
+                      style="bold green")
+    except _JOB_ERRORS as e:
+        logger.error("Error joining chapters: %s", e, exc_info=True)
+        console.print("An error occurred while joining chapters.", style="bold red")
+    breadcrumb_path.pop()
+
+
+def handle_reencode_videos(input_directory: str, output_directory: str) -> None:
+    """Handle re-encoding all video files of the input directory into one file.
+
+    Args:
+        input_directory (str): The directory holding the video files.
+        output_directory (str): The directory to write the re-encoded file to.
+    """
+    update_breadcrumb("Re-encode Videos")
+    try:
+        output_file = reencode_videos(input_directory, output_directory)
+        if output_file:
+            console.print(f"Re-encoded video saved to {output_file}.", style="bold green")
+    except _JOB_ERRORS as e:
+        logger.error("Error re-encoding videos: %s", e, exc_info=True)
+        console.print(f"An error occurred while re-encoding: {e}", style="bold red")
+    breadcrumb_path.pop()
+
+
+def handle_trim_clip(output_directory: str) -> None:
+    """Handle cutting the start and end off a clip on keyframes.
+
+    Args:
+        output_directory (str): The directory to write the trimmed clip to.
+    """
+    selected = select_files("Select a Video File to Trim")
+    if not selected:
+        console.print("No file selected.", style="bold red")
+        return
+    source = selected[0]
+    try:
+        start = parse_timestamp(Prompt.ask(
+            "Start time (seconds or HH:MM:SS, empty for the beginning)", default=""))
+        end = parse_timestamp(Prompt.ask(
+            "End time (seconds or HH:MM:SS, empty for the end)", default=""))
+    except ValueError as e:
+        console.print(f"Invalid time: {e}", style="bold red")
+        return
+    base_name = os.path.splitext(os.path.basename(source))[0] + "_trim"
+    destination = os.path.join(output_directory,
+                               get_unique_filename(output_directory, base_name, "mp4"))
+    try:
+        kept_start, _ = trim_clip(source, destination, (start, end))
+        console.print(f"Trimmed clip saved to {destination} (starting on the keyframe at "
+                      f"{kept_start or 0:.2f}s).", style="bold green")
+    except _JOB_ERRORS as e:
+        logger.error("Error trimming %s: %s", source, e, exc_info=True)
+        console.print(f"An error occurred while trimming: {e}", style="bold red")
+
+
+def handle_catalog_join(input_directory: str, output_directory: str) -> None:
+    """Handle joining the clips that match a query of the media catalog.
+
+    Args:
+        input_directory (str): The input directory, refreshed in the catalog first.
+        output_directory (str): The output directory, refreshed in the catalog first.
+    """
+    catalog = MediaCatalog()
+    try:
+        with console.status("Updating the media catalog..."):
+            for directory in (input_directory, output_directory):
+                catalog.refresh(directory)
+        cameras = catalog.cameras()
+        if cameras:
+            console.print(f"Cameras in the catalog: {', '.join(cameras)}")
+        camera = Prompt.ask("Camera (empty for any)", default="").strip() or None
+        try:
+            since = Prompt.ask("Shot on or after (YYYY-MM-DD, empty for any)", default="").strip()
+            until = Prompt.ask("Shot on or before (YYYY-MM-DD, empty for any)", default="").strip()
+            min_height = Prompt.ask("Minimum height in pixels, e.g. 2160 for 4K (empty for any)",
+                                    default="").strip()
+            min_duration = parse_timestamp(Prompt.ask(
+                "Minimum duration (seconds or HH:MM:SS, empty for any)", default=""))
+            entries = catalog.query(ClipFilter(
+                camera=camera,
+                since=datetime.strptime(since, '%Y-%m-%d') if since else None,
+                until=datetime.strptime(until, '%Y-%m-%d') + timedelta(days=1) if until else None,
+                min_height=int(min_height) if min_height else None,
+                min_duration=min_duration))
+        except ValueError as e:
+            console.print(f"Invalid value: {e}", style="bold red")
+            return
+    finally:
+        catalog.close()
+
+    entries = [entry for entry in entries if os.path.exists(entry.path)]
+    if not entries:
+        console.print("No clips match.", style="bold yellow")
+        return
+    print_entries(entries, console)
+    answer = Prompt.ask(f"Join these {len(entries)} clips in this order?", choices=["yes", "no"])
+    if answer == "yes":
+        try:
+            if run_ffmpeg(input_directory, output_directory, False,
+                          video_files=[entry.path for entry in entries]):
+                open_output_directory(output_directory)
+        except _JOB_ERRORS as e:
+            logger.error("Error joining catalog clips: %s", e, exc_info=True)
+            console.print(f"An error occurred while joining clips: {e}", style="bold red")
+
+
 def handle_automatic_append(output_directory: str) -> None:
     """Handle the automatic appending of video files."""
     while True:
@@ -153,7 +308,8 @@ def run_ffmpeg_with_error_handling(input_directory: str, output_directory: str,
         select_files_option (bool): Whether to select specific files.
     """
     try:
-        run_ffmpeg(input_directory, output_directory, select_files_option)
+        if run_ffmpeg(input_directory, output_directory, select_files_option):
+            open_output_directory(output_directory)
         console.print("FFmpeg script has been run successfully.",
                       style="bold green")
         console.print("Press Enter to go back to the main menu...")
@@ -164,6 +320,32 @@ def run_ffmpeg_with_error_handling(input_directory: str, output_directory: str,
         logger.error("Error running FFmpeg: %s", e, exc_info=True)
 
 
+def handle_extract_telemetry() -> None:
+    """Handle extracting the GPS, accelerometer and gyro telemetry of selected clips."""
+    clear_screen()
+    update_breadcrumb("Extract Telemetry")
+    output_directory = get_directory('output_directory', 'output')
+    if not output_directory:
+        breadcrumb_path.pop()
+        return
+    selected = select_files("Select Video Files to Extract Telemetry From")
+    if not selected:
+        console.print("No files selected.", style="bold red")
+        breadcrumb_path.pop()
+        return
+    from telemetry import export_telemetry  # pylint: disable=import-outside-toplevel
+    for source in selected:
+        try:
+            written = export_telemetry(source, output_directory)
+            console.print(f"Wrote {len(written)} telemetry files for {os.path.basename(source)}.",
+                          style="bold green")
+        except (OSError, Mp4Error) as e:
+            logger.error("Error extracting telemetry from %s: %s", source, e)
+            console.print(f"Could not extract telemetry from {os.path.basename(source)}: {e}",
+                          style="bold red")
+    breadcrumb_path.pop()
+
+
 def handle_transfer_videos() -> None:
     """Handle the transfer of video files from the input directory to the output directory."""
     clear_screen()
@@ -2,7 +2,7 @@
 
 import os
 from configparser import ConfigParser
-from logging_setup import setup_logger
+from logging_setup import DEFAULT_RATE_LIMIT, configure_logging, setup_logger
 
 logger = setup_logger(__name__)
 
@@ -12,14 +12,28 @@ config_file = os.path.join(os.path.dirname(
 config = ConfigParser()
 
 
+def get_state_path(filename: str) -> str:
+    """Get the path of a state file stored next to config.ini.
+
+    Args:
+        filename (str): The name of the state file.
+
+    Returns:
+        str: The full path of the state file.
+    """
+    return os.path.join(os.path.dirname(config_file), filename)
+
+
 def load_config() -> bool:
-    """Load the configuration file.
+    """Load the configuration file and apply its log_level and log_rate_limit settings.
 
     Returns:
         bool: True if the config file existed, False if it was created.
     """
     if os.path.exists(config_file):
         config.read(config_file)
+        configure_logging(get_config_value('log_level'),
+                          get_config_int('log_rate_limit', DEFAULT_RATE_LIMIT))
         logger.info("Configuration loaded")
         return True
     else:
@@ -54,3 +68,41 @@ def get_config_value(key: str) -> str:
         str: The configuration value.
     """
     return config['DEFAULT'].get(key, '')
+
+
+def get_config_int(key: str, default: int) -> int:
+    """Get an integer value from the configuration file.
+
+    Args:
+        key (str): The configuration key.
+        default (int): The value to use when the key is missing or invalid.
+
+    Returns:
+        int: The configuration value.
+    """
+    value = get_config_value(key)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning("Invalid integer for %s: %s. Using %d.", key, value, default)
+        return default
+
+
+def get_config_bool(key: str, default: bool) -> bool:
+    """Get a yes/no value from the configuration file.
+
+    Args:
+        key (str): The configuration key.
+        default (bool): The value to use when the key is missing or invalid.
+
+    Returns:
+        bool: The configuration value.
+    """
+    value = get_config_value(key).strip().lower()
+    if value in ('1', 'yes', 'true', 'on'):
+        return True
+    if value in ('0', 'no', 'false', 'off'):
+        return False
+    return default
@@ -0,0 +1,135 @@
+"""Module to remember imported clips so re-imports can skip them."""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from config import get_state_path
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+INDEX_FILENAME = "import_index.db"
+SAMPLE_SIZE = 2 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def fingerprint(path: str) -> str:
+    """Compute a cheap fingerprint from the size and the first and last few MB.
+
+    Args:
+        path (str): The file to fingerprint.
+
+    Returns:
+        str: The fingerprint as "<size>:<hex digest>".
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            f.seek(max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+            digest.update(f.read(SAMPLE_SIZE))
+    return f"{size}:{digest.hexdigest()}"
+
+
+def full_hash(path: str) -> str:
+    """Compute the SHA-256 of a whole file.
+
+    Args:
+        path (str): The file to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImportIndex:
+    """SQLite index of imported clips, keyed by fingerprint."""
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self.db_path = db_path or get_state_path(INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS clips ("
+            "fingerprint TEXT NOT NULL, filename TEXT NOT NULL, destination TEXT NOT NULL, "
+            "full_hash TEXT, imported_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS clips_fingerprint ON clips (fingerprint)")
+        self._conn.commit()
+
+    def find_duplicate(self, path: str, clip_fingerprint: str,
+                       confirm: bool = False) -> Optional[str]:
+        """Find an earlier import of the same clip.
+
+        A fingerprint match under the same filename is trusted as is, unless confirm
+        is set. Other matches are confirmed with a full hash of both files, which is
+        computed only then and cached for the imported copy. Earlier imports that
+        were since deleted or moved away are forgotten, so the clip is imported again.
+
+        Args:
+            path (str): The clip about to be imported.
+            clip_fingerprint (str): The fingerprint of the clip.
+            confirm (bool): Whether to confirm same-name matches with a full hash too,
+                for when the clip will be deleted because a copy exists.
+
+        Returns:
+            Optional[str]: The destination of the earlier import, or None.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, filename, destination, full_hash FROM clips WHERE fingerprint = ?",
+                (clip_fingerprint,)).fetchall()
+        filename = os.path.basename(path)
+        candidate_hash = None
+        for rowid, imported_name, destination, imported_hash in rows:
+            if not os.path.exists(destination):
+                logger.info("Forgetting the import of %s as %s, which no longer exists",
+                            imported_name, destination)
+                with self._lock:
+                    self._conn.execute("DELETE FROM clips WHERE rowid = ?", (rowid,))
+                    self._conn.commit()
+                continue
+            if imported_name == filename and not confirm:
+                return destination
+            if imported_hash is None:
+                imported_hash = full_hash(destination)
+                with self._lock:
+                    self._conn.execute("UPDATE clips SET full_hash = ? WHERE rowid = ?",
+                                       (imported_hash, rowid))
+                    self._conn.commit()
+            if candidate_hash is None:
+                candidate_hash = full_hash(path)
+            if candidate_hash == imported_hash:
+                return destination
+        return None
+
+    def record(self, clip_fingerprint: str, filename: str, destination: str,
+               clip_hash: Optional[str] = None) -> None:
+        """Record a finished import.
+
+        Args:
+            clip_fingerprint (str): The fingerprint of the source clip.
+            filename (str): The original filename of the clip.
+            destination (str): Where the clip was imported to.
+            clip_hash (Optional[str]): The SHA-256 of the clip, if already known.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO clips (fingerprint, filename, destination, full_hash, imported_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (clip_fingerprint, filename, destination, clip_hash, time.time()))
+            self._conn.commit()
+        logger.debug("Recorded import of %s as %s", filename, destination)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,197 @@
+"""Module to re-encode footage in keyframe-aligned segments on many cores at once."""
+
+import os
+import struct
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional
+import ffmpeg
+from config import get_config_int, get_config_value
+from ffmpeg_job import FFmpegJob, hwaccel_input_args
+from keyframes import get_keyframes
+from logging_setup import setup_logger
+from mp4 import Mp4Error
+from probe import StreamInfo
+
+logger = setup_logger(__name__)
+
+DEFAULT_CODEC = 'libx264'
+DEFAULT_PRESET = 'medium'
+DEFAULT_CRF = {'libx264': 23, 'libx265': 28}
+DEFAULT_ENCODE_THREADS = 4
+DEFAULT_SEGMENT_SECONDS = 60
+SUPPORTED_CODECS = ('libx264', 'libx265')
+
+
+class Segment(NamedTuple):
+    """A part of a clip that is encoded on its own.
+
+    Attributes:
+        path (str): The clip.
+        start (float): The start in seconds; always a keyframe.
+        end (Optional[float]): The end in seconds, or None for the end of the clip.
+    """
+    path: str
+    start: float
+    end: Optional[float]
+
+
+class EncodeSettings(NamedTuple):
+    """How segments are encoded.
+
+    Attributes:
+        codec (str): libx264 or libx265.
+        crf (int): The constant rate factor.
+        preset (str): The encoder preset.
+        threads (int): The encoder threads of each ffmpeg process.
+        width (Optional[int]): The output width; None keeps each clip's size.
+        height (Optional[int]): The output height.
+        frame_rate (Optional[str]): The output frame rate as a fraction.
+    """
+    codec: str
+    crf: int
+    preset: str
+    threads: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frame_rate: Optional[str] = None
+
+
+class EncodeOptions(NamedTuple):
+    """What a caller chose for a re-encode; None falls back to the encode_* settings.
+
+    Attributes:
+        codec (Optional[str]): libx264 or libx265.
+        crf (Optional[int]): The quality.
+        workers (Optional[int]): The number of segments encoded at once.
+    """
+    codec: Optional[str] = None
+    crf: Optional[int] = None
+    workers: Optional[int] = None
+
+
+def encode_settings(target: Optional[StreamInfo] = None, codec: Optional[str] = None,
+                    crf: Optional[int] = None) -> EncodeSettings:
+    """Build encode settings from arguments and the encode_* settings in config.ini.
+
+    Args:
+        target (Optional[StreamInfo]): A clip whose size and frame rate every segment is
+            scaled and padded to, so mismatched clips can be joined.
+        codec (Optional[str]): The encoder. Defaults to the encode_codec setting.
+        crf (Optional[int]): The quality. Defaults to the encode_crf setting.
+
+    Returns:
+        EncodeSettings: The settings.
+
+    Raises:
+        ValueError: If the codec is not supported.
+    """
+    codec = codec or get_config_value('encode_codec') or DEFAULT_CODEC
+    if codec not in SUPPORTED_CODECS:
+        raise ValueError(f"Unsupported encoder {codec}; use one of {', '.join(SUPPORTED_CODECS)}")
+    return EncodeSettings(
+        codec=codec,
+        crf=crf if crf is not None else get_config_int('encode_crf', DEFAULT_CRF[codec]),
+        preset=get_config_value('encode_preset') or DEFAULT_PRESET,
+        threads=max(1, get_config_int('encode_threads', DEFAULT_ENCODE_THREADS)),
+        width=target.width if target else None,
+        height=target.height if target else None,
+        frame_rate=target.frame_rate if target else None,
+    )
+
+
+def default_workers(threads: int) -> int:
+    """The number of segments encoded at once: enough processes to fill every core."""
+    return get_config_int('encode_workers', max(1, (os.cpu_count() or 1) // max(1, threads)))
+
+
+def plan_segments(video_files: List[str], segment_seconds: Optional[float] = None) -> List[Segment]:
+    """Split clips into segments that start on keyframes.
+
+    Each clip is cut at the first keyframe after every segment_seconds, so no
+    segment has to decode frames before its start. Clips that cannot be indexed
+    are encoded as a single segment.
+
+    Args:
+        video_files (List[str]): The clips, in order.
+        segment_seconds (Optional[float]): The target segment length. Defaults to the
+            encode_segment_seconds setting.
+
+    Returns:
+        List[Segment]: The segments, in order.
+    """
+    segment_seconds = segment_seconds or get_config_int('encode_segment_seconds',
+                                                        DEFAULT_SEGMENT_SECONDS)
+    segments = []
+    for path in video_files:
+        try:
+            index = get_keyframes(path)
+        except (OSError, Mp4Error, struct.error) as e:
+            logger.info("Encoding %s as one segment: %s", path, e)
+            segments.append(Segment(path, 0.0, None))
+            continue
+        cuts = [0.0]
+        target = segment_seconds
+        while target < index.duration:
+            cut = index.keyframe_after(target)
+            if cut >= index.duration:
+                break
+            if cut > cuts[-1]:
+                cuts.append(cut)
+            target = cut + segment_seconds
+        segments.extend(Segment(path, start, end) for start, end in zip(cuts, cuts[1:] + [None]))
+    logger.info("Planned %d segments for %d clips", len(segments), len(video_files))
+    return segments
+
+
+def _video_filter(stream, settings: EncodeSettings):
+    if settings.width and settings.height:
+        stream = stream.filter('scale', settings.width, settings.height,
+                               force_original_aspect_ratio='decrease', force_divisible_by=2)
+        stream = stream.filter('pad', settings.width, settings.height, '(ow-iw)/2', '(oh-ih)/2')
+    if settings.frame_rate:
+        stream = stream.filter('fps', settings.frame_rate)
+    return stream.filter('format', 'yuv420p')
+
+
+def encode_segment(segment: Segment, destination: str, settings: EncodeSettings,
+                   cancel_event: Optional[threading.Event] = None,
+                   progress: Optional[Callable[[float], None]] = None) -> None:
+    """Encode the video of one segment.
+
+    Audio is left out; it is encoded once for the whole timeline so that no
+    encoder priming gaps end up at segment boundaries.
+
+    Raises:
+        ffmpeg.Error: If ffmpeg fails.
+        JobCancelled: If the encode is cancelled or times out.
+    """
+    input_args = {'ss': segment.start} if segment.start else {}
+    if segment.end is not None:
+        input_args['t'] = segment.end - segment.start
+    input_args.update(hwaccel_input_args())
+    video = _video_filter(ffmpeg.input(segment.path, **input_args).video, settings)
+    output_args: Dict[str, object] = {
+        'vcodec': settings.codec, 'crf': settings.crf, 'preset': settings.preset,
+        'threads': settings.threads,
+    }
+    if settings.codec == 'libx265':
+        output_args['x265-params'] = f"pools={settings.threads}:log-level=error"
+    stream = ffmpeg.output(video, destination, **output_args)
+    FFmpegJob(stream, os.path.basename(destination), cancel_event=cancel_event,
+              progress=progress).run()
+
+
+def encode_audio(video_files: List[str], destination: str,
+                 cancel_event: Optional[threading.Event] = None,
+                 progress: Optional[Callable[[float], None]] = None) -> None:
+    """Encode the audio of all clips, one after another, into a single AAC file.
+
+    Raises:
+        ffmpeg.Error: If ffmpeg fails.
+        JobCancelled: If the encode is cancelled or times out.
+    """
+    audio = [ffmpeg.input(path).audio for path in video_files]
+    joined = ffmpeg.concat(*audio, v=0, a=1) if len(audio) > 1 else audio[0]
+    stream = ffmpeg.output(joined, destination, acodec='aac', audio_bitrate='192k')
+    FFmpegJob(stream, os.path.basename(destination), cancel_event=cancel_event,
+              progress=progress).run()
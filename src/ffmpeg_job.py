@@ -0,0 +1,312 @@
+"""Module to run ffmpeg jobs with live progress, cancellation and timeouts."""
+
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+from typing import Any, Callable, Dict, List, Optional
+import ffmpeg
+from tqdm import tqdm
+from config import get_config_int, get_config_value, get_state_path
+from logging_setup import setup_logger
+from metrics import span
+
+logger = setup_logger(__name__)
+
+CAPABILITIES_FILENAME = "ffmpeg_capabilities.json"
+STDERR_LINES = 50
+POLL_SECONDS = 0.5
+TERMINATE_GRACE_SECONDS = 5
+
+
+class JobCancelled(Exception):
+    """Raised when an ffmpeg job is cancelled before it finishes."""
+
+
+class JobTimeout(JobCancelled):
+    """Raised when an ffmpeg job runs longer than its timeout."""
+
+
+def _ffmpeg_identity() -> Optional[Dict[str, object]]:
+    """The path, size and mtime of the ffmpeg binary on the PATH."""
+    path = shutil.which('ffmpeg')
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    stat_result = os.stat(path)
+    return {'path': path, 'size': stat_result.st_size, 'mtime': stat_result.st_mtime_ns}
+
+
+_hwaccels_lock = threading.Lock()
+_hwaccels: Optional[List[str]] = None  # pylint: disable=invalid-name
+
+
+def available_hwaccels() -> List[str]:
+    """List the hardware acceleration methods the installed ffmpeg supports.
+
+    The result of `ffmpeg -hwaccels` is cached in memory and in a state file next to
+    config.ini, keyed by the ffmpeg binary's path, size and mtime, so ffmpeg is only
+    asked again after it is upgraded.
+
+    Returns:
+        List[str]: The method names, e.g. ["cuda", "vaapi"]. Empty if ffmpeg is missing.
+    """
+    global _hwaccels  # pylint: disable=global-statement
+    with _hwaccels_lock:
+        if _hwaccels is not None:
+            return _hwaccels
+        identity = _ffmpeg_identity()
+        if identity is None:
+            _hwaccels = []
+            return _hwaccels
+        cache_path = get_state_path(CAPABILITIES_FILENAME)
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('ffmpeg') == identity:
+                _hwaccels = cached['hwaccels']
+                return _hwaccels
+        except (OSError, ValueError, KeyError):
+            pass
+        try:
+            output = subprocess.run([identity['path'], '-hide_banner', '-hwaccels'],
+                                    capture_output=True, text=True, timeout=10, check=True).stdout
+            _hwaccels = [line.strip() for line in output.splitlines()[1:] if line.strip()]
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("Could not list ffmpeg hardware acceleration methods: %s", e)
+            _hwaccels = []
+            return _hwaccels
+        logger.info("ffmpeg hardware acceleration methods: %s", _hwaccels)
+        try:
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'ffmpeg': identity, 'hwaccels': _hwaccels}, f)
+        except OSError as e:
+            logger.warning("Could not cache ffmpeg capabilities: %s", e)
+        return _hwaccels
+
+
+_devices_lock = threading.Lock()
+_devices: Dict[str, bool] = {}
+
+
+def hwaccel_device_works(method: str) -> bool:
+    """Check once per run that ffmpeg can open a device for a hardware acceleration method.
+
+    `ffmpeg -hwaccels` lists what ffmpeg was built with, not what the machine has:
+    a cuda build on a machine without an NVIDIA GPU fails every job that asks for it.
+    """
+    with _devices_lock:
+        if method not in _devices:
+            try:
+                subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error',
+                                '-init_hw_device', method, '-f', 'lavfi', '-i', 'nullsrc',
+                                '-frames:v', '1', '-f', 'null', '-'],
+                               stdin=subprocess.DEVNULL, capture_output=True, timeout=10,
+                               check=True)
+                _devices[method] = True
+            except (OSError, subprocess.SubprocessError):
+                logger.info("No %s device could be opened. Decoding on the CPU.", method)
+                _devices[method] = False
+        return _devices[method]
+
+
+def hwaccel_input_args() -> Dict[str, str]:
+    """Get the input options for hardware decoding, if it is configured and available.
+
+    The method is taken from the hwaccel setting (default "cuda"; "none" disables it).
+    Decoded frames are copied back to system memory, so the CPU filters that follow
+    (scale, pad, fps) work unchanged.
+
+    Returns:
+        Dict[str, str]: Keyword arguments for ffmpeg.input, empty if the method is not supported.
+    """
+    method = get_config_value('hwaccel').strip().lower() or 'cuda'
+    if method == 'none':
+        return {}
+    if method not in available_hwaccels():
+        logger.debug("Hardware acceleration %s is not available. Decoding on the CPU.", method)
+        return {}
+    if not hwaccel_device_works(method):
+        return {}
+    return {'hwaccel': method}
+
+
+class FFmpegJob:
+    """A single ffmpeg run with a progress bar, a timeout and a cancel switch.
+
+    ffmpeg reports its progress as key=value blocks on stdout (`-progress pipe:1`).
+    Each block advances the bar by output time and shows the output bytes/s and
+    the speed relative to realtime. stderr is drained in the background and its
+    last lines are kept for the error message. A job that runs longer than the
+    ffmpeg_timeout_seconds setting is stopped; 0 means no limit.
+    """
+
+    def __init__(self, stream, description: str, duration: Optional[float] = None,
+                 cancel_event: Optional[threading.Event] = None,
+                 progress: Optional[Callable[[float], None]] = None) -> None:
+        """
+        Args:
+            stream: The ffmpeg-python output stream to run.
+            description (str): The label of the progress bar.
+            duration (Optional[float]): The expected output duration in seconds, used as
+                the progress bar total.
+            cancel_event (Optional[threading.Event]): Set it to stop the job.
+            progress (Optional[Callable[[float], None]]): Called with the seconds of output
+                written since the last call, instead of showing a progress bar. Used when
+                several jobs share one bar.
+        """
+        self.args = (stream.global_args('-progress', 'pipe:1', '-nostats')
+                     .overwrite_output().compile())
+        self.description = description
+        self.duration = duration
+        self.cancel_event = cancel_event or threading.Event()
+        self.progress = progress
+        self._out_time = 0.0
+        self._out_bytes = 0
+
+    def cancel(self) -> None:
+        """Ask the job to stop. The running call to run() raises JobCancelled."""
+        self.cancel_event.set()
+
+    def run(self) -> None:
+        """Run ffmpeg to completion.
+
+        Raises:
+            ffmpeg.Error: If ffmpeg exits with an error.
+            JobTimeout: If the job runs longer than its timeout.
+            JobCancelled: If the job is cancelled or interrupted with Ctrl+C.
+        """
+        with span('ffmpeg', output=self.description) as ffmpeg_span:
+            try:
+                self._run()
+            finally:
+                ffmpeg_span.add(self._out_bytes)
+
+    def _run(self) -> None:
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"{self.description} was cancelled")
+        logger.info("Running ffmpeg: %s", subprocess.list2cmdline(self.args))
+        # Not a with block: the job stops the process itself on cancel and reaps it,
+        # and closing its pipes on the way out would break the reader threads
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            self.args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        progress: "queue.Queue[Optional[Dict[str, str]]]" = queue.Queue()
+        stderr: deque = deque(maxlen=STDERR_LINES)
+        readers = [
+            threading.Thread(target=self._read_progress, args=(process.stdout, progress),
+                             daemon=True),
+            threading.Thread(target=self._read_stderr, args=(process.stderr, stderr), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        start = time.monotonic()
+        timeout = get_config_int('ffmpeg_timeout_seconds', 0)
+        deadline = start + timeout if timeout else None
+        total = round(self.duration, 1) if self.duration else None
+        quiet = self.progress is not None
+        try:
+            with tqdm(total=total, unit='s', desc=self.description, disable=quiet) as pbar:
+                while True:
+                    if self.cancel_event.is_set():
+                        raise JobCancelled(f"{self.description} was cancelled")
+                    if deadline and time.monotonic() > deadline:
+                        raise JobTimeout(f"{self.description} timed out after {timeout}s")
+                    try:
+                        block = progress.get(timeout=POLL_SECONDS)
+                    except queue.Empty:
+                        continue
+                    if block is None:
+                        break
+                    self._update(pbar, block, time.monotonic() - start)
+        except (JobCancelled, KeyboardInterrupt) as e:
+            self._stop(process)
+            logger.warning("Stopped ffmpeg: %s", str(e) or "interrupted")
+            if isinstance(e, KeyboardInterrupt):
+                raise JobCancelled(f"{self.description} was interrupted") from e
+            raise
+        returncode = process.wait()
+        for reader in readers:
+            reader.join()
+        logger.info("ffmpeg finished in %.1fs with exit code %d", time.monotonic() - start,
+                    returncode)
+        if returncode != 0:
+            raise ffmpeg.Error('ffmpeg', b'', '\n'.join(stderr).encode())
+
+    @staticmethod
+    def _read_progress(stdout, progress: "queue.Queue[Optional[Dict[str, str]]]") -> None:
+        block: Dict[str, str] = {}
+        for raw_line in stdout:
+            key, _, value = raw_line.decode('utf-8', 'replace').strip().partition('=')
+            block[key] = value
+            if key == 'progress':
+                progress.put(block)
+                block = {}
+        progress.put(None)
+
+    @staticmethod
+    def _read_stderr(stderr, lines: deque) -> None:
+        for raw_line in stderr:
+            lines.append(raw_line.decode('utf-8', 'replace').rstrip())
+
+    def _update(self, pbar: tqdm, block: Dict[str, str], elapsed: float) -> None:
+        try:
+            out_time = int(block['out_time_us']) / 1_000_000
+            total_size = int(block['total_size'])
+        except (KeyError, ValueError):
+            # Missing or "N/A" before the first packet is written
+            return
+        self._out_bytes = total_size
+        if self.duration:
+            out_time = min(out_time, round(self.duration, 1))
+        advanced = round(out_time, 1) - self._out_time
+        self._out_time += advanced
+        if self.progress is not None:
+            self.progress(advanced)
+            return
+        pbar.update(advanced)
+        rate = total_size / elapsed / 1e6 if elapsed else 0.0
+        pbar.set_postfix_str(f"{rate:.1f} MB/s, {block.get('speed', 'N/A').strip()}")
+
+    @staticmethod
+    def _stop(process: subprocess.Popen) -> None:
+        process.terminate()
+        try:
+            process.wait(timeout=TERMINATE_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def wait_cancellable(future: Future, cancel_event: threading.Event,
+                     on_cancel: Optional[Callable[[], None]] = None) -> Any:
+    """Wait for work running in other threads, turning Ctrl+C into a cancel request.
+
+    Only the main thread sees KeyboardInterrupt, so it sets the cancel event and
+    keeps waiting while the workers stop their ffmpeg processes.
+
+    Args:
+        future (Future): The work to wait for.
+        cancel_event (threading.Event): The event the workers watch.
+        on_cancel (Optional[Callable[[], None]]): Called when Ctrl+C is pressed.
+
+    Returns:
+        Any: The result of the future.
+
+    Raises:
+        JobCancelled: If the work was cancelled.
+    """
+    while True:
+        try:
+            return future.result(timeout=POLL_SECONDS)
+        except FuturesTimeout:
+            continue
+        except KeyboardInterrupt:
+            cancel_event.set()
+            if on_cancel:
+                on_cancel()
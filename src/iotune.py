@@ -0,0 +1,127 @@
+"""Module to tune file I/O for the devices involved in a transfer."""
+
+import errno
+import os
+import shutil
+from typing import List
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+CHUNK_SIZES = [256 * 1024, 512 * 1024, 1024 * 1024, 2 * 1024 * 1024, 4 * 1024 * 1024,
+               8 * 1024 * 1024, 16 * 1024 * 1024]
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+PROBE_BYTES = 32 * 1024 * 1024
+FREE_SPACE_MARGIN = 64 * 1024 * 1024
+
+
+class InsufficientSpaceError(OSError):
+    """Raised when a transfer will not fit on the destination."""
+
+
+class ChunkTuner:
+    """Picks a chunk size by measuring throughput at the start of a transfer.
+
+    Each candidate size is used for PROBE_BYTES while its throughput is measured.
+    The tuner climbs to larger sizes while throughput keeps improving. If the first
+    step up does not help, it tries smaller sizes instead, for devices that prefer
+    short requests. It settles on the fastest size it has seen, which is then used
+    for the rest of the file.
+    """
+
+    def __init__(self, initial: int = DEFAULT_CHUNK_SIZE) -> None:
+        self._start = CHUNK_SIZES.index(initial if initial in CHUNK_SIZES else DEFAULT_CHUNK_SIZE)
+        self._index = self._start
+        self._step = 1
+        self._rates: List[float] = [0.0] * len(CHUNK_SIZES)
+        self._bytes = 0
+        self._seconds = 0.0
+        self.settled = False
+
+    @property
+    def chunk_size(self) -> int:
+        """The chunk size to use for the next read."""
+        return CHUNK_SIZES[self._index]
+
+    def record(self, num_bytes: int, seconds: float) -> None:
+        """Record how long a chunk took to transfer.
+
+        Args:
+            num_bytes (int): The number of bytes in the chunk.
+            seconds (float): The time the read and write took.
+        """
+        if self.settled:
+            return
+        self._bytes += num_bytes
+        self._seconds += seconds
+        if self._bytes < PROBE_BYTES:
+            return
+        rate = self._bytes / self._seconds if self._seconds > 0 else float('inf')
+        self._rates[self._index] = rate
+        self._bytes = 0
+        self._seconds = 0.0
+        previous_index = self._index - self._step
+        previous = self._rates[previous_index] if 0 <= previous_index < len(CHUNK_SIZES) else 0.0
+        if rate > previous * 1.05 and 0 <= self._index + self._step < len(CHUNK_SIZES):
+            self._index += self._step
+            return
+        if self._step == 1 and self._index <= self._start + 1 and self._start > 0:
+            self._step = -1
+            self._index = self._start - 1
+            return
+        self._index = max(range(len(CHUNK_SIZES)),
+                          key=lambda i: (self._rates[i], -abs(i - self._start)))
+        self.settled = True
+        logger.debug("Settled on %d byte chunks (%.1f MB/s)", self.chunk_size,
+                     self._rates[self._index] / (1024 * 1024))
+
+
+def preallocate(fd: int, offset: int, length: int) -> None:
+    """Reserve space for the rest of a file so it is laid out contiguously.
+
+    Filesystems that cannot preallocate are left to grow the file as it is written.
+
+    Args:
+        fd (int): The destination file descriptor.
+        offset (int): Where the data still to be written starts.
+        length (int): The number of bytes still to be written.
+    """
+    if length <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, offset, length)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        logger.debug("Preallocation not supported: %s", e)
+
+
+def advise_sequential(fd: int) -> None:
+    """Tell the kernel a file will be read or written front to back."""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+def drop_cached(fd: int, offset: int, length: int) -> None:
+    """Drop pages that have already been copied from the page cache."""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+
+def check_free_space(directory: str, required_bytes: int) -> None:
+    """Fail before copying if the planned bytes will not fit in a directory.
+
+    Args:
+        directory (str): The destination directory.
+        required_bytes (int): The number of bytes that will be written.
+
+    Raises:
+        InsufficientSpaceError: If the free space is smaller than required.
+    """
+    free_bytes = shutil.disk_usage(directory).free
+    logger.info("%d bytes planned for %s, %d bytes free", required_bytes, directory, free_bytes)
+    if required_bytes + FREE_SPACE_MARGIN > free_bytes:
+        raise InsufficientSpaceError(
+            errno.ENOSPC,
+            f"Not enough space in {directory}: {required_bytes / 1024 ** 3:.1f} GB needed, "
+            f"{free_bytes / 1024 ** 3:.1f} GB free")
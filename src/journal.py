@@ -0,0 +1,140 @@
+"""Module to record import progress so interrupted imports can be resumed."""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Sequence
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+PARTIAL_SUFFIX = ".part"
+JOURNAL_PREFIX = ".import_"
+JOURNAL_SUFFIX = ".journal.json"
+
+
+def journal_path(input_directories: Sequence[str], output_directory: str) -> str:
+    """Get the journal path for an import from some directories into another.
+
+    Args:
+        input_directories (Sequence[str]): The directories videos are imported from.
+        output_directory (str): The directory videos are imported into.
+
+    Returns:
+        str: The journal file path inside the output directory.
+    """
+    sources = '\n'.join(sorted(os.path.abspath(directory) for directory in input_directories))
+    session = hashlib.sha1(sources.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(output_directory, f"{JOURNAL_PREFIX}{session}{JOURNAL_SUFFIX}")
+
+
+def partial_path(destination: str) -> str:
+    """Get the temporary name a file is written to before it is complete."""
+    return destination + PARTIAL_SUFFIX
+
+
+class ImportJournal:
+    """Completed files and partial byte offsets for one import session.
+
+    Entries are keyed by source path and remember the source size and mtime, so
+    a different file that reuses a name on a reformatted card is not resumed.
+    The journal file is replaced atomically on every write.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f).get('files', {})
+                logger.info("Loaded import journal %s with %d entries", path, len(self._entries))
+            except (OSError, ValueError) as e:
+                logger.warning("Ignoring unreadable import journal %s: %s", path, e)
+
+    @property
+    def has_entries(self) -> bool:
+        """Whether the journal holds progress from an earlier session."""
+        return bool(self._entries)
+
+    @staticmethod
+    def _identity(source: str) -> dict:
+        source_stat = os.stat(source)
+        return {'size': source_stat.st_size, 'mtime': source_stat.st_mtime_ns}
+
+    def _matching_entry(self, source: str) -> dict:
+        entry = self._entries.get(source)
+        if not entry:
+            return {}
+        identity = self._identity(source)
+        if entry.get('size') != identity['size'] or entry.get('mtime') != identity['mtime']:
+            return {}
+        return entry
+
+    def is_complete(self, source: str, destination: str) -> bool:
+        """Check whether a source file was already imported in full.
+
+        Args:
+            source (str): The source file path.
+            destination (str): The final destination path.
+
+        Returns:
+            bool: True if the journal and the destination agree the file is complete.
+        """
+        with self._lock:
+            entry = self._matching_entry(source)
+        return (entry.get('status') == 'done' and os.path.exists(destination)
+                and os.path.getsize(destination) == entry['size'])
+
+    def resume_offset(self, source: str, partial: str) -> int:
+        """Get the number of bytes of a partial file that can be kept.
+
+        Only bytes that were flushed to disk and recorded in the journal are kept;
+        anything the partial file holds beyond that offset is discarded.
+
+        Args:
+            source (str): The source file path.
+            partial (str): The temporary destination path.
+
+        Returns:
+            int: The byte offset to resume copying from.
+        """
+        with self._lock:
+            entry = self._matching_entry(source)
+        if not entry or not os.path.exists(partial):
+            return 0
+        return min(entry.get('offset', 0), os.path.getsize(partial))
+
+    def record_offset(self, source: str, offset: int) -> None:
+        """Record the number of bytes of a source file safely on disk."""
+        with self._lock:
+            entry = self._identity(source)
+            entry.update(status='partial', offset=offset)
+            self._entries[source] = entry
+            self._write()
+
+    def complete(self, source: str) -> None:
+        """Record that a source file has been fully imported."""
+        with self._lock:
+            entry = self._identity(source)
+            entry.update(status='done', offset=entry['size'])
+            self._entries[source] = entry
+            self._write()
+
+    def remove(self) -> None:
+        """Delete the journal once the session has finished."""
+        with self._lock:
+            self._entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        logger.info("Removed import journal %s", self.path)
+
+    def _write(self) -> None:
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self._entries}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
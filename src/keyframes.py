@@ -0,0 +1,228 @@
+"""Module to index the keyframes of clips and trim clips losslessly on keyframes."""
+
+import bisect
+import json
+import os
+import sqlite3
+import struct
+import threading
+from itertools import accumulate, chain, repeat
+from typing import List, NamedTuple, Optional, Tuple
+import ffmpeg
+from config import get_state_path
+from ffmpeg_job import FFmpegJob
+from logging_setup import setup_logger
+from mp4 import Mp4Error
+from mp4concat import Mp4Input, TrackTables
+
+logger = setup_logger(__name__)
+
+CACHE_FILENAME = "keyframe_cache.db"
+
+TrimRange = Tuple[Optional[float], Optional[float]]
+
+
+class KeyframeIndex(NamedTuple):
+    """The presentation times of the keyframes of a clip's video track.
+
+    Attributes:
+        times (List[float]): Keyframe times in seconds from the first frame, ascending.
+        duration (float): The duration of the video track in seconds.
+    """
+    times: List[float]
+    duration: float
+
+    def keyframe_before(self, seconds: float) -> float:
+        """The time of the last keyframe at or before a time, or 0."""
+        index = bisect.bisect_right(self.times, seconds + 1e-6) - 1
+        return self.times[index] if index >= 0 else 0.0
+
+    def keyframe_after(self, seconds: float) -> float:
+        """The time of the first keyframe at or after a time, or the end of the clip."""
+        index = bisect.bisect_left(self.times, seconds - 1e-6)
+        return self.times[index] if index < len(self.times) else self.duration
+
+
+def _expand(table, count: int) -> List[int]:
+    """Expand a (count, value) run-length table into one value per sample."""
+    pairs = zip(table[0::2], table[1::2])
+    return list(chain.from_iterable(repeat(value, run) for run, value in pairs))[:count]
+
+
+def index_track(track: TrackTables) -> KeyframeIndex:
+    """Build the keyframe index of a video track from its stss, stts and ctts tables."""
+    deltas = _expand(track.stts, track.sample_count)
+    decode_times = [0] + list(accumulate(deltas))[:-1]
+    if track.ctts is not None:
+        offsets = _expand(track.ctts, track.sample_count)
+        if track.ctts_version == 1:
+            offsets = [offset - (1 << 32) if offset & 0x80000000 else offset for offset in offsets]
+        presentation = [decode + offset for decode, offset in zip(decode_times, offsets)]
+    else:
+        presentation = decode_times
+    if not presentation:
+        return KeyframeIndex([], 0.0)
+    first = min(presentation)
+    sync = track.stss if track.stss is not None else range(1, len(presentation) + 1)
+    times = sorted((presentation[sample - 1] - first) / track.timescale
+                   for sample in sync if sample <= len(presentation))
+    return KeyframeIndex(times, track.media_duration / track.timescale)
+
+
+def build_index(path: str) -> KeyframeIndex:
+    """Read the keyframe index of a clip from its moov box.
+
+    Raises:
+        Mp4Error: If the clip is not a readable MP4 file or has no video track.
+    """
+    source = Mp4Input(path)
+    try:
+        video = next((track for track in source.tracks if track.handler == b'vide'), None)
+        if video is None:
+            raise Mp4Error(f"{path} has no video track")
+        return index_track(video)
+    finally:
+        source.close()
+
+
+class KeyframeCache:
+    """SQLite cache of keyframe indexes keyed by path, size and mtime."""
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path or get_state_path(CACHE_FILENAME),
+                                     check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS keyframes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime INTEGER NOT NULL, duration REAL NOT NULL, times TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get(self, path: str, stat_result: os.stat_result) -> Optional[KeyframeIndex]:
+        """Get the cached index of a clip, if the clip has not changed since it was indexed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT duration, times FROM keyframes WHERE path = ? AND size = ? AND mtime = ?",
+                (path, stat_result.st_size, stat_result.st_mtime_ns)).fetchone()
+        return KeyframeIndex(json.loads(row[1]), row[0]) if row else None
+
+    def put(self, path: str, stat_result: os.stat_result, index: KeyframeIndex) -> None:
+        """Store the index of a clip."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO keyframes VALUES (?, ?, ?, ?, ?)",
+                               (path, stat_result.st_size, stat_result.st_mtime_ns,
+                                index.duration, json.dumps(index.times)))
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def get_keyframes(path: str, cache: Optional[KeyframeCache] = None) -> KeyframeIndex:
+    """Get the keyframe index of a clip, building it only if it is not cached.
+
+    Args:
+        path (str): The clip.
+        cache (Optional[KeyframeCache]): The cache to use. Defaults to keyframe_cache.db
+            next to config.ini.
+
+    Returns:
+        KeyframeIndex: The index.
+
+    Raises:
+        Mp4Error: If the clip cannot be indexed.
+    """
+    path = os.path.abspath(path)
+    own_cache = cache is None
+    cache = cache or KeyframeCache()
+    try:
+        stat_result = os.stat(path)
+        index = cache.get(path, stat_result)
+        if index is None:
+            index = build_index(path)
+            cache.put(path, stat_result, index)
+            logger.info("Indexed %d keyframes in %s", len(index.times), path)
+        return index
+    finally:
+        if own_cache:
+            cache.close()
+
+
+def snap_trim(path: str, trim: TrimRange) -> TrimRange:
+    """Move the start of a trim range back to the nearest keyframe.
+
+    A stream copy can only start on a keyframe; starting anywhere else would
+    leave undecodable frames at the head of the output.
+
+    Args:
+        path (str): The clip.
+        trim (TrimRange): The (start, end) in seconds; None means the clip's start or end.
+
+    Returns:
+        TrimRange: The range with its start on a keyframe, or as requested if the
+            clip's keyframes cannot be read.
+    """
+    start, end = trim
+    if not start:
+        return None, end
+    try:
+        snapped = get_keyframes(path).keyframe_before(start)
+    except (Mp4Error, struct.error) as e:
+        logger.warning("Could not read the keyframes of %s, trimming at %.3fs as requested: %s",
+                       path, start, e)
+        return start, end
+    if snapped != start:
+        logger.info("Trim start of %s moved from %.3fs to keyframe at %.3fs", path, start, snapped)
+    return snapped, end
+
+
+def parse_timestamp(text: str) -> Optional[float]:
+    """Parse seconds or [[HH:]MM:]SS[.fff] into seconds; an empty string gives None.
+
+    Raises:
+        ValueError: If the text is not a timestamp.
+    """
+    text = text.strip()
+    if not text:
+        return None
+    seconds = 0.0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Negative timestamp: {text}")
+    return seconds
+
+
+def trim_clip(source: str, destination: str, trim: TrimRange) -> TrimRange:
+    """Cut a clip to a time range without re-encoding.
+
+    The start is snapped back to the keyframe at or before it, and the streams are
+    copied from there to the end of the range, so trimming takes as long as copying
+    the kept part of the file.
+
+    Args:
+        source (str): The clip to trim.
+        destination (str): The output file.
+        trim (TrimRange): The (start, end) in seconds to keep.
+
+    Returns:
+        TrimRange: The range that was actually kept.
+
+    Raises:
+        ffmpeg.Error: If ffmpeg fails.
+        JobCancelled: If the trim is cancelled or times out.
+    """
+    start, end = snap_trim(source, trim)
+    input_args = {'ss': start} if start else {}
+    output_args = {'t': end - (start or 0)} if end is not None else {}
+    stream = ffmpeg.output(ffmpeg.input(source, **input_args), destination, c='copy', map='0',
+                           avoid_negative_ts='make_zero', **output_args)
+    duration: Optional[float] = None
+    try:
+        duration = (end if end is not None else get_keyframes(source).duration) - (start or 0)
+    except (Mp4Error, struct.error):
+        logger.debug("Trimming %s without a known duration", source)
+    FFmpegJob(stream, os.path.basename(destination), duration).run()
+    logger.info("Trimmed %s to %s (%s-%s)", source, destination, start, end)
+    return start, end
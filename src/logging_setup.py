@@ -1,41 +1,182 @@
 """Module handling the setup of the logger"""
 
+import atexit
+import copy
+import logging
 import os
+import queue
+import threading
+import time
 from datetime import datetime
-import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, Optional, Tuple
+
+DEFAULT_LEVEL = logging.INFO
+# Records per second let through for each message below WARNING; 0 disables the limit
+DEFAULT_RATE_LIMIT = 20
+# Messages formatted before logging have no shared template; forget them past this count
+MAX_TRACKED_MESSAGES = 1000
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s:%(lineno)d - %(message)s'
+
+_lock = threading.Lock()
+_queue_handler: Optional[QueueHandler] = None  # pylint: disable=invalid-name
+_listener: Optional[QueueListener] = None  # pylint: disable=invalid-name
+
+
+class RateLimitFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Let through at most `per_second` records of each message below WARNING.
+
+    Hot loops log the same message template for every file; only the first
+    records of every second are kept, and the next record that gets through
+    says how many similar ones were dropped. Warnings and errors always pass.
+    """
+
+    def __init__(self, per_second: int = DEFAULT_RATE_LIMIT) -> None:
+        super().__init__()
+        self.per_second = per_second
+        self._windows: Dict[Tuple[str, object], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.per_second <= 0 or record.levelno >= logging.WARNING:
+            return True
+        now = int(time.monotonic())
+        key = (record.name, record.msg)
+        window = self._windows.get(key)
+        if window is None and len(self._windows) >= MAX_TRACKED_MESSAGES:
+            self._windows.clear()
+        if window is None or window[0] != now:
+            suppressed = window[2] if window else 0
+            self._windows[key] = [now, 1, 0]
+            record.suppressed = suppressed
+            return True
+        if window[1] < self.per_second:
+            window[1] += 1
+            record.suppressed = window[2]
+            window[2] = 0
+            return True
+        window[2] += 1
+        return False
+
+
+class _QueueHandler(QueueHandler):
+    """Hand records to the listener thread without formatting them here.
+
+    Only the message is merged with its arguments, so later changes to the
+    arguments cannot alter it; timestamps and layout are formatted by the
+    listener. The queue never leaves the process, so exc_info is kept as is.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        message = record.getMessage()
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        record.msg = message
+        record.args = None
+        return record
+
+
+class _LogFileHandler(TimedRotatingFileHandler):
+    """Daily log file that is created on the first record and flushed in batches."""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+    def flush(self) -> None:
+        # Flushed by the listener once the queue is drained instead of after every record
+        pass
+
+    def drain(self) -> None:
+        """Write buffered records to disk."""
+        with self.lock:
+            if self.stream:
+                self.stream.flush()
+
+    def close(self) -> None:
+        self.drain()
+        super().close()
+
+
+class _Listener(QueueListener):
+    """Queue listener that flushes the log file whenever it catches up."""
+
+    def handle(self, record: logging.LogRecord) -> None:
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                if isinstance(handler, _LogFileHandler):
+                    handler.drain()
+
+
+def _start() -> QueueHandler:
+    """Route the root logger through a queue to one file handler on a background thread."""
+    global _queue_handler, _listener  # pylint: disable=global-statement
+    with _lock:
+        if _queue_handler is None:
+            date_str = datetime.now().strftime("%m-%d-%Y")
+            file_handler = _LogFileHandler(os.path.join('logs', f'{date_str}-log.log'),
+                                           when='midnight', interval=1, delay=True)
+            file_handler.suffix = "%Y-%m-%d"
+            file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+            records: queue.SimpleQueue = queue.SimpleQueue()
+            _queue_handler = _QueueHandler(records)
+            _queue_handler.addFilter(RateLimitFilter())
+            root = logging.getLogger()
+            root.addHandler(_queue_handler)
+            root.setLevel(DEFAULT_LEVEL)
+
+            _listener = _Listener(records, file_handler)
+            _listener.start()
+            atexit.register(stop_logging)
+    return _queue_handler
 
 
 def setup_logger(name: str) -> logging.Logger:
-    """Set up a logger that outputs logs to a file with the specified date format.
+    """Get the logger of a module.
+
+    Every logger feeds one shared queue; a background thread writes the records
+    to the daily log file in logs/, so logging never waits for the disk.
 
     Args:
         name (str): The name of the logger.
 
     Returns:
-        logging.Logger: Configured logger instance.
+        logging.Logger: The logger instance.
     """
-    # Create logs directory if it doesn't exist
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-
-    # Set up logging
-    date_str = datetime.now().strftime("%m-%d-%Y")
-    log_filename = f'logs/{date_str}-log.log'
-    log_handler = TimedRotatingFileHandler(
-        log_filename, when='midnight', interval=1)
-    log_handler.suffix = "%Y-%m-%d"
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s - %(pathname)s:%(lineno)d')
-    log_handler.setFormatter(formatter)
-
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)  # Set to DEBUG for development
-
-    # Remove any existing handlers
-    logger.handlers = []
-
-    # Add the file handler only
-    logger.addHandler(log_handler)
-
-    return logger
+    _start()
+    return logging.getLogger(name)
+
+
+def configure_logging(level: Optional[str] = None, rate_limit: Optional[int] = None) -> None:
+    """Set the log level and the rate limit of repeated messages.
+
+    Args:
+        level (Optional[str]): A level name such as "DEBUG" or "WARNING". Defaults to INFO.
+        rate_limit (Optional[int]): The records per second let through for each
+            message below WARNING; 0 disables the limit.
+    """
+    handler = _start()
+    numeric_level = logging.getLevelName((level or '').strip().upper()
+                                         or logging.getLevelName(DEFAULT_LEVEL))
+    if not isinstance(numeric_level, int):
+        logging.getLogger(__name__).warning("Unknown log level %r, using INFO", level)
+        numeric_level = DEFAULT_LEVEL
+    logging.getLogger().setLevel(numeric_level)
+    if rate_limit is not None:
+        for log_filter in handler.filters:
+            if isinstance(log_filter, RateLimitFilter):
+                log_filter.per_second = rate_limit
+
+
+def stop_logging() -> None:
+    """Write out every queued record and stop the background thread."""
+    global _listener  # pylint: disable=global-statement
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
@@ -7,6 +7,7 @@ from rich.prompt import Prompt
 from config import load_config
 from commands import (
     handle_concatenate_videos,
+    handle_extract_telemetry,
     handle_transfer_videos,
     handle_settings,
 )
@@ -18,8 +19,9 @@ console = Console()
 # Constants for menu choices
 CONCATENATE_VIDEOS = "1"
 TRANSFER_VIDEOS = "2"
-SETTINGS = "3"
-EXIT = "4"
+EXTRACT_TELEMETRY = "3"
+SETTINGS = "4"
+EXIT = "5"
 LOGGING_LEVEL = logging.WARNING  # Constant for logging level
 
 
@@ -34,6 +36,7 @@ def display_menu() -> None:
     console.print("Available commands:", style="bold green")
     console.print(f"{CONCATENATE_VIDEOS}. Concatenate videos")
     console.print(f"{TRANSFER_VIDEOS}. Transfer videos to output directory")
+    console.print(f"{EXTRACT_TELEMETRY}. Extract GPS and sensor telemetry")
     console.print(f"{SETTINGS}. Settings")
     console.print(f"{EXIT}. Exit")
 
@@ -43,6 +46,7 @@ def execute_command(choice: str) -> None:
     commands = {
         CONCATENATE_VIDEOS: handle_concatenate_videos,
         TRANSFER_VIDEOS: handle_transfer_videos,
+        EXTRACT_TELEMETRY: handle_extract_telemetry,
         SETTINGS: handle_settings,
         EXIT: lambda: console.print("Exiting...", style="bold red"),
     }
@@ -71,7 +75,7 @@ def main() -> None:
     while True:
         display_menu()
         choice = Prompt.ask("Enter your choice", choices=[
-                            CONCATENATE_VIDEOS, TRANSFER_VIDEOS, SETTINGS, EXIT])
+                            CONCATENATE_VIDEOS, TRANSFER_VIDEOS, EXTRACT_TELEMETRY, SETTINGS, EXIT])
 
         if choice == EXIT:
             logger.setLevel(LOGGING_LEVEL)  # Set logger to WARNING level
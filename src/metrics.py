@@ -0,0 +1,325 @@
+"""Module to time the stages of import, organize and concat jobs and report where the time went.
+
+A job is a flat list of timed spans. Each span names a stage (scan, plan,
+transfer, verify, organize, vidlist, ffmpeg, rename, ...) and records the bytes
+and files it handled. When the outermost job ends, a JSON report is written,
+a summary table is printed and, when configured, the totals are exported for
+Prometheus' node_exporter textfile collector.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from rich.console import Console
+from rich.table import Table
+from config import get_config_int, get_config_value, get_state_path
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_REPORT_DIRECTORY = "job_reports"
+DEFAULT_REPORTS_KEPT = 100
+MB = 1024 * 1024
+
+
+class Span:
+    """One timed stage of a job, with the bytes and files it handled.
+
+    A stage that raises records the exception type as its "error" attribute.
+    """
+
+    __slots__ = ('name', 'device', 'start', 'seconds', 'bytes', 'files', 'attributes')
+
+    def __init__(self, name: str, device: Optional[str] = None, num_bytes: int = 0, files: int = 0,
+                 **attributes: object) -> None:
+        self.name = name
+        self.device = device
+        self.start = 0.0
+        self.seconds = 0.0
+        self.bytes = num_bytes
+        self.files = files
+        self.attributes = attributes
+
+    def add(self, num_bytes: int = 0, files: int = 0) -> None:
+        """Count bytes or files handled once the span has started."""
+        self.bytes += num_bytes
+        self.files += files
+
+    def to_dict(self, job_start: float) -> Dict[str, object]:
+        """Describe the span, with its start relative to the start of the job."""
+        described = {'stage': self.name, 'start': round(self.start - job_start, 6),
+                     'seconds': round(self.seconds, 6), 'bytes': self.bytes, 'files': self.files}
+        if self.device:
+            described['device'] = self.device
+        described.update(self.attributes)
+        return described
+
+
+class StageTotals(NamedTuple):
+    """The spans of one stage on one device, added up."""
+    stage: str
+    device: Optional[str]
+    spans: int
+    seconds: float
+    bytes: int
+    files: int
+    errors: int
+
+    @property
+    def mbps(self) -> Optional[float]:
+        """The throughput in MB/s, when the stage moved data."""
+        return self.bytes / MB / self.seconds if self.bytes and self.seconds else None
+
+
+class Job:
+    """The spans recorded while one import, organize or concat runs.
+
+    Spans can be recorded from several threads at once.
+    """
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.status = 'running'
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def record(self, finished: Span) -> None:
+        """Add a finished span."""
+        with self._lock:
+            self.spans.append(finished)
+
+    def stages(self) -> List[StageTotals]:
+        """Add up the spans of each stage and device, in the order the stages first ran."""
+        totals: Dict[tuple, list] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for current in spans:
+            total = totals.setdefault((current.name, current.device), [0, 0.0, 0, 0, 0])
+            total[0] += 1
+            total[1] += current.seconds
+            total[2] += current.bytes
+            total[3] += current.files
+            total[4] += 'error' in current.attributes
+        return [StageTotals(stage, device, *total) for (stage, device), total in totals.items()]
+
+    def to_dict(self) -> Dict[str, object]:
+        """Describe the job, its stage totals and every span, for the JSON report."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda current: current.start)
+        return {
+            'job': self.kind,
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': round(self.seconds, 6),
+            'status': self.status,
+            'stages': [dict(totals._asdict(), mbps=totals.mbps) for totals in self.stages()],
+            'spans': [current.to_dict(self.start) for current in spans],
+        }
+
+
+_lock = threading.Lock()
+_active: Optional[Job] = None  # pylint: disable=invalid-name
+
+
+def current_job() -> Optional[Job]:
+    """Get the job that is running, if any."""
+    return _active
+
+
+@contextmanager
+def job(kind: str, console: Optional[Console] = None) -> Iterator[Job]:
+    """Record the spans of a job and report them when it ends.
+
+    Jobs started while another job runs, such as the organize step of an import,
+    add their spans to the running job instead of reporting separately. Like any
+    context manager made with contextmanager, it can also decorate a function.
+
+    Args:
+        kind (str): The kind of job, e.g. "import" or "concat".
+        console (Optional[Console]): The rich console to print the summary table on.
+
+    Yields:
+        Job: The job spans are recorded in.
+    """
+    global _active  # pylint: disable=global-statement
+    with _lock:
+        outer = _active
+        if outer is None:
+            _active = Job(kind)
+        running = _active
+    if outer is not None:
+        yield outer
+        return
+
+    try:
+        yield running
+        running.status = 'ok'
+    except BaseException as e:
+        running.status = f"failed: {type(e).__name__}"
+        raise
+    finally:
+        running.seconds = time.perf_counter() - running.start
+        with _lock:
+            _active = None
+        finish(running, console)
+
+
+@contextmanager
+def span(name: str, device: Optional[str] = None, num_bytes: int = 0, files: int = 0,
+         **attributes: object) -> Iterator[Span]:
+    """Time a stage of the running job.
+
+    Outside a job the span is timed but not recorded, so instrumented functions
+    can still be called on their own.
+
+    Args:
+        name (str): The stage, e.g. "transfer" or "ffmpeg".
+        device (Optional[str]): What the stage read from or wrote to, such as a source
+            directory, so slow devices stand out in the totals.
+        num_bytes (int): The bytes handled, if known up front; see Span.add.
+        files (int): The files handled, if known up front.
+        **attributes: Details kept in the JSON report, such as the file name.
+
+    Yields:
+        Span: The span, to count bytes and files as they are handled.
+    """
+    current = Span(name, device, num_bytes, files, **attributes)
+    current.start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes['error'] = type(e).__name__
+        raise
+    finally:
+        current.seconds = time.perf_counter() - current.start
+        running = _active
+        if running is not None:
+            running.record(current)
+
+
+def finish(finished: Job, console: Optional[Console] = None) -> None:
+    """Report a finished job: JSON report, summary table and Prometheus textfile.
+
+    Reporting never fails the job; errors are logged.
+    """
+    if not finished.spans:
+        return
+    logger.info("%s job %s in %.2fs: %s", finished.kind, finished.status, finished.seconds,
+                ', '.join(f"{totals.stage} {totals.seconds:.2f}s" for totals in finished.stages()))
+    try:
+        path = write_report(finished)
+        logger.info("Wrote job report to %s", path)
+    except OSError as e:
+        logger.error("Could not write the job report: %s", e)
+    if console:
+        print_summary(finished, console)
+    textfile_directory = get_config_value('metrics_textfile_directory')
+    if textfile_directory:
+        try:
+            write_textfile(finished, textfile_directory)
+        except OSError as e:
+            logger.error("Could not write metrics to %s: %s", textfile_directory, e)
+
+
+def report_directory() -> str:
+    """The directory job reports are written to."""
+    return get_config_value('job_report_directory') or get_state_path(DEFAULT_REPORT_DIRECTORY)
+
+
+def write_report(finished: Job) -> str:
+    """Write the JSON report of a job and remove the oldest reports beyond job_reports_kept.
+
+    Returns:
+        str: The report path.
+    """
+    directory = report_directory()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{finished.kind}-{finished.started:%Y%m%d-%H%M%S-%f}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(finished.to_dict(), f, indent=2)
+
+    kept = get_config_int('job_reports_kept', DEFAULT_REPORTS_KEPT)
+    reports = sorted(name for name in os.listdir(directory)
+                     if name.startswith(f"{finished.kind}-") and name.endswith('.json'))
+    for name in reports[:max(0, len(reports) - kept)]:
+        os.remove(os.path.join(directory, name))
+    return path
+
+
+def print_summary(finished: Job, console: Console) -> None:
+    """Print the time, data and throughput of each stage of a job."""
+    table = Table(title=f"{finished.kind.capitalize()} {finished.status} "
+                        f"in {finished.seconds:.2f}s")
+    table.add_column("Stage")
+    table.add_column("Device")
+    table.add_column("Runs", justify="right")
+    table.add_column("Files", justify="right")
+    table.add_column("MB", justify="right")
+    table.add_column("Seconds", justify="right")
+    table.add_column("MB/s", justify="right")
+    for totals in finished.stages():
+        table.add_row(totals.stage, totals.device or "", str(totals.spans),
+                      str(totals.files) if totals.files else "",
+                      f"{totals.bytes / MB:.1f}" if totals.bytes else "",
+                      f"{totals.seconds:.2f}",
+                      f"{totals.mbps:.1f}" if totals.mbps is not None else "",
+                      style="bold red" if totals.errors else None)
+    console.print(table)
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_textfile(finished: Job, directory: str) -> str:
+    """Export the stage totals of a job for node_exporter's textfile collector.
+
+    Each kind of job has its own actioncam_<kind>.prom file holding its last run.
+    The file is written under a temporary name and renamed, so the collector never
+    reads half a file.
+
+    Returns:
+        str: The path of the .prom file.
+    """
+    kind = _label(finished.kind)
+    lines = [
+        "# HELP actioncam_job_seconds Duration of the last job.",
+        "# TYPE actioncam_job_seconds gauge",
+        f'actioncam_job_seconds{{job="{kind}"}} {finished.seconds:.6f}',
+        "# HELP actioncam_job_success Whether the last job succeeded.",
+        "# TYPE actioncam_job_success gauge",
+        f'actioncam_job_success{{job="{kind}"}} {int(finished.status == "ok")}',
+        "# HELP actioncam_job_last_run_timestamp_seconds When the last job started.",
+        "# TYPE actioncam_job_last_run_timestamp_seconds gauge",
+        f'actioncam_job_last_run_timestamp_seconds{{job="{kind}"}} '
+        f'{finished.started.timestamp():.0f}',
+    ]
+    metrics = (
+        ('stage_seconds', "Seconds spent in each stage of the last job.",
+         lambda t: f"{t.seconds:.6f}"),
+        ('stage_bytes', "Bytes handled by each stage of the last job.", lambda t: str(t.bytes)),
+        ('stage_files', "Files handled by each stage of the last job.", lambda t: str(t.files)),
+        ('stage_errors', "Failed runs of each stage of the last job.", lambda t: str(t.errors)),
+    )
+    stages = finished.stages()
+    for name, description, value in metrics:
+        lines.append(f"# HELP actioncam_{name} {description}")
+        lines.append(f"# TYPE actioncam_{name} gauge")
+        for totals in stages:
+            labels = (f'job="{kind}",stage="{_label(totals.stage)}",'
+                      f'device="{_label(totals.device or "")}"')
+            lines.append(f"actioncam_{name}{{{labels}}} {value(totals)}")
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"actioncam_{finished.kind}.prom")
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temporary, path)
+    return path
@@ -0,0 +1,312 @@
+"""Module to read MP4/MOV box structure and clip metadata without ffprobe."""
+
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+MP4_EPOCH = datetime(1904, 1, 1)
+# GoPro firmware prefixes (udta/FIRM) for cameras that do not name themselves in GPMF
+GOPRO_FIRMWARE_MODELS = {
+    'HD5': 'HERO5', 'HD6': 'HERO6 Black', 'HD7': 'HERO7', 'HD8': 'HERO8 Black',
+    'H19': 'MAX', 'H21': 'HERO10 Black', 'H22': 'HERO11 Black', 'H23': 'HERO12 Black',
+}
+
+
+class Mp4Error(ValueError):
+    """Raised when a file is not a well-formed MP4/MOV file."""
+
+
+class Box(NamedTuple):
+    """A box located in a file or buffer.
+
+    Attributes:
+        type (bytes): The four-character box type.
+        offset (int): The offset of the box header.
+        size (int): The size of the box including its header.
+        header_size (int): The size of the header (8, or 16 for 64-bit sizes).
+    """
+    type: bytes
+    offset: int
+    size: int
+    header_size: int
+
+    @property
+    def payload_offset(self) -> int:
+        """The offset of the first byte after the header."""
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        """The offset of the first byte after the box."""
+        return self.offset + self.size
+
+
+class ClipMetadata(NamedTuple):
+    """Capture metadata read from the moov box of a clip."""
+    creation_time: Optional[datetime]
+    camera_model: Optional[str]
+    duration: Optional[float]
+    width: Optional[int] = None
+    height: Optional[int] = None
+    video_codec: Optional[str] = None
+
+
+def _parse_header(header: bytes, offset: int, limit: int, f: Optional[BinaryIO] = None) -> Box:
+    size, box_type = struct.unpack('>I4s', header[:8])
+    header_size = 8
+    if size == 1:
+        if len(header) < 16 and f is not None:
+            header += f.read(8)
+        if len(header) < 16:
+            raise Mp4Error(f"Truncated 64-bit box header at {offset}")
+        size = struct.unpack('>Q', header[8:16])[0]
+        header_size = 16
+    elif size == 0:
+        size = limit - offset
+    if size < header_size or offset + size > limit:
+        raise Mp4Error(f"Invalid size {size} for box {box_type!r} at {offset}")
+    return Box(box_type, offset, size, header_size)
+
+
+def read_top_level_boxes(f: BinaryIO) -> List[Box]:
+    """List the top-level boxes of a file by reading only their headers.
+
+    Args:
+        f (BinaryIO): The file opened in binary mode.
+
+    Returns:
+        List[Box]: The top-level boxes in file order.
+    """
+    file_size = os.fstat(f.fileno()).st_size
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        box = _parse_header(f.read(8), offset, file_size, f)
+        boxes.append(box)
+        offset = box.end
+    return boxes
+
+
+def iter_boxes(data, start: int = 0, end: Optional[int] = None) -> Iterator[Box]:
+    """Iterate over the boxes in a region of a buffer.
+
+    Args:
+        data: A bytes-like object or mmap.
+        start (int): The offset of the first box.
+        end (Optional[int]): The end of the region. Defaults to the end of the buffer.
+
+    Yields:
+        Box: Each box in the region, with offsets relative to the buffer.
+    """
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        box = _parse_header(bytes(data[offset:offset + 16]), offset, end)
+        yield box
+        offset = box.end
+
+
+def find_box(data, path: List[bytes], start: int = 0, end: Optional[int] = None) -> Optional[Box]:
+    """Find the first box at a path of box types, such as [b'trak', b'tkhd'].
+
+    Args:
+        data: A bytes-like object or mmap.
+        path (List[bytes]): The box types to descend through.
+        start (int): The offset of the first box to search.
+        end (Optional[int]): The end of the region to search.
+
+    Returns:
+        Optional[Box]: The box, or None if it does not exist.
+    """
+    for box in iter_boxes(data, start, end):
+        if box.type != path[0]:
+            continue
+        if len(path) == 1:
+            return box
+        found = find_box(data, path[1:], box.payload_offset, box.end)
+        if found:
+            return found
+    return None
+
+
+def find_boxes(data, box_type: bytes, start: int = 0, end: Optional[int] = None) -> List[Box]:
+    """Find all direct children of a given type in a region of a buffer."""
+    return [box for box in iter_boxes(data, start, end) if box.type == box_type]
+
+
+class MappedMoov:
+    """The moov box of a file, memory-mapped without touching the media data.
+
+    Box offsets found in `data` are relative to `base`; add `base` to get file offsets.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self.top_level = read_top_level_boxes(f)
+            moov = next((box for box in self.top_level if box.type == b'moov'), None)
+            if moov is None:
+                raise Mp4Error(f"No moov box in {path}")
+            aligned = moov.offset - moov.offset % mmap.ALLOCATIONGRANULARITY
+            self._map = mmap.mmap(f.fileno(), moov.end - aligned, offset=aligned,
+                                  access=mmap.ACCESS_READ)
+        self.base = aligned
+        self.moov = Box(moov.type, moov.offset - aligned, moov.size, moov.header_size)
+        self.data = memoryview(self._map)
+
+    def close(self) -> None:
+        """Release the mapping."""
+        self.data.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # A slice of the map is still referenced, e.g. by the traceback of a parse
+            # error; the map is unmapped when that slice is collected
+            logger.debug("Deferred closing the moov map of %s", self.path)
+
+    def __enter__(self) -> 'MappedMoov':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _mp4_time(seconds: int) -> Optional[datetime]:
+    if not seconds:
+        return None
+    return MP4_EPOCH + timedelta(seconds=seconds)
+
+
+def _mvhd_times(data, box: Box):
+    """Read (creation_time, timescale, duration) from an mvhd box."""
+    payload = box.payload_offset
+    version = data[payload]
+    if version == 1:
+        creation, _, timescale, duration = struct.unpack_from('>QQIQ', data, payload + 4)
+    else:
+        creation, _, timescale, duration = struct.unpack_from('>IIII', data, payload + 4)
+    return creation, timescale, duration
+
+
+def _tkhd_creation(data, box: Box) -> int:
+    payload = box.payload_offset
+    if data[payload] == 1:
+        return struct.unpack_from('>Q', data, payload + 4)[0]
+    return struct.unpack_from('>I', data, payload + 4)[0]
+
+
+def _video_format(data, moov: Box) -> Tuple[Optional[int], Optional[int], Optional[str]]:
+    """Read the coded width, height and sample entry type of the first video track."""
+    for trak in find_boxes(data, b'trak', moov.payload_offset, moov.end):
+        mdia = find_box(data, [b'mdia'], trak.payload_offset, trak.end)
+        hdlr = find_box(data, [b'hdlr'], mdia.payload_offset, mdia.end) if mdia else None
+        if hdlr is None or bytes(data[hdlr.payload_offset + 8:hdlr.payload_offset + 12]) != b'vide':
+            continue
+        stsd = find_box(data, [b'minf', b'stbl', b'stsd'], mdia.payload_offset, mdia.end)
+        entry = next(iter_boxes(data, stsd.payload_offset + 8, stsd.end), None) if stsd else None
+        if entry is None:
+            return None, None, None
+        width, height = struct.unpack_from('>HH', data, entry.payload_offset + 24)
+        return width, height, entry.type.decode('latin-1')
+    return None, None, None
+
+
+def _quicktime_text(data, box: Box) -> Optional[str]:
+    """Decode a QuickTime user data text atom such as ©mod."""
+    payload = box.payload_offset
+    if box.end - payload < 4:
+        return None
+    length = struct.unpack_from('>H', data, payload)[0]
+    text = bytes(data[payload + 4:min(payload + 4 + length, box.end)])
+    return text.decode('utf-8', 'replace').strip('\0 ') or None
+
+
+def _gpmf_string(data, box: Box, key: bytes) -> Optional[str]:
+    """Find a string value in the GoPro GPMF KLV payload of udta/GPMF."""
+    offset = box.payload_offset
+    while offset + 8 <= box.end:
+        fourcc = bytes(data[offset:offset + 4])
+        value_type = data[offset + 4]
+        sample_size = data[offset + 5]
+        repeat = struct.unpack_from('>H', data, offset + 6)[0]
+        length = sample_size * repeat
+        if value_type == 0:
+            # Nested KLV: descend into it
+            offset += 8
+            continue
+        if fourcc == key and value_type == ord('c'):
+            text = bytes(data[offset + 8:offset + 8 + length])
+            return text.decode('utf-8', 'replace').strip('\0 ')
+        offset += 8 + (length + 3) // 4 * 4
+    return None
+
+
+def _camera_model(data, udta: Optional[Box]) -> Optional[str]:
+    if udta is None:
+        return None
+    firmware = None
+    for box in iter_boxes(data, udta.payload_offset, udta.end):
+        if box.type == b'\xa9mod':
+            model = _quicktime_text(data, box)
+            if model:
+                return model
+        elif box.type == b'GPMF':
+            model = _gpmf_string(data, box, b'MINF')
+            if model:
+                return model
+        elif box.type == b'FIRM':
+            text = bytes(data[box.payload_offset:box.end])
+            firmware = text.decode('ascii', 'replace').strip('\0 ')
+    if firmware:
+        return GOPRO_FIRMWARE_MODELS.get(firmware[:3], f"GoPro ({firmware})")
+    return None
+
+
+def read_metadata(path: str) -> ClipMetadata:
+    """Read the capture time, camera model, duration and video format of a clip.
+
+    Only the box headers before moov and the moov box itself are read; the media
+    data is never touched. Cameras usually store local wall-clock time in mvhd,
+    so the creation time is returned as a naive datetime.
+
+    Args:
+        path (str): The MP4 or MOV file.
+
+    Returns:
+        ClipMetadata: The metadata, with None for anything the file does not record.
+
+    Raises:
+        Mp4Error: If the file has no readable moov box.
+    """
+    with MappedMoov(path) as mapped:
+        data, moov = mapped.data, mapped.moov
+        mvhd = find_box(data, [b'mvhd'], moov.payload_offset, moov.end)
+        creation, timescale, duration = _mvhd_times(data, mvhd) if mvhd else (0, 0, 0)
+        if not creation:
+            tkhd = find_box(data, [b'trak', b'tkhd'], moov.payload_offset, moov.end)
+            creation = _tkhd_creation(data, tkhd) if tkhd else 0
+        udta = find_box(data, [b'udta'], moov.payload_offset, moov.end)
+        width, height, video_codec = _video_format(data, moov)
+        return ClipMetadata(
+            creation_time=_mp4_time(creation),
+            camera_model=_camera_model(data, udta),
+            duration=duration / timescale if timescale else None,
+            width=width,
+            height=height,
+            video_codec=video_codec,
+        )
+
+
+def read_creation_time(path: str) -> Optional[datetime]:
+    """Read the capture time of a clip, or None if it cannot be determined."""
+    try:
+        return read_metadata(path).creation_time
+    except (OSError, IndexError, OverflowError, Mp4Error, struct.error) as e:
+        logger.debug("Could not read creation time of %s: %s", path, e)
+        return None
@@ -0,0 +1,551 @@
+"""Module to concatenate MP4 files natively, without ffmpeg or re-encoding."""
+
+import bisect
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from tqdm import tqdm
+from ffmpeg_job import JobCancelled
+from journal import partial_path
+from logging_setup import setup_logger
+from mp4 import Box, MappedMoov, Mp4Error, find_box, iter_boxes
+from transfer import copy_range
+
+logger = setup_logger(__name__)
+
+UINT32_MAX = 0xFFFFFFFF
+
+
+class IncompatibleInputs(Mp4Error):  # pylint: disable=too-few-public-methods
+    """Raised when files cannot be joined without ffmpeg."""
+
+
+def _be_array(typecode: str, data) -> array:
+    """Decode a run of big-endian integers."""
+    values = array(typecode)
+    values.frombytes(bytes(data))
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _to_be_bytes(values: array) -> bytes:
+    values = array(values.typecode, values)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type: bytes, version: int, payload: bytes) -> bytes:
+    return _box(box_type, struct.pack('>I', version << 24) + payload)
+
+
+def _table(data, box: Optional[Box], typecode: str, fields: int) -> Tuple[int, array]:
+    """Read the (version, entries) of a full box holding an entry count and a table."""
+    if box is None:
+        return 0, array(typecode)
+    payload = box.payload_offset
+    version = data[payload]
+    count = struct.unpack_from('>I', data, payload + 4)[0]
+    item_size = array(typecode).itemsize
+    start = payload + 8
+    end = start + count * fields * item_size
+    if end > box.end:
+        raise Mp4Error(f"Truncated {box.type!r} table")
+    return version, _be_array(typecode, data[start:end])
+
+
+class TrackTables(NamedTuple):
+    """The sample tables of one track of one input.
+
+    Chunk offsets are absolute file offsets. stss and ctts are None when the
+    input does not have them.
+    """
+    trak: Box
+    handler: bytes
+    timescale: int
+    stsd: bytes
+    stts: array
+    ctts: Optional[array]
+    ctts_version: int
+    stss: Optional[array]
+    stsc: array
+    sample_size: int
+    sample_count: int
+    sizes: array
+    chunk_offsets: array
+
+    @property
+    def media_duration(self) -> int:
+        """The sum of all sample durations, in the track timescale."""
+        return sum(count * delta for count, delta in zip(self.stts[0::2], self.stts[1::2]))
+
+
+def _timescale(data, header: Box) -> int:
+    """Read the timescale of an mvhd or mdhd box, which sits at the same offset in both."""
+    return struct.unpack_from(
+        '>I', data, header.payload_offset + (20 if data[header.payload_offset] == 1 else 12))[0]
+
+
+def _sample_sizes(data, stsz: Box) -> Tuple[int, int, array]:
+    """Read the (uniform sample size, sample count, per-sample sizes) of an stsz box."""
+    sample_size, sample_count = struct.unpack_from('>II', data, stsz.payload_offset + 4)
+    sizes = array('I')
+    if sample_size == 0:
+        start = stsz.payload_offset + 12
+        if start + 4 * sample_count > stsz.end:
+            raise Mp4Error("Truncated b'stsz' table")
+        sizes = _be_array('I', data[start:start + 4 * sample_count])
+    return sample_size, sample_count, sizes
+
+
+def _chunk_offsets(data, children: Dict[bytes, Box]) -> array:
+    """Read the chunk offsets of an stbl from its co64 or stco box as 64-bit values."""
+    if b'co64' in children:
+        return _table(data, children[b'co64'], 'Q', 1)[1]
+    return array('Q', _table(data, children.get(b'stco'), 'I', 1)[1])
+
+
+def _read_track(data, trak: Box) -> TrackTables:
+    mdia = find_box(data, [b'mdia'], trak.payload_offset, trak.end)
+    stbl = find_box(data, [b'minf', b'stbl'], mdia.payload_offset, mdia.end) if mdia else None
+    mdhd = find_box(data, [b'mdhd'], mdia.payload_offset, mdia.end) if mdia else None
+    hdlr = find_box(data, [b'hdlr'], mdia.payload_offset, mdia.end) if mdia else None
+    if stbl is None or mdhd is None or hdlr is None:
+        raise IncompatibleInputs("Track without sample tables")
+    children = {box.type: box for box in iter_boxes(data, stbl.payload_offset, stbl.end)}
+    if b'stsd' not in children or b'stsz' not in children:
+        raise IncompatibleInputs("Track without sample descriptions or sizes")
+
+    sample_size, sample_count, sizes = _sample_sizes(data, children[b'stsz'])
+    ctts_version, ctts = _table(data, children.get(b'ctts'), 'I', 2)
+    stsd = children[b'stsd']
+    return TrackTables(
+        trak=trak,
+        handler=bytes(data[hdlr.payload_offset + 8:hdlr.payload_offset + 12]),
+        timescale=_timescale(data, mdhd),
+        stsd=bytes(data[stsd.offset:stsd.end]),
+        stts=_table(data, children.get(b'stts'), 'I', 2)[1],
+        ctts=ctts if b'ctts' in children else None,
+        ctts_version=ctts_version,
+        stss=_table(data, children[b'stss'], 'I', 1)[1] if b'stss' in children else None,
+        stsc=_table(data, children.get(b'stsc'), 'I', 3)[1],
+        sample_size=sample_size,
+        sample_count=sample_count,
+        sizes=sizes,
+        chunk_offsets=_chunk_offsets(data, children),
+    )
+
+
+class Mp4Input:
+    """The moov of one input file, its tracks and the media data ranges to copy."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.mapped = MappedMoov(path)
+        try:
+            self._read_moov()
+        except Exception:
+            self.close()
+            raise
+        with open(path, 'rb') as f:
+            ftyp = next((box for box in self.mapped.top_level if box.type == b'ftyp'), None)
+            f.seek(ftyp.offset if ftyp else 0)
+            self.ftyp = f.read(ftyp.size) if ftyp else b''
+
+    def _read_moov(self) -> None:
+        data, moov = self.mapped.data, self.mapped.moov
+        if any(box.type == b'moof' for box in self.mapped.top_level):
+            raise IncompatibleInputs(f"{self.path} is a fragmented MP4")
+        self.mdats = [box for box in self.mapped.top_level if box.type == b'mdat']
+        self.tracks = [_read_track(data, trak)
+                       for trak in iter_boxes(data, moov.payload_offset, moov.end)
+                       if trak.type == b'trak']
+        if not self.tracks:
+            raise IncompatibleInputs(f"{self.path} has no tracks")
+
+    @property
+    def mdat_bytes(self) -> int:
+        """The number of media data bytes that will be copied."""
+        return sum(box.size - box.header_size for box in self.mdats)
+
+    def close(self) -> None:
+        """Release the mapped moov."""
+        self.mapped.close()
+
+
+def _descriptor_header(data: bytes, offset: int) -> Tuple[int, int, int]:
+    """Read an MPEG-4 descriptor tag and its variable-length size."""
+    tag = data[offset]
+    size = 0
+    offset += 1
+    for _ in range(4):
+        byte = data[offset]
+        offset += 1
+        size = size << 7 | byte & 0x7F
+        if not byte & 0x80:
+            break
+    return tag, size, offset
+
+
+def _esds_without_bitrates(esds: bytes) -> bytes:
+    """Zero the max and average bitrates of an esds box, which vary from file to file."""
+    patched = bytearray(esds)
+    try:
+        tag, _, offset = _descriptor_header(patched, 12)
+        if tag != 0x03:
+            return esds
+        flags = patched[offset + 2]
+        offset += 3
+        if flags & 0x80:
+            offset += 2
+        if flags & 0x40:
+            offset += 1 + patched[offset]
+        if flags & 0x20:
+            offset += 2
+        tag, _, offset = _descriptor_header(patched, offset)
+        if tag == 0x04:
+            patched[offset + 5:offset + 13] = bytes(8)
+    except IndexError:
+        return esds
+    return bytes(patched)
+
+
+# Size of the fixed fields of a sample entry before its child boxes, by handler
+SAMPLE_ENTRY_FIELDS = {b'vide': 78, b'soun': 28}
+
+
+def stsd_signature(stsd: bytes, handler: bytes) -> bytes:
+    """The parts of an stsd box that must match for sample tables to be merged.
+
+    Encoders record the bitrate of each file in btrt boxes and in the esds of AAC
+    audio. Those fields do not affect decoding and are left out; everything else,
+    including the codec private data, is compared byte for byte.
+    """
+    fields = SAMPLE_ENTRY_FIELDS.get(handler)
+    if fields is None:
+        return stsd
+    signature = stsd[:16]
+    for entry in iter_boxes(stsd, 16):
+        if handler == b'soun':
+            version = struct.unpack_from('>H', stsd, entry.payload_offset + 8)[0]
+            fields = 28 + {1: 16, 2: 36}.get(version, 0)
+        children_start = entry.payload_offset + fields
+        signature += stsd[entry.offset:children_start]
+        for child in iter_boxes(stsd, children_start, entry.end):
+            if child.type == b'btrt':
+                continue
+            child_bytes = stsd[child.offset:child.end]
+            if child.type == b'esds':
+                child_bytes = _esds_without_bitrates(child_bytes)
+            signature += child_bytes
+    return signature
+
+
+def check_compatible(inputs: List[Mp4Input]) -> None:
+    """Check that inputs can be joined by merging their sample tables.
+
+    Every input must have the same tracks in the same order, with identical sample
+    descriptions (codec, resolution, codec private data) and timescales.
+
+    Raises:
+        IncompatibleInputs: If they cannot.
+    """
+    first = inputs[0]
+    for other in inputs[1:]:
+        if len(other.tracks) != len(first.tracks):
+            raise IncompatibleInputs(f"{other.path} has {len(other.tracks)} tracks, "
+                                     f"{first.path} has {len(first.tracks)}")
+        for index, (a, b) in enumerate(zip(first.tracks, other.tracks)):
+            if a.handler != b.handler or a.timescale != b.timescale:
+                raise IncompatibleInputs(
+                    f"Track {index} of {other.path} has a different type or timescale")
+            if stsd_signature(a.stsd, a.handler) != stsd_signature(b.stsd, b.handler):
+                raise IncompatibleInputs(
+                    f"Track {index} of {other.path} has different codec parameters")
+            if a.ctts is not None and b.ctts is not None and a.ctts_version != b.ctts_version:
+                raise IncompatibleInputs(
+                    f"Track {index} of {other.path} has a different ctts version")
+
+
+class _MergedTrack(NamedTuple):
+    stts: array
+    ctts: Optional[array]
+    ctts_version: int
+    stss: Optional[array]
+    stsc: array
+    sample_size: int
+    sample_count: int
+    sizes: array
+    chunk_offsets: array
+    media_duration: int
+
+
+def _mdat_mapping(source: Mp4Input, data_start: int) -> Tuple[List[int], List[Box], List[int]]:
+    """Where each mdat payload of an input lands in the output."""
+    starts, boxes, targets = [], [], []
+    position = data_start
+    for box in sorted(source.mdats, key=lambda box: box.offset):
+        starts.append(box.payload_offset)
+        boxes.append(box)
+        targets.append(position)
+        position += box.size - box.header_size
+    return starts, boxes, targets
+
+
+def _relocate(offsets: array, source: Mp4Input, data_start: int) -> array:
+    starts, boxes, targets = _mdat_mapping(source, data_start)
+    relocated = array('Q')
+    for offset in offsets:
+        index = bisect.bisect_right(starts, offset) - 1
+        if index < 0 or offset >= boxes[index].end:
+            raise IncompatibleInputs(
+                f"Chunk offset {offset} of {source.path} is outside the media data")
+        relocated.append(targets[index] + offset - starts[index])
+    return relocated
+
+
+def _shifted_stsc(stsc: array, chunks: int) -> array:
+    """Renumber the first chunk of each stsc entry for a track whose chunks follow others."""
+    shifted = array('I', stsc)
+    for entry in range(0, len(shifted), 3):
+        shifted[entry] += chunks
+    return shifted
+
+
+def _merge_track(inputs: List[Mp4Input], index: int, data_starts: List[int]) -> _MergedTrack:
+    tracks = [source.tracks[index] for source in inputs]
+    uniform = tracks[0].sample_size
+    if any(track.sample_size != uniform for track in tracks):
+        uniform = 0
+
+    stts, stsc, sizes, chunk_offsets = array('I'), array('I'), array('I'), array('Q')
+    ctts = array('I') if any(track.ctts is not None for track in tracks) else None
+    stss = array('I') if any(track.stss is not None for track in tracks) else None
+    samples = 0
+    for source, track, data_start in zip(inputs, tracks, data_starts):
+        stts.extend(track.stts)
+        if ctts is not None:
+            ctts.extend(array('I', [track.sample_count, 0]) if track.ctts is None else track.ctts)
+        if stss is not None:
+            # An input without stss has only sync samples
+            stss.extend(sample + samples for sample in
+                        (range(1, track.sample_count + 1) if track.stss is None else track.stss))
+        stsc.extend(_shifted_stsc(track.stsc, len(chunk_offsets)))
+        if not uniform:
+            sizes.extend(track.sizes if track.sample_size == 0
+                         else [track.sample_size] * track.sample_count)
+        chunk_offsets.extend(_relocate(track.chunk_offsets, source, data_start))
+        samples += track.sample_count
+
+    return _MergedTrack(stts, ctts, tracks[0].ctts_version, stss, stsc, uniform, samples, sizes,
+                        chunk_offsets, sum(track.media_duration for track in tracks))
+
+
+def _stbl(data, stbl: Box, merged: _MergedTrack, use_co64: bool) -> bytes:
+    """Build an stbl with the merged tables, keeping the first input's stsd.
+
+    Optional tables that are not merged, such as sdtp and sample groups, are dropped.
+    """
+    stsd = find_box(data, [b'stsd'], stbl.payload_offset, stbl.end)
+    payload = bytes(data[stsd.offset:stsd.end])
+    payload += _full_box(b'stts', 0,
+                         struct.pack('>I', len(merged.stts) // 2) + _to_be_bytes(merged.stts))
+    if merged.ctts is not None:
+        payload += _full_box(b'ctts', merged.ctts_version,
+                             struct.pack('>I', len(merged.ctts) // 2) + _to_be_bytes(merged.ctts))
+    if merged.stss is not None:
+        payload += _full_box(b'stss', 0,
+                             struct.pack('>I', len(merged.stss)) + _to_be_bytes(merged.stss))
+    payload += _full_box(b'stsc', 0,
+                         struct.pack('>I', len(merged.stsc) // 3) + _to_be_bytes(merged.stsc))
+    payload += _full_box(b'stsz', 0, struct.pack('>II', merged.sample_size, merged.sample_count)
+                         + (_to_be_bytes(merged.sizes) if not merged.sample_size else b''))
+    if use_co64:
+        payload += _full_box(b'co64', 0, struct.pack('>I', len(merged.chunk_offsets))
+                             + _to_be_bytes(merged.chunk_offsets))
+    else:
+        payload += _full_box(b'stco', 0, struct.pack('>I', len(merged.chunk_offsets))
+                             + _to_be_bytes(array('I', merged.chunk_offsets)))
+    return _box(b'stbl', payload)
+
+
+def _patch_duration(data, box: Box, v0_offset: int, v1_offset: int, duration: int) -> bytes:
+    """Copy a box and replace the duration field at the offset for its version."""
+    patched = bytearray(data[box.offset:box.end])
+    header = box.header_size
+    if patched[header] == 1:
+        struct.pack_into('>Q', patched, header + v1_offset, duration)
+    else:
+        if duration > UINT32_MAX:
+            raise IncompatibleInputs(
+                f"Duration {duration} does not fit a version 0 {box.type!r} box")
+        struct.pack_into('>I', patched, header + v0_offset, duration)
+    return bytes(patched)
+
+
+def _edts(data, edts: Box, duration: int) -> bytes:
+    """Keep a single-entry edit list, stretched to the joined duration."""
+    elst = find_box(data, [b'elst'], edts.payload_offset, edts.end)
+    if elst is None or struct.unpack_from('>I', data, elst.payload_offset + 4)[0] != 1:
+        return b''
+    return _box(b'edts', _patch_duration(data, elst, 8, 8, duration))
+
+
+def _trak(data, trak: Box, merged: _MergedTrack, movie_duration: int, use_co64: bool) -> bytes:
+    payload = b''
+    for box in iter_boxes(data, trak.payload_offset, trak.end):
+        if box.type == b'tkhd':
+            payload += _patch_duration(data, box, 20, 28, movie_duration)
+        elif box.type == b'edts':
+            payload += _edts(data, box, movie_duration)
+        elif box.type == b'mdia':
+            payload += _box(b'mdia', _mdia(data, box, merged, use_co64))
+        else:
+            payload += bytes(data[box.offset:box.end])
+    return _box(b'trak', payload)
+
+
+def _mdia(data, mdia: Box, merged: _MergedTrack, use_co64: bool) -> bytes:
+    payload = b''
+    for box in iter_boxes(data, mdia.payload_offset, mdia.end):
+        if box.type == b'mdhd':
+            payload += _patch_duration(data, box, 16, 24, merged.media_duration)
+        elif box.type == b'minf':
+            minf = b''
+            for child in iter_boxes(data, box.payload_offset, box.end):
+                if child.type == b'stbl':
+                    minf += _stbl(data, child, merged, use_co64)
+                else:
+                    minf += bytes(data[child.offset:child.end])
+            payload += _box(b'minf', minf)
+        else:
+            payload += bytes(data[box.offset:box.end])
+    return payload
+
+
+def build_moov(inputs: List[Mp4Input], data_start: int, use_co64: bool) -> bytes:
+    """Build the moov of the joined file.
+
+    The first input's moov is the template: its boxes are copied, and the sample
+    tables and durations are replaced with the merged ones.
+
+    Args:
+        inputs (List[Mp4Input]): The inputs, in order.
+        data_start (int): The file offset of the first media data byte in the output.
+        use_co64 (bool): Whether to write 64-bit chunk offsets.
+
+    Returns:
+        bytes: The moov box.
+    """
+    data, moov = inputs[0].mapped.data, inputs[0].mapped.moov
+    movie_timescale = _timescale(data, find_box(data, [b'mvhd'], moov.payload_offset, moov.end))
+    data_starts = [data_start + sum(source.mdat_bytes for source in inputs[:index])
+                   for index in range(len(inputs))]
+
+    traks = []
+    movie_duration = 0
+    for index, track in enumerate(inputs[0].tracks):
+        merged = _merge_track(inputs, index, data_starts)
+        track_duration = merged.media_duration * movie_timescale // track.timescale
+        movie_duration = max(movie_duration, track_duration)
+        traks.append(_trak(data, track.trak, merged, track_duration, use_co64))
+
+    payload = b''
+    for box in iter_boxes(data, moov.payload_offset, moov.end):
+        if box.type == b'mvhd':
+            payload += _patch_duration(data, box, 16, 24, movie_duration)
+        elif box.type == b'trak':
+            payload += traks.pop(0)
+        else:
+            payload += bytes(data[box.offset:box.end])
+    return _box(b'moov', payload)
+
+
+def concat_mp4(video_files: List[str], destination: str,
+               cancel_event: Optional[threading.Event] = None) -> None:
+    """Join MP4 files with identical stream parameters into one file.
+
+    The sample tables of every input are merged into a new moov, which is written
+    at the front of the output, followed by a single mdat holding the media data
+    of every input in order. The media data is copied with copy_file_range where
+    the filesystem allows, so it never passes through Python. The output is
+    written to a .part file and renamed into place once complete.
+
+    Args:
+        video_files (List[str]): The files to join, in order.
+        destination (str): The output file.
+        cancel_event (Optional[threading.Event]): Set it to stop the join.
+
+    Raises:
+        IncompatibleInputs: If the files cannot be joined without ffmpeg. Nothing is written.
+        Mp4Error: If an input is not a readable MP4 file, including tables that are
+            cut short or point outside the file. Nothing is written.
+        JobCancelled: If the join is cancelled. The partial output is removed.
+    """
+    inputs: List[Mp4Input] = []
+    try:
+        try:
+            for path in video_files:
+                inputs.append(Mp4Input(path))
+            check_compatible(inputs)
+            header, total_mdat = _build_header(inputs)
+        except Mp4Error:
+            raise
+        except (IndexError, KeyError, OverflowError, ValueError, struct.error) as e:
+            raise Mp4Error(f"Malformed MP4 input: {e!r}") from e
+        _write(inputs, destination, header, total_mdat, cancel_event)
+    finally:
+        for source in inputs:
+            source.close()
+
+
+def _build_header(inputs: List[Mp4Input]) -> Tuple[bytes, int]:
+    """Build the ftyp, moov and mdat header of the output and count the media bytes after it."""
+    ftyp = inputs[0].ftyp
+    total_mdat = sum(source.mdat_bytes for source in inputs)
+    mdat_header = struct.pack('>I4sQ', 1, b'mdat', 16 + total_mdat)
+    # Measured with 64-bit offsets, which hold any offset; 32-bit ones are used
+    # when even this larger moov leaves every offset below 4 GiB
+    moov = build_moov(inputs, 0, True)
+    use_co64 = len(ftyp) + len(moov) + len(mdat_header) + total_mdat > UINT32_MAX
+    if not use_co64:
+        moov = build_moov(inputs, 0, False)
+    # The moov size does not depend on the offsets, so it can be built again in place
+    moov = build_moov(inputs, len(ftyp) + len(moov) + len(mdat_header), use_co64)
+    return ftyp + moov + mdat_header, total_mdat
+
+
+def _write(inputs: List[Mp4Input], destination: str, header: bytes, total_mdat: int,
+           cancel_event: Optional[threading.Event]) -> None:
+    partial = partial_path(destination)
+    with tqdm(total=total_mdat, unit='B', unit_scale=True,
+              desc=os.path.basename(destination)) as pbar:
+        def update(num_bytes: int) -> None:
+            if cancel_event is not None and cancel_event.is_set():
+                raise JobCancelled(f"Joining {os.path.basename(destination)} was cancelled")
+            pbar.update(num_bytes)
+
+        try:
+            with open(partial, 'wb') as dst:
+                dst.write(header)
+                dst.flush()
+                for source in inputs:
+                    with open(source.path, 'rb') as src:
+                        for box in sorted(source.mdats, key=lambda box: box.offset):
+                            copy_range(src, dst, box.payload_offset, box.end, update)
+                os.fsync(dst.fileno())
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+    os.replace(partial, destination)
+    logger.info("Joined %d files into %s (%d bytes of media data)", len(inputs), destination,
+                total_mdat)
@@ -1,86 +1,484 @@
 """Module to organize videos by date."""
 
+import errno
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import mimetypes
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from rich.console import Console
+from rich.table import Table
+from catalog import ClipFilter, MediaCatalog
+from config import get_config_int
 from logging_setup import setup_logger
+from metrics import job, span
+from mp4 import read_creation_time
+from proxies import move_proxies, proxy_directory_name
+from snapshot import OrganizeSnapshot
 
 logger = setup_logger(__name__)
 
-# Function to move video files into folders based on their creation date
+DEFAULT_ORGANIZE_WORKERS = 8
+LEGACY_DATE_FORMAT = '%m-%d-%Y'
+DATE_FORMAT = '%Y-%m-%d'
+# Errors of os.link meaning hard links cannot be made here, as opposed to the name being taken
+_NO_LINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK,
+                   errno.ENOSYS}
 
+# Function to move video files into folders based on their capture date
 
-def organize_videos_by_date(directory):
+
+class PlannedMove(NamedTuple):
+    """A clip and the date folder it will be moved into."""
+    source: str
+    destination: str
+    date: str
+
+
+class OrganizePlan(NamedTuple):
+    """Everything organize_videos_by_date will change in a directory.
+
+    Attributes:
+        directory (str): The directory being organized.
+        renames (List[Tuple[str, str]]): Legacy %m-%d-%Y folders and their new names.
+        directories (List[str]): Date folders that have to be created.
+        moves (List[PlannedMove]): Clips to move into date folders.
+        conflicts (List[PlannedMove]): Clips that are left where they are because their
+            date folder already holds a file of the same name.
+    """
+    directory: str
+    renames: List[Tuple[str, str]]
+    directories: List[str]
+    moves: List[PlannedMove]
+    conflicts: List[PlannedMove]
+
+
+def capture_date(file_path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """Get the date a clip was shot.
+
+    The creation time recorded by the camera in the clip's mvhd/tkhd boxes is
+    used when present; otherwise the file's ctime is used.
+
+    Args:
+        file_path (str): The clip.
+        stat_result (Optional[os.stat_result]): An existing stat of the clip, if any.
+
+    Returns:
+        str: The date formatted as YYYY-MM-DD.
     """
-    Organize video files into folders based on their creation date.
+    creation_time = read_creation_time(file_path)
+    if creation_time is None:
+        ctime = stat_result.st_ctime if stat_result else os.path.getctime(file_path)
+        creation_time = datetime.fromtimestamp(ctime)
+    return creation_time.strftime(DATE_FORMAT)
+
+
+def plan_organize(directory: str, workers: Optional[int] = None) -> OrganizePlan:
+    """Work out which folders to rename or create and which clips to move.
+
+    The clips and their capture dates come from the media catalog, which is
+    refreshed first; only clips that are new or changed since the last refresh
+    are opened, in parallel, and an unchanged directory is not listed at all.
 
     Args:
         directory (str): The directory to organize videos in.
+        workers (Optional[int]): The number of clips read at once. Defaults to the
+            organize_workers setting.
 
     Returns:
-        None
+        OrganizePlan: The changes to make. Nothing is changed on disk.
     """
-    # Ensure the directory exists
-    if not os.path.exists(directory):
-        logger.error("Directory does not exist: %s", directory)
-        return
+    directory = os.path.abspath(directory)
+    workers = workers or get_config_int('organize_workers', DEFAULT_ORGANIZE_WORKERS)
+    catalog = MediaCatalog()
+    try:
+        with span('scan', directory) as scan_span:
+            catalog.refresh(directory, recursive=False, workers=workers)
+            folders = set(catalog.subdirectories(directory))
+            clips = [entry for entry in catalog.query(ClipFilter(directory=directory))
+                     if entry.path.lower().endswith('.mp4')]
+            scan_span.add(files=len(clips))
+    finally:
+        catalog.close()
 
-    logger.info('Starting to organize videos in directory: %s', directory)
+    with span('plan', directory, files=len(clips)):
+        renames = _legacy_renames(directory, folders)
+
+        moves = []
+        conflicts = []
+        new_folders = []
+        taken = _TakenNames()
+        for entry in sorted(clips, key=lambda clip: clip.path):
+            date = (entry.captured.strftime(DATE_FORMAT) if entry.captured
+                    else capture_date(entry.path))
+            if date not in folders:
+                folders.add(date)
+                new_folders.append(os.path.join(directory, date))
+            move = PlannedMove(entry.path,
+                               os.path.join(directory, date, os.path.basename(entry.path)), date)
+            if taken.claim(move.destination):
+                moves.append(move)
+            else:
+                logger.warning("Not moving %s: %s already exists", move.source, move.destination)
+                conflicts.append(move)
+
+    logger.info("Planned %d folder renames, %d new folders, %d moves and %d conflicts in %s",
+                len(renames), len(new_folders), len(moves), len(conflicts), directory)
+    return OrganizePlan(directory, renames, new_folders, moves, conflicts)
+
+
+class _TakenNames:
+    """The file names in date folders, on disk or assigned by the plan being made."""
 
-    # Check and rename existing directories
-    for item in os.listdir(directory):
-        item_path = os.path.join(directory, item)
-        if os.path.isdir(item_path):
+    def __init__(self) -> None:
+        self._names: Dict[str, Set[str]] = {}
+
+    def names(self, folder: str) -> Set[str]:
+        """The names taken in a folder, listing it the first time it is asked for."""
+        if folder not in self._names:
             try:
-                old_date = datetime.strptime(item, '%m-%d-%Y')
-                new_date = old_date.strftime('%Y-%m-%d')
-                new_date_directory = os.path.join(directory, new_date)
-                if not os.path.exists(new_date_directory):
-                    logger.info('Renaming directory %s to %s', item, new_date)
-                    os.rename(item_path, new_date_directory)
-            except ValueError:
-                continue
-
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-
-        logger.info("Processing file: %s", filename)
-
-        # Ignore folders, .toproj, and .bat files
-        if not os.path.isfile(file_path) or file_path.endswith('.toproj') or file_path.endswith('.bat'):
-            logger.info(
-                "Skipping folder, .toproj file, or .bat file: %s", filename)
+                self._names[folder] = set(os.listdir(folder))
+            except FileNotFoundError:
+                self._names[folder] = set()
+        return self._names[folder]
+
+    def claim(self, destination: str) -> bool:
+        """Assign a destination to a clip, unless the name is taken."""
+        names = self.names(os.path.dirname(destination))
+        name = os.path.basename(destination)
+        if name in names:
+            return False
+        names.add(name)
+        return True
+
+    def claim_unique(self, destination: str) -> str:
+        """Assign a destination to a clip, adding a numeric suffix if the name is taken."""
+        folder = os.path.dirname(destination)
+        names = self.names(folder)
+        stem, extension = os.path.splitext(os.path.basename(destination))
+        candidate = os.path.basename(destination)
+        count = 1
+        while candidate in names:
+            candidate = f"{stem}_{count}{extension}"
+            count += 1
+        names.add(candidate)
+        return os.path.join(folder, candidate)
+
+
+def _legacy_renames(directory: str, folders: set) -> List[Tuple[str, str]]:
+    """Plan renames of %m-%d-%Y folders to %Y-%m-%d, adding the new names to folders."""
+    renames = []
+    for folder in sorted(folders):
+        try:
+            new_name = datetime.strptime(folder, LEGACY_DATE_FORMAT).strftime(DATE_FORMAT)
+        except ValueError:
+            continue
+        if new_name not in folders:
+            renames.append((os.path.join(directory, folder), os.path.join(directory, new_name)))
+            folders.add(new_name)
+    return renames
+
+
+def _is_date_folder(name: str) -> bool:
+    try:
+        datetime.strptime(name, DATE_FORMAT)
+    except ValueError:
+        return False
+    return True
+
+
+class ScannedDirectory(NamedTuple):
+    """A directory listed during an incremental scan."""
+    path: str
+    stat: os.stat_result
+    children: List[str]
+
+
+class IncrementalScan(NamedTuple):
+    """What an incremental scan found.
+
+    Attributes:
+        scanned (List[ScannedDirectory]): The directories that were listed.
+        in_place (List[Tuple[str, os.stat_result]]): New clips already in a date folder.
+        clips (List[Tuple[str, os.stat_result]]): New clips to move into a date folder.
+    """
+    scanned: List[ScannedDirectory]
+    in_place: List[Tuple[str, os.stat_result]]
+    clips: List[Tuple[str, os.stat_result]]
+
+
+def _scan_changed(root: str, snapshot: OrganizeSnapshot, renamed: Set[str]) -> IncrementalScan:
+    """Walk a tree, listing only the directories that changed since the snapshot."""
+    proxy_folder = proxy_directory_name()
+    found = IncrementalScan([], [], [])
+    stack = [(root, False)]
+    while stack:
+        path, in_date_folder = stack.pop()
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            snapshot.forget_directory(path)
+            continue
+        known_children = snapshot.unchanged_children(path, stat_result) if path != root else None
+        if known_children is not None:
+            stack.extend((child, in_date_folder) for child in known_children)
             continue
+        children = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if (entry.name.startswith('.') or entry.name == proxy_folder
+                            or entry.path in renamed):
+                        continue
+                    children.append(entry.path)
+                    stack.append((entry.path, in_date_folder
+                                  or (path == root and _is_date_folder(entry.name))))
+                elif entry.is_file() and entry.name.lower().endswith('.mp4'):
+                    entry_stat = entry.stat()
+                    if snapshot.file_unchanged(entry.path, entry_stat):
+                        continue
+                    if in_date_folder:
+                        found.in_place.append((entry.path, entry_stat))
+                    else:
+                        found.clips.append((entry.path, entry_stat))
+        found.scanned.append(ScannedDirectory(path, stat_result, children))
+    return found
+
+
+def _plan_moves(root: str, clips: List[Tuple[str, os.stat_result]], folders: Set[str],
+                workers: Optional[int] = None) -> Tuple[List[PlannedMove], List[str]]:
+    """Plan the moves of new clips into date folders, adding new folders to folders.
+
+    Returns:
+        Tuple[List[PlannedMove], List[str]]: The moves and the folders to create.
+    """
+    workers = workers or get_config_int('organize_workers', DEFAULT_ORGANIZE_WORKERS)
+    with ThreadPoolExecutor(max_workers=max(1, workers),
+                            thread_name_prefix="organize") as executor:
+        dates = list(executor.map(lambda clip: capture_date(*clip), clips))
+
+    moves = []
+    new_folders = []
+    taken = _TakenNames()
+    for (path, _), date in sorted(zip(clips, dates)):
+        if date not in folders:
+            folders.add(date)
+            new_folders.append(os.path.join(root, date))
+        destination = taken.claim_unique(os.path.join(root, date, os.path.basename(path)))
+        if os.path.basename(destination) != os.path.basename(path):
+            logger.info("%s is taken in %s, moving %s as %s", os.path.basename(path), date, path,
+                        os.path.basename(destination))
+        moves.append(PlannedMove(path, destination, date))
+    return moves, new_folders
+
 
-        # Skip files that are not .mp4
-        if not filename.lower().endswith('.mp4'):
-            logger.info("Skipping non-.mp4 file: %s", filename)
+def plan_incremental(directory: str, snapshot: OrganizeSnapshot, workers: Optional[int] = None
+                     ) -> Tuple[OrganizePlan, IncrementalScan]:
+    """Plan an organize run over a whole tree, looking only at what changed.
+
+    Directories whose inode and mtime match the snapshot are not listed again;
+    only their recorded subdirectories are visited. Clips that match the snapshot
+    are skipped without being opened. New clips inside a date folder are already
+    organized and are only recorded; new clips anywhere else in the tree are moved
+    into the date folder of their capture date. Clips from different folders can
+    share a name, so a clip whose name is taken in its date folder gets a numeric
+    suffix, e.g. GX010001_1.MP4. Hidden directories, proxy folders
+    and legacy folders about to be renamed are not descended into.
+
+    Args:
+        directory (str): The root directory to organize.
+        snapshot (OrganizeSnapshot): The snapshot of earlier runs.
+        workers (Optional[int]): The number of clips read at once.
+
+    Returns:
+        Tuple[OrganizePlan, IncrementalScan]: The plan, and what the scan found.
+    """
+    root = os.path.abspath(directory)
+    with os.scandir(root) as entries:
+        folders = {entry.name for entry in entries if entry.is_dir()}
+    renames = _legacy_renames(root, folders)
+    found = _scan_changed(root, snapshot, {old_path for old_path, _ in renames})
+    moves, new_folders = _plan_moves(root, found.clips, folders, workers)
+
+    logger.info("Incremental scan of %s listed %d directories and found %d new clips",
+                root, len(found.scanned), len(found.clips) + len(found.in_place))
+    return OrganizePlan(root, renames, new_folders, moves, []), found
+
+
+def _update_snapshot(snapshot: OrganizeSnapshot, plan: OrganizePlan, moved: List[PlannedMove],
+                     found: IncrementalScan) -> None:
+    """Record the result of an incremental run.
+
+    Directories are stat'ed again, since the moves changed their mtimes. A directory
+    that still holds a clip that could not be moved is forgotten, so the next run
+    lists it again and retries the clip.
+    """
+    moved_sources = {move.source for move in moved}
+    retry = {os.path.dirname(move.source) for move in plan.moves
+             if move.source not in moved_sources}
+    for directory in found.scanned:
+        if directory.path in retry:
+            snapshot.forget_directory(directory.path)
+            continue
+        try:
+            stat_result = os.stat(directory.path)
+        except FileNotFoundError:
+            snapshot.forget_directory(directory.path)
             continue
+        snapshot.record_directory(directory.path, stat_result, directory.children)
+    for path, stat_result in found.in_place:
+        snapshot.record_file(path, stat_result)
+    for move in moved:
+        snapshot.forget_file(move.source)
+        snapshot.record_file(move.destination, os.stat(move.destination))
+    snapshot.save()
 
-        mime_type = mimetypes.guess_type(file_path)[0]
-        if mime_type is not None and mime_type.startswith('video'):
-            logger.info("Identified video file: %s", filename)
-
-            creation_time = os.path.getctime(file_path)
-            creation_date = datetime.fromtimestamp(
-                creation_time).strftime('%Y-%m-%d')
-            date_directory = os.path.join(directory, creation_date)
-
-            if not os.path.exists(date_directory):
-                logger.info("Creating new directory for date: %s",
-                            creation_date)
-                os.makedirs(date_directory)
-
-            # Check if the file is already in the correct directory
-            if os.path.abspath(file_path).startswith(os.path.abspath(date_directory)):
-                logger.info(
-                    "File %s is already in the correct directory: %s", filename, date_directory)
-                continue
-
-            logger.info('Moving file %s to directory: %s',
-                        filename, date_directory)
-            shutil.move(file_path, os.path.join(date_directory, filename))
+
+def print_plan(plan: OrganizePlan, console: Console) -> None:
+    """Show a plan as a dry run.
+
+    Args:
+        plan (OrganizePlan): The plan returned by plan_organize.
+        console (Console): The rich console instance for printing messages.
+    """
+    table = Table(title=f"Organize plan for {plan.directory}")
+    table.add_column("Action")
+    table.add_column("From")
+    table.add_column("To")
+    for old_path, new_path in plan.renames:
+        table.add_row("rename", os.path.basename(old_path), os.path.basename(new_path))
+    for folder in plan.directories:
+        table.add_row("create", "", os.path.basename(folder))
+    for move in plan.moves:
+        target = move.date
+        if os.path.basename(move.destination) != os.path.basename(move.source):
+            target = f"{move.date}/{os.path.basename(move.destination)}"
+        table.add_row("move", os.path.relpath(move.source, plan.directory), target)
+    for move in plan.conflicts:
+        table.add_row("conflict", os.path.basename(move.source),
+                      f"{move.date} (name taken, not moved)", style="bold red")
+    console.print(table)
+
+
+def move_no_replace(source: str, destination: str) -> None:
+    """Move a file, failing instead of replacing a file that already exists at the destination.
+
+    On one device the file is hard-linked to its new name, which fails atomically
+    if the name exists, and then unlinked. Where hard links are not available the
+    destination is checked right before the move.
+
+    Raises:
+        FileExistsError: If the destination exists.
+    """
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        if os.path.lexists(destination):
+            raise FileExistsError(errno.EEXIST, "File exists", destination) from e
+        if e.errno == errno.EXDEV:
+            shutil.move(source, destination)
         else:
-            logger.info(
-                'File is not a video or MIME type could not be determined: %s', file_path)
+            os.rename(source, destination)
+        return
+    os.unlink(source)
+
+
+def _move(move: PlannedMove) -> bool:
+    try:
+        move_no_replace(move.source, move.destination)
+    except FileExistsError:
+        logger.warning("Not moving %s: %s already exists", move.source, move.destination)
+        return False
+    except OSError as e:
+        logger.error("Could not move %s to %s: %s", move.source, move.destination, e)
+        return False
+    move_proxies(move.source, move.destination)
+    logger.debug("Moved %s to %s", move.source, move.destination)
+    return True
+
+
+def execute_plan(plan: OrganizePlan, workers: Optional[int] = None) -> List[PlannedMove]:
+    """Apply a plan: rename legacy folders, create date folders, then move clips in parallel.
+
+    A clip is never moved onto an existing file; if its destination appeared after
+    the plan was made, or the move fails, the clip stays where it is.
+
+    Args:
+        plan (OrganizePlan): The plan returned by plan_organize.
+        workers (Optional[int]): The number of concurrent moves. Defaults to the
+            organize_workers setting.
+
+    Returns:
+        List[PlannedMove]: The moves that were made.
+    """
+    with span('organize', plan.directory, files=len(plan.moves)):
+        for old_path, new_path in plan.renames:
+            logger.info('Renaming directory %s to %s', old_path, new_path)
+            os.rename(old_path, new_path)
+        for folder in plan.directories:
+            logger.info("Creating new directory for date: %s", os.path.basename(folder))
+            os.makedirs(folder, exist_ok=True)
+        if not plan.moves:
+            return []
+        workers = workers or get_config_int('organize_workers', DEFAULT_ORGANIZE_WORKERS)
+        with ThreadPoolExecutor(max_workers=max(1, workers),
+                                thread_name_prefix="organize") as executor:
+            results = executor.map(_move, plan.moves)
+            moved = [move for move, done in zip(plan.moves, results) if done]
+    logger.info("Moved %d of %d files in %s", len(moved), len(plan.moves), plan.directory)
+    return moved
+
+
+def organize_videos_by_date(directory: str, dry_run: bool = False,
+                            console: Optional[Console] = None,
+                            incremental: bool = False) -> Optional[OrganizePlan]:
+    """
+    Organize video files into folders based on the date they were shot.
+
+    By default only clips at the top level of the directory are organized. In
+    incremental mode the whole tree is walked, but only entries that are new or
+    changed since the last incremental run are looked at.
+
+    Args:
+        directory (str): The directory to organize videos in.
+        dry_run (bool): Only plan the changes and print them instead of applying them.
+        console (Optional[Console]): The rich console instance used to print a dry run and
+            the time spent in each stage.
+        incremental (bool): Whether to use the snapshot of earlier runs and recurse.
+
+    Returns:
+        Optional[OrganizePlan]: The plan that was applied or shown, or None if the
+        directory does not exist.
+    """
+    # Ensure the directory exists
+    if not os.path.exists(directory):
+        logger.error("Directory does not exist: %s", directory)
+        return None
+
+    logger.info('Starting to organize videos in directory: %s', directory)
+    with job('organize', console):
+        if not incremental:
+            plan = plan_organize(directory)
+            if dry_run:
+                print_plan(plan, console or Console())
+            else:
+                execute_plan(plan)
+            return plan
+
+        snapshot = OrganizeSnapshot(directory)
+        try:
+            with span('plan', directory, incremental=True) as plan_span:
+                plan, found = plan_incremental(directory, snapshot)
+                plan_span.add(files=len(plan.moves))
+            if dry_run:
+                print_plan(plan, console or Console())
+            else:
+                moved = execute_plan(plan)
+                _update_snapshot(snapshot, plan, moved, found)
+        finally:
+            snapshot.close()
+        return plan
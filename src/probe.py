@@ -0,0 +1,163 @@
+"""Module to probe video streams with ffprobe and cache the results."""
+
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from typing import Dict, Iterable, NamedTuple, Optional
+import ffmpeg
+from config import get_config_int, get_state_path
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+CACHE_FILENAME = "probe_cache.db"
+DEFAULT_PROBE_WORKERS = 8
+
+
+class StreamInfo(NamedTuple):
+    """The stream parameters of a clip that matter for concatenation.
+
+    Attributes:
+        codec (str): The video codec name, e.g. "h264" or "hevc".
+        width (int): The video width in pixels.
+        height (int): The video height in pixels.
+        frame_rate (str): The video frame rate as a fraction, e.g. "30000/1001".
+        time_base (str): The video stream time base, e.g. "1/90000".
+        pixel_format (str): The pixel format, e.g. "yuvj420p".
+        duration (float): The container duration in seconds.
+        audio_codec (str): The audio codec name, or "" if there is no audio.
+        audio_layout (str): The audio channel layout, e.g. "stereo".
+        audio_sample_rate (int): The audio sample rate, or 0 if there is no audio.
+    """
+    codec: str
+    width: int
+    height: int
+    frame_rate: str
+    time_base: str
+    pixel_format: str
+    duration: float
+    audio_codec: str
+    audio_layout: str
+    audio_sample_rate: int
+
+    @property
+    def fps(self) -> float:
+        """The frame rate as a number."""
+        try:
+            return float(Fraction(self.frame_rate))
+        except (ValueError, ZeroDivisionError):
+            return 0.0
+
+
+def parse_probe(result: dict) -> StreamInfo:
+    """Build a StreamInfo from the JSON output of ffprobe.
+
+    Args:
+        result (dict): The output of ffmpeg.probe.
+
+    Returns:
+        StreamInfo: The parameters of the first video and audio streams.
+    """
+    streams = result.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    return StreamInfo(
+        codec=video.get('codec_name', ''),
+        width=int(video.get('width', 0)),
+        height=int(video.get('height', 0)),
+        frame_rate=video.get('r_frame_rate', '0/1'),
+        time_base=video.get('time_base', ''),
+        pixel_format=video.get('pix_fmt', ''),
+        duration=float(result.get('format', {}).get('duration', 0) or 0),
+        audio_codec=audio.get('codec_name', ''),
+        audio_layout=audio.get('channel_layout', str(audio.get('channels', ''))),
+        audio_sample_rate=int(audio.get('sample_rate', 0) or 0),
+    )
+
+
+class ProbeCache:
+    """SQLite cache of StreamInfo keyed by path, size and mtime."""
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path or get_state_path(CACHE_FILENAME),
+                                     check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime INTEGER NOT NULL, info TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get(self, path: str, stat_result: os.stat_result) -> Optional[StreamInfo]:
+        """Get the cached info of a file, if the file has not changed since it was probed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT info FROM probes WHERE path = ? AND size = ? AND mtime = ?",
+                (path, stat_result.st_size, stat_result.st_mtime_ns)).fetchone()
+        return StreamInfo(**json.loads(row[0])) if row else None
+
+    def put(self, path: str, stat_result: os.stat_result, info: StreamInfo) -> None:
+        """Store the info of a file."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?)",
+                               (path, stat_result.st_size, stat_result.st_mtime_ns,
+                                json.dumps(info._asdict())))
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def probe_files(paths: Iterable[str], workers: Optional[int] = None,
+                cache: Optional[ProbeCache] = None) -> Dict[str, StreamInfo]:
+    """Get the stream info of many files, probing only those not in the cache.
+
+    Cache misses are probed in parallel, each with its own ffprobe process.
+
+    Args:
+        paths (Iterable[str]): The files to probe.
+        workers (Optional[int]): The number of ffprobe processes to run at once.
+            Defaults to the probe_workers setting.
+        cache (Optional[ProbeCache]): The cache to use. Defaults to probe_cache.db
+            next to config.ini.
+
+    Returns:
+        Dict[str, StreamInfo]: The info of each file, keyed by absolute path.
+
+    Raises:
+        ffmpeg.Error: If ffprobe fails on any file.
+    """
+    own_cache = cache is None
+    cache = cache or ProbeCache()
+    try:
+        results: Dict[str, StreamInfo] = {}
+        misses = []
+        for path in {os.path.abspath(path) for path in paths}:
+            stat_result = os.stat(path)
+            info = cache.get(path, stat_result)
+            if info is None:
+                misses.append((path, stat_result))
+            else:
+                results[path] = info
+        logger.info("Probe cache: %d hits, %d misses", len(results), len(misses))
+        if misses:
+            workers = workers or get_config_int('probe_workers', DEFAULT_PROBE_WORKERS)
+            with ThreadPoolExecutor(max_workers=max(1, workers),
+                                    thread_name_prefix="probe") as executor:
+                probed = executor.map(lambda miss: parse_probe(ffmpeg.probe(miss[0])), misses)
+                for (path, stat_result), info in zip(misses, probed):
+                    cache.put(path, stat_result, info)
+                    results[path] = info
+        return results
+    finally:
+        if own_cache:
+            cache.close()
+
+
+def probe_file(path: str) -> StreamInfo:
+    """Get the stream info of a single file, using the cache."""
+    return probe_files([path])[os.path.abspath(path)]
@@ -0,0 +1,265 @@
+"""Module to carry camera proxies and thumbnails along with clips and generate missing ones."""
+
+import os
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Collection, List, NamedTuple, Optional, Tuple
+import ffmpeg
+from rich.console import Console
+from config import get_config_int, get_config_value, get_state_path
+from dedup import fingerprint
+from ffmpeg_job import FFmpegJob, JobCancelled, hwaccel_input_args
+from logging_setup import setup_logger
+from transfer import TransferSettings, transfer_file
+
+logger = setup_logger(__name__)
+
+CACHE_FILENAME = "proxy_cache.db"
+DEFAULT_PROXY_DIRECTORY = "Proxy"
+DEFAULT_PROXY_WORKERS = 2
+PROXY_HEIGHT = 480
+THUMBNAIL_HEIGHT = 240
+PROXY = "proxy"
+THUMBNAIL = "thumbnail"
+
+
+class Sidecars(NamedTuple):
+    """The low-resolution proxy (.LRV) and thumbnail (.THM) a camera wrote for a clip."""
+    proxy: Optional[str]
+    thumbnail: Optional[str]
+
+
+def proxy_directory_name() -> str:
+    """The name of the folder proxies are kept in, next to their clips."""
+    return get_config_value('proxy_directory') or DEFAULT_PROXY_DIRECTORY
+
+
+def sidecar_stems(filename: str) -> List[str]:
+    """The file name stems a camera may have used for the sidecars of a clip.
+
+    GoPro HERO6 and later name the proxy of GX010042.MP4 GL010042.LRV, and its
+    thumbnail GX010042.THM; older models use the clip's own stem for both.
+    """
+    stem = os.path.splitext(filename)[0]
+    stems = [stem]
+    if stem[:2].upper() in ('GX', 'GH'):
+        stems.append('GL' + stem[2:])
+    return stems
+
+
+def find_sidecars(clip: str, names: Optional[Collection[str]] = None) -> Sidecars:
+    """Find the camera sidecars of a clip in its directory.
+
+    Args:
+        clip (str): The clip path.
+        names (Optional[Collection[str]]): The file names in the clip's directory, to
+            avoid listing it once per clip.
+
+    Returns:
+        Sidecars: The sidecar paths, None where the camera did not write one.
+    """
+    directory = os.path.dirname(clip)
+    if names is None:
+        names = os.listdir(directory)
+    by_upper = {name.upper(): name for name in names}
+    found = {}
+    for extension in ('.LRV', '.THM'):
+        for stem in sidecar_stems(os.path.basename(clip)):
+            name = by_upper.get(f"{stem}{extension}".upper())
+            if name:
+                found[extension] = os.path.join(directory, name)
+                break
+    return Sidecars(found.get('.LRV'), found.get('.THM'))
+
+
+def proxy_paths(clip: str) -> Tuple[str, str]:
+    """Get where the proxy and thumbnail of a clip belong: Proxy/<clip>.mp4 and .jpg."""
+    stem = os.path.splitext(os.path.basename(clip))[0]
+    directory = os.path.join(os.path.dirname(clip), proxy_directory_name())
+    return os.path.join(directory, f"{stem}.mp4"), os.path.join(directory, f"{stem}.jpg")
+
+
+def carry_sidecars(sidecars: Sidecars, destination: str, move: bool = True) -> int:
+    """Bring a clip's sidecars along to where the clip was imported.
+
+    The .LRV proxy is an H.264 MP4 and the .THM thumbnail a JPEG, so they are only
+    renamed to Proxy/<clip>.mp4 and Proxy/<clip>.jpg, which editors pick up as
+    proxies of the imported clip.
+
+    Args:
+        sidecars (Sidecars): The sidecars found next to the source clip.
+        destination (str): The imported clip.
+        move (bool): Whether to move the sidecars instead of copying them.
+
+    Returns:
+        int: The number of sidecars carried.
+    """
+    carried = 0
+    for sidecar, target in zip(sidecars, proxy_paths(destination)):
+        if sidecar is None or os.path.exists(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        transfer_file(sidecar, target, settings=TransferSettings(move=move))
+        logger.debug("Carried %s to %s", sidecar, target)
+        carried += 1
+    return carried
+
+
+def move_proxies(source: str, destination: str) -> None:
+    """Move the proxy and thumbnail of a clip that was moved, so they stay next to it."""
+    for old_path, new_path in zip(proxy_paths(source), proxy_paths(destination)):
+        if os.path.exists(old_path) and not os.path.exists(new_path):
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            shutil.move(old_path, new_path)
+            logger.debug("Moved %s to %s", old_path, new_path)
+
+
+class ProxyCache:
+    """SQLite cache of generated proxies and thumbnails, keyed by clip fingerprint."""
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path or get_state_path(CACHE_FILENAME),
+                                     check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS proxies (fingerprint TEXT NOT NULL, kind TEXT NOT NULL, "
+            "path TEXT NOT NULL, PRIMARY KEY (fingerprint, kind))")
+        self._conn.commit()
+
+    def get(self, clip_fingerprint: str, kind: str) -> Optional[str]:
+        """Get a generated file for a clip, if it still exists."""
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM proxies WHERE fingerprint = ? AND kind = ?",
+                                     (clip_fingerprint, kind)).fetchone()
+        return row[0] if row and os.path.exists(row[0]) else None
+
+    def put(self, clip_fingerprint: str, kind: str, path: str) -> None:
+        """Record a generated file for a clip."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO proxies VALUES (?, ?, ?)",
+                               (clip_fingerprint, kind, path))
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def generate(clip: str, kind: str, destination: str,
+             cancel_event: Optional[threading.Event] = None) -> None:
+    """Generate a proxy or thumbnail of a clip with ffmpeg.
+
+    Proxies are small H.264 files at PROXY_HEIGHT lines like a camera's LRV, and
+    thumbnails are the first frame as a JPEG like its THM.
+
+    Raises:
+        ffmpeg.Error: If ffmpeg fails.
+        OSError: If ffmpeg cannot be run.
+        JobCancelled: If the job is cancelled or times out.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    source = ffmpeg.input(clip, **hwaccel_input_args())
+    if kind == PROXY:
+        # 0:a? maps the audio only if there is any, so silent clips get proxies too
+        stream = ffmpeg.output(source.video.filter('scale', -2, PROXY_HEIGHT), source['a?'],
+                               destination, vcodec='libx264', preset='veryfast', crf=28,
+                               acodec='aac', audio_bitrate='96k', movflags='+faststart')
+    else:
+        stream = ffmpeg.output(source.video.filter('scale', -2, THUMBNAIL_HEIGHT), destination,
+                               vframes=1)
+    FFmpegJob(stream, os.path.basename(destination), cancel_event=cancel_event,
+              progress=lambda seconds: None).run()
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def _missing_jobs(clips: List[str], cache: ProxyCache) -> List[Tuple[str, str, str, str]]:
+    """List the (clip, fingerprint, kind, path) of every proxy or thumbnail to generate.
+
+    Files the cache holds for a clip with the same fingerprint are linked instead.
+    """
+    jobs = []
+    for clip in clips:
+        missing = [(kind, path) for kind, path in zip((PROXY, THUMBNAIL), proxy_paths(clip))
+                   if not os.path.exists(path)]
+        if not missing:
+            continue
+        clip_fingerprint = fingerprint(clip)
+        for kind, path in missing:
+            cached = cache.get(clip_fingerprint, kind)
+            if cached:
+                _link_or_copy(cached, path)
+                logger.info("Reused %s of %s from %s", kind, clip, cached)
+            else:
+                jobs.append((clip, clip_fingerprint, kind, path))
+    return jobs
+
+
+def build_missing(clips: List[str], console: Optional[Console] = None,
+                  workers: Optional[int] = None, cache: Optional[ProxyCache] = None) -> int:
+    """Generate the proxies and thumbnails that clips do not have yet.
+
+    Clips whose proxy or thumbnail already exists, for example because the
+    camera's sidecar was carried along, are skipped. A clip that was processed
+    before under another name or in another folder is recognized by its
+    fingerprint and gets a link to the earlier result. The rest are generated by
+    up to proxy_workers ffmpeg processes at once.
+
+    Args:
+        clips (List[str]): The clips.
+        console (Optional[Console]): The rich console instance for printing messages.
+        workers (Optional[int]): The number of ffmpeg processes. Defaults to the
+            proxy_workers setting.
+        cache (Optional[ProxyCache]): The cache to use. Defaults to proxy_cache.db
+            next to config.ini.
+
+    Returns:
+        int: The number of files that were generated.
+    """
+    own_cache = cache is None
+    cache = cache or ProxyCache()
+    try:
+        jobs = _missing_jobs(clips, cache)
+        if not jobs:
+            return 0
+
+        workers = workers or get_config_int('proxy_workers', DEFAULT_PROXY_WORKERS)
+        if console:
+            console.print(f"Generating {len(jobs)} missing proxies and thumbnails, "
+                          f"{workers} at a time.", style="bold green")
+        cancel_event = threading.Event()
+
+        def run_job(job: Tuple[str, str, str, str]) -> bool:
+            clip, clip_fingerprint, kind, path = job
+            try:
+                generate(clip, kind, path, cancel_event)
+            except ffmpeg.Error as e:
+                logger.error("Could not generate the %s of %s: %s", kind, clip, e)
+                return False
+            except OSError as e:
+                logger.warning("Could not run ffmpeg to generate the %s of %s: %s", kind, clip, e)
+                return False
+            cache.put(clip_fingerprint, kind, path)
+            return True
+
+        with ThreadPoolExecutor(max_workers=max(1, workers),
+                                thread_name_prefix="proxy") as executor:
+            try:
+                generated = sum(executor.map(run_job, jobs))
+            except (JobCancelled, KeyboardInterrupt):
+                cancel_event.set()
+                raise
+        logger.info("Generated %d of %d proxies and thumbnails", generated, len(jobs))
+        return generated
+    finally:
+        if own_cache:
+            cache.close()
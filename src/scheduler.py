@@ -0,0 +1,117 @@
+"""Module to schedule file transfers across the devices they read from and write to."""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+Transfer = Tuple[str, str]
+TransferTask = Callable[[str, str, str], None]
+
+
+def group_by_device(transfers: List[Transfer]) -> Dict[int, List[Transfer]]:
+    """Group transfers by the device their source lives on.
+
+    Args:
+        transfers (List[Transfer]): (source, destination) path pairs.
+
+    Returns:
+        Dict[int, List[Transfer]]: The transfers of each source device, in their original order.
+    """
+    groups: Dict[int, List[Transfer]] = {}
+    for source, destination in transfers:
+        groups.setdefault(os.stat(source).st_dev, []).append((source, destination))
+    return groups
+
+
+class DeviceScheduler:  # pylint: disable=too-few-public-methods
+    """Runs transfers from different devices in parallel and limits each device.
+
+    Every source device gets its own lanes, up to device_workers, which take
+    transfers from that device's queue in order. A lane never waits on another
+    device's work, so a slow card reader cannot hold up a fast one. Writes to each
+    destination device are limited to destination_workers at a time so that many
+    readers do not turn a shared destination disk into a seek storm. When a
+    transfer fails, the other lanes finish the transfer they are running and
+    start no more.
+    """
+
+    def __init__(self, device_workers: int, destination_workers: Optional[int] = None) -> None:
+        self.device_workers = max(1, device_workers)
+        self.destination_workers = destination_workers
+        self._lock = threading.Lock()
+        self._destination_slots: Dict[int, threading.BoundedSemaphore] = {}
+
+    def _destination_slot(self, destination: str) -> Optional[threading.BoundedSemaphore]:
+        if not self.destination_workers:
+            return None
+        device = os.stat(os.path.dirname(os.path.abspath(destination))).st_dev
+        with self._lock:
+            if device not in self._destination_slots:
+                self._destination_slots[device] = threading.BoundedSemaphore(
+                    self.destination_workers)
+            return self._destination_slots[device]
+
+    def run(self, transfers: List[Transfer], task: TransferTask) -> None:
+        """Run a task for every transfer.
+
+        Args:
+            transfers (List[Transfer]): (source, destination) path pairs.
+            task (TransferTask): Called with the source, destination and the name of
+                the lane running it.
+
+        Raises:
+            Exception: The first error raised by a task, after all lanes have stopped.
+            KeyboardInterrupt: If interrupted, once the running transfers have finished.
+        """
+        stop = threading.Event()
+        groups = group_by_device(transfers)
+        lanes = []
+        for device, group in groups.items():
+            queue: Deque[Transfer] = deque(group)
+            for lane in range(min(self.device_workers, len(group))):
+                lanes.append((f"dev{device:x}-{lane}", queue))
+        logger.info("Scheduling %d transfers from %d devices on %d lanes",
+                    len(transfers), len(groups), len(lanes))
+
+        with ThreadPoolExecutor(max_workers=max(1, len(lanes)),
+                                thread_name_prefix="import") as executor:
+            futures = [executor.submit(self._drain, name, queue, task, stop)
+                       for name, queue in lanes]
+            try:
+                errors = [future.exception() for future in futures]
+            except BaseException:
+                # Ctrl+C reaches only this thread; stop the lanes before waiting for them
+                stop.set()
+                for future in futures:
+                    future.cancel()
+                raise
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _drain(self, name: str, queue: Deque[Transfer], task: TransferTask,
+               stop: threading.Event) -> None:
+        try:
+            while not stop.is_set():
+                try:
+                    source, destination = queue.popleft()
+                except IndexError:
+                    return
+                slot = self._destination_slot(destination)
+                if slot is None:
+                    task(source, destination, name)
+                    continue
+                with slot:
+                    if stop.is_set():
+                        return
+                    task(source, destination, name)
+        except BaseException:
+            if not stop.is_set():
+                logger.warning("Stopping all lanes after a failed transfer on %s", name)
+                stop.set()
+            raise
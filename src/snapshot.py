@@ -0,0 +1,100 @@
+"""Module to remember what the organizer has already seen in a directory tree."""
+
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+from config import get_state_path
+from logging_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+SNAPSHOT_FILENAME = "organize_snapshot.db"
+
+EntryState = Tuple[int, int, int]
+
+
+def entry_state(stat_result: os.stat_result) -> EntryState:
+    """The (inode, size, mtime) triple used to detect changed entries."""
+    return stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+class OrganizeSnapshot:
+    """SQLite snapshot of the directories and clips under one organized root.
+
+    Files are keyed by path and remember their inode, size and mtime. Directories
+    also remember their subdirectories, so an unchanged directory can be skipped
+    without listing it while its subdirectories are still visited.
+    """
+
+    def __init__(self, root: str, db_path: Optional[str] = None) -> None:
+        self.root = os.path.abspath(root)
+        self._conn = sqlite3.connect(db_path or get_state_path(SNAPSHOT_FILENAME))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (root TEXT NOT NULL, path TEXT NOT NULL, "
+            "inode INTEGER, size INTEGER, mtime INTEGER, PRIMARY KEY (root, path))")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS directories (root TEXT NOT NULL, path TEXT NOT NULL, "
+            "inode INTEGER, mtime INTEGER, children TEXT, PRIMARY KEY (root, path))")
+        self._files: Dict[str, EntryState] = {
+            path: (inode, size, mtime) for path, inode, size, mtime in self._conn.execute(
+                "SELECT path, inode, size, mtime FROM files WHERE root = ?", (self.root,))}
+        self._directories: Dict[str, Tuple[int, int, List[str]]] = {
+            path: (inode, mtime, json.loads(children))
+            for path, inode, mtime, children in self._conn.execute(
+                "SELECT path, inode, mtime, children FROM directories WHERE root = ?",
+                (self.root,))}
+        logger.info("Loaded organize snapshot of %s: %d directories, %d files",
+                    self.root, len(self._directories), len(self._files))
+
+    def file_unchanged(self, path: str, stat_result: os.stat_result) -> bool:
+        """Whether a file was seen before with the same inode, size and mtime."""
+        return self._files.get(path) == entry_state(stat_result)
+
+    def unchanged_children(self, path: str, stat_result: os.stat_result) -> Optional[List[str]]:
+        """Get the subdirectories of a directory whose listing has not changed.
+
+        Args:
+            path (str): The directory path.
+            stat_result (os.stat_result): The current stat of the directory.
+
+        Returns:
+            Optional[List[str]]: The recorded subdirectories, or None if the directory
+            is new or its contents changed and it has to be listed again.
+        """
+        recorded = self._directories.get(path)
+        if recorded is None or recorded[:2] != (stat_result.st_ino, stat_result.st_mtime_ns):
+            return None
+        return recorded[2]
+
+    def record_directory(self, path: str, stat_result: os.stat_result, children: List[str]) -> None:
+        """Record the state and subdirectories of a listed directory."""
+        self._directories[path] = (stat_result.st_ino, stat_result.st_mtime_ns, children)
+        self._conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                           (self.root, path, stat_result.st_ino, stat_result.st_mtime_ns,
+                            json.dumps(children)))
+
+    def forget_directory(self, path: str) -> None:
+        """Forget a directory, so that the next run lists it again."""
+        self._directories.pop(path, None)
+        self._conn.execute("DELETE FROM directories WHERE root = ? AND path = ?", (self.root, path))
+
+    def record_file(self, path: str, stat_result: os.stat_result) -> None:
+        """Record the state of an organized file."""
+        state = entry_state(stat_result)
+        self._files[path] = state
+        self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                           (self.root, path) + state)
+
+    def forget_file(self, path: str) -> None:
+        """Forget a file that was moved or deleted."""
+        self._files.pop(path, None)
+        self._conn.execute("DELETE FROM files WHERE root = ? AND path = ?", (self.root, path))
+
+    def save(self) -> None:
+        """Write the recorded changes to disk."""
+        self._conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection without saving pending changes."""
+        self._conn.close()
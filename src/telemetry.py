@@ -0,0 +1,431 @@
+"""Module to extract GoPro GPMF telemetry (GPS, accelerometer, gyro) from clips."""
+
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+import numpy as np
+from logging_setup import setup_logger
+from mp4 import Mp4Error
+from mp4concat import Mp4Input, TrackTables
+
+logger = setup_logger(__name__)
+
+GPMF_SAMPLE_ENTRY = b'gpmd'
+# GPMF value types and the big-endian NumPy dtypes they are stored as
+GPMF_DTYPES = {
+    'b': '>i1', 'B': '>u1', 's': '>i2', 'S': '>u2', 'l': '>i4', 'L': '>u4',
+    'j': '>i8', 'J': '>u8', 'f': '>f4', 'd': '>f8', 'q': '>i4', 'Q': '>i8',
+}
+# Fixed-point types: q is Q15.16 and Q is Q31.32
+GPMF_FIXED_POINT = {'q': 1 << 16, 'Q': 1 << 32}
+GPS_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc).timestamp()
+COLUMNS = {
+    'GPS5': ['latitude', 'longitude', 'altitude', 'speed_2d', 'speed_3d'],
+    'GPS9': ['latitude', 'longitude', 'altitude', 'speed_2d', 'speed_3d',
+             'days', 'seconds', 'dop', 'fix'],
+}
+
+
+class TelemetryStream(NamedTuple):
+    """One sensor stream of a clip, such as GPS5 or ACCL.
+
+    Attributes:
+        key (str): The GPMF FourCC of the data, e.g. "GPS5".
+        name (Optional[str]): The stream name the camera recorded (STNM).
+        columns (List[str]): A name for each column of values.
+        units (List[str]): The unit of each column, where the camera recorded them.
+        times (np.ndarray): The time of each row in seconds from the start of the clip.
+        values (np.ndarray): The scaled values, one row per sample.
+        utc (Optional[np.ndarray]): The UTC time of each row as seconds since the
+            epoch, for GPS streams.
+    """
+    key: str
+    name: Optional[str]
+    columns: List[str]
+    units: List[str]
+    times: np.ndarray
+    values: np.ndarray
+    utc: Optional[np.ndarray] = None
+
+
+def find_gpmf_track(source: Mp4Input) -> TrackTables:
+    """Find the GPMF metadata track of a clip.
+
+    Raises:
+        Mp4Error: If the clip has no GPMF track.
+    """
+    for track in source.tracks:
+        if track.stsd[20:24] == GPMF_SAMPLE_ENTRY:
+            return track
+    raise Mp4Error(f"{source.path} has no GPMF telemetry track")
+
+
+def sample_layout(track: TrackTables) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Work out where every sample of a track is stored and when it plays.
+
+    Args:
+        track (TrackTables): The sample tables of the track.
+
+    Returns:
+        Tuple: The file offset and size of every sample, and its start time and
+        duration in seconds.
+    """
+    count = track.sample_count
+    if track.sample_size:
+        sizes = np.full(count, track.sample_size, dtype=np.int64)
+    else:
+        sizes = np.frombuffer(track.sizes, dtype=np.uint32).astype(np.int64)
+    chunk_offsets = np.frombuffer(track.chunk_offsets, dtype=np.uint64).astype(np.int64)
+
+    stsc = np.frombuffer(track.stsc, dtype=np.uint32).astype(np.int64).reshape(-1, 3)
+    first_chunks = stsc[:, 0] - 1
+    runs = np.diff(np.append(first_chunks, len(chunk_offsets)))
+    samples_per_chunk = np.repeat(stsc[:, 1], runs)
+    chunk_of_sample = np.repeat(np.arange(len(chunk_offsets)), samples_per_chunk)[:count]
+    first_sample_of_chunk = np.cumsum(samples_per_chunk) - samples_per_chunk
+    before = np.cumsum(sizes) - sizes
+    offsets = (chunk_offsets[chunk_of_sample] + before
+               - before[first_sample_of_chunk[chunk_of_sample]])
+
+    stts = np.frombuffer(track.stts, dtype=np.uint32).astype(np.int64)
+    durations = np.repeat(stts[1::2], stts[0::2])[:count] / track.timescale
+    starts = np.cumsum(durations) - durations
+    return offsets, sizes, starts, durations
+
+
+class _Klv(NamedTuple):
+    """The header of a GPMF key-length-value entry and the offset of its data."""
+    fourcc: str
+    value_type: str
+    sample_size: int
+    repeat: int
+    offset: int
+
+    @property
+    def end(self) -> int:
+        """The offset of the first byte after the data."""
+        return self.offset + self.sample_size * self.repeat
+
+
+class _Sample(NamedTuple):
+    """The start time and duration in seconds of one sample of the GPMF track."""
+    start: float
+    duration: float
+
+
+class _SampleFormat(NamedTuple):
+    """How the values of a stream are stored: GPMF type, bytes per sample and TYPE."""
+    value_type: str
+    sample_size: int
+    complex_type: Optional[str]
+
+
+ScaleKey = Tuple[str, int, int, bytes]
+
+
+class _Payload(NamedTuple):
+    """The samples one GPMF payload holds for a stream."""
+    raw: bytes
+    count: int
+    scale: Optional[ScaleKey]
+    sample: _Sample
+    gps_time: Optional[float]
+
+
+def _klv_headers(data, start: int, end: int) -> Iterator[_Klv]:
+    """Yield the header of each KLV in a range."""
+    offset = start
+    while offset + 8 <= end:
+        fourcc, value_type, sample_size, repeat = struct.unpack_from('>4scBH', data, offset)
+        yield _Klv(fourcc.decode('latin-1'), value_type.decode('latin-1'), sample_size, repeat,
+                   offset + 8)
+        offset += 8 + (sample_size * repeat + 3) // 4 * 4
+
+
+def _strings(data, offset: int, sample_size: int, repeat: int) -> List[str]:
+    raw = bytes(data[offset:offset + sample_size * repeat])
+    return [raw[i:i + sample_size].decode('latin-1').strip('\0 ')
+            for i in range(0, len(raw), sample_size)]
+
+
+def _text(data, klv: _Klv) -> str:
+    """Decode the data of a KLV as a single string."""
+    return _strings(data, klv.offset, klv.sample_size * klv.repeat, 1)[0]
+
+
+def _numbers(raw: bytes, value_type: str, sample_size: int, repeat: int,
+             complex_type: Optional[str] = None) -> Optional[np.ndarray]:
+    """Decode the data of a numeric KLV into a float array with one row per sample."""
+    if value_type == '?':
+        if not complex_type or '[' in complex_type or not set(complex_type) <= GPMF_DTYPES.keys():
+            return None
+        dtype = np.dtype([(f"f{i}", GPMF_DTYPES[c]) for i, c in enumerate(complex_type)])
+        if dtype.itemsize != sample_size:
+            return None
+        records = np.frombuffer(raw, dtype=dtype, count=repeat)
+        divisors = [GPMF_FIXED_POINT.get(c, 1) for c in complex_type]
+        return np.column_stack([records[name].astype(np.float64) / divisor
+                                for name, divisor in zip(dtype.names, divisors)])
+    dtype = GPMF_DTYPES.get(value_type)
+    if dtype is None:
+        return None
+    values = np.frombuffer(raw, dtype=dtype).astype(np.float64)
+    values /= GPMF_FIXED_POINT.get(value_type, 1)
+    return values.reshape(repeat, -1)
+
+
+def _gps_time(text: str) -> Optional[float]:
+    """Parse a GPSU yymmddhhmmss.sss timestamp into seconds since the epoch."""
+    try:
+        parsed = datetime.strptime(text[:16], '%y%m%d%H%M%S.%f')
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+class _StreamParts:
+    """The raw data of one stream collected from every payload, decoded at once at the end."""
+
+    def __init__(self, key: str, sample_format: _SampleFormat) -> None:
+        self.key = key
+        self.sample_format = sample_format
+        self.name: Optional[str] = None
+        self.units: List[str] = []
+        self.orientation: Optional[str] = None
+        self.payloads: List[_Payload] = []
+
+    def describe(self, data, metadata: Dict[str, _Klv]) -> None:
+        """Take the name, units and axis order of the stream from its STNM, SIUN/UNIT and ORIN."""
+        if 'STNM' in metadata:
+            self.name = _text(data, metadata['STNM'])
+        units = metadata.get('SIUN') or metadata.get('UNIT')
+        if units:
+            self.units = _strings(data, units.offset, units.sample_size, units.repeat)
+        if 'ORIN' in metadata:
+            self.orientation = _text(data, metadata['ORIN'])
+
+    def add(self, raw: bytes, count: int, scale: Optional[ScaleKey], sample: _Sample,
+            gps_time: Optional[float]) -> None:
+        """Add the samples of one payload, with the scale and timing that apply to them."""
+        self.payloads.append(_Payload(raw, count, scale, sample, gps_time))
+
+    def _scale(self, values: np.ndarray, counts: np.ndarray) -> None:
+        """Divide the values by the SCAL of the payload each row came from."""
+        scales = [payload.scale for payload in self.payloads]
+        decoded = {}
+        for key in set(scales):
+            if key is None:
+                decoded[key] = np.ones(values.shape[1])
+                continue
+            scale = _numbers(key[3], key[0], key[1], key[2])
+            scale = np.ones(1) if scale is None else scale.ravel()
+            scale[scale == 0] = 1
+            if len(scale) not in (1, values.shape[1]):
+                scale = np.ones(1)
+            decoded[key] = np.broadcast_to(scale, values.shape[1])
+        if len(decoded) == 1:
+            values /= next(iter(decoded.values()))
+        else:
+            values /= np.repeat(np.stack([decoded[key] for key in scales]), counts, axis=0)
+
+    def _columns(self, width: int) -> List[str]:
+        """Name the columns: known names for GPS, else the axis order, else numbered."""
+        columns = COLUMNS.get(self.key)
+        if columns is not None and len(columns) == width:
+            return columns
+        if self.orientation and len(self.orientation) == width:
+            return [axis.lower() for axis in self.orientation]
+        return [f"{self.key.lower()}_{i}" for i in range(width)]
+
+    def finish(self) -> Optional[TelemetryStream]:
+        """Decode the collected samples into a stream, or None if they cannot be decoded."""
+        counts = np.array([payload.count for payload in self.payloads])
+        total = int(counts.sum())
+        value_type, sample_size, complex_type = self.sample_format
+        values = _numbers(b''.join(payload.raw for payload in self.payloads), value_type,
+                          sample_size, total, complex_type)
+        if values is None:
+            logger.debug("Skipping telemetry stream %s of unsupported type %s%s", self.key,
+                         value_type, f" ({complex_type})" if complex_type else "")
+            return None
+        if not total:
+            return None
+        self._scale(values, counts)
+
+        first_rows = np.cumsum(counts) - counts
+        durations = np.array([payload.sample.duration for payload in self.payloads])
+        steps = np.repeat(durations / np.maximum(counts, 1), counts)
+        offsets = (np.arange(total) - np.repeat(first_rows, counts)) * steps
+        starts = np.array([payload.sample.start for payload in self.payloads])
+        times = np.repeat(starts, counts) + offsets
+
+        gps_times = [payload.gps_time for payload in self.payloads]
+        utc = None
+        if self.key == 'GPS9':
+            utc = GPS_EPOCH + values[:, 5] * 86400 + values[:, 6]
+        elif all(gps_time is not None for gps_time in gps_times):
+            utc = np.repeat(np.array(gps_times), counts) + offsets
+        return TelemetryStream(self.key, self.name, self._columns(values.shape[1]), self.units,
+                               times, values, utc)
+
+
+def _read_stream(data, start: int, end: int, sample: _Sample,
+                 streams: Dict[str, _StreamParts]) -> None:
+    """Collect one STRM: its metadata, then the data KLV that closes it."""
+    scale = None
+    complex_type = None
+    metadata: Dict[str, _Klv] = {}
+    gps_time = None
+    last = None
+    for klv in _klv_headers(data, start, end):
+        if klv.fourcc == 'SCAL':
+            scale = (klv.value_type, klv.sample_size, klv.repeat, bytes(data[klv.offset:klv.end]))
+        elif klv.fourcc == 'TYPE':
+            complex_type = _text(data, klv)
+        elif klv.fourcc in ('STNM', 'SIUN', 'UNIT', 'ORIN'):
+            metadata[klv.fourcc] = klv
+        elif klv.fourcc == 'GPSU':
+            gps_time = _gps_time(_text(data, klv))
+        last = klv
+    if last is None or last.repeat == 0 or last.value_type in ('\0', 'c', 'U', 'F'):
+        return
+    sample_format = _SampleFormat(last.value_type, last.sample_size, complex_type)
+    parts = streams.get(last.fourcc)
+    if parts is None:
+        parts = streams[last.fourcc] = _StreamParts(last.fourcc, sample_format)
+        parts.describe(data, metadata)
+    elif sample_format != parts.sample_format:
+        logger.debug("Skipping %s samples stored as %s%d instead of %s%d", last.fourcc,
+                     last.value_type, last.sample_size, parts.sample_format.value_type,
+                     parts.sample_format.sample_size)
+        return
+    parts.add(bytes(data[last.offset:last.end]), last.repeat, scale, sample, gps_time)
+
+
+def _read_payload(data, start: int, end: int, sample: _Sample,
+                  streams: Dict[str, _StreamParts]) -> None:
+    for klv in _klv_headers(data, start, end):
+        if klv.value_type != '\0':
+            continue
+        payload_end = min(klv.end, end)
+        if klv.fourcc == 'STRM':
+            _read_stream(data, klv.offset, payload_end, sample, streams)
+        else:
+            _read_payload(data, klv.offset, payload_end, sample, streams)
+
+
+def extract_telemetry(path: str) -> Dict[str, TelemetryStream]:
+    """Extract every telemetry stream of a clip.
+
+    The GPMF track is found through the sample tables in the moov box, and only
+    its samples are read from a memory map of the file, so the video and audio
+    data are never touched. The data of each sensor is gathered from every
+    payload and decoded in a single NumPy call.
+
+    Args:
+        path (str): The clip.
+
+    Returns:
+        Dict[str, TelemetryStream]: The streams by FourCC, e.g. "GPS5" or "ACCL".
+
+    Raises:
+        Mp4Error: If the clip is not a readable MP4 file or has no GPMF track.
+    """
+    source = Mp4Input(path)
+    try:
+        offsets, sizes, starts, durations = sample_layout(find_gpmf_track(source))
+    finally:
+        source.close()
+
+    streams: Dict[str, _StreamParts] = {}
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = memoryview(mapped)
+            try:
+                for offset, size, start, duration in zip(offsets.tolist(), sizes.tolist(),
+                                                         starts.tolist(), durations.tolist()):
+                    if offset + size > len(mapped):
+                        raise Mp4Error(f"Telemetry sample at {offset} is past the end of {path}")
+                    _read_payload(data, offset, offset + size, _Sample(start, duration), streams)
+            finally:
+                data.release()
+    logger.info("Extracted %s from %d telemetry samples of %s",
+                ", ".join(sorted(streams)) or "nothing",
+                len(offsets), path)
+    finished = {key: parts.finish() for key, parts in streams.items()}
+    return {key: stream for key, stream in finished.items() if stream is not None}
+
+
+def export_csv(stream: TelemetryStream, destination: str) -> None:
+    """Write a stream as CSV with a time column followed by its values."""
+    header = ['time'] + (['utc'] if stream.utc is not None else []) + stream.columns
+    columns = [stream.times] + ([stream.utc] if stream.utc is not None else [])
+    table = np.column_stack(columns + [stream.values])
+    formats = (['%.6f'] + (['%.3f'] if stream.utc is not None else [])
+               + ['%.9g'] * len(stream.columns))
+    np.savetxt(destination, table, delimiter=',', fmt=formats, header=','.join(header), comments='')
+
+
+def export_columns(stream: TelemetryStream, destination: str) -> None:
+    """Write a stream as a column file: one named array per column in an .npz archive."""
+    columns = {'time': stream.times}
+    if stream.utc is not None:
+        columns['utc'] = stream.utc
+    for index, column in enumerate(stream.columns):
+        columns[column] = stream.values[:, index]
+    np.savez(destination, **columns)
+
+
+def export_gpx(stream: TelemetryStream, destination: str, track_name: str) -> None:
+    """Write a GPS5 or GPS9 stream as a GPX track."""
+    latitude, longitude, altitude = stream.values[:, 0], stream.values[:, 1], stream.values[:, 2]
+    times = None
+    if stream.utc is not None:
+        times = np.datetime_as_string((stream.utc * 1000).astype('datetime64[ms]'), unit='ms')
+    points = []
+    for index in range(len(stream.values)):
+        time = f"<time>{times[index]}Z</time>" if times is not None else ""
+        points.append(f'<trkpt lat="{latitude[index]:.7f}" lon="{longitude[index]:.7f}">'
+                      f'<ele>{altitude[index]:.3f}</ele>{time}</trkpt>')
+    with open(destination, 'w', encoding='utf-8') as gpx:
+        gpx.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<gpx version="1.1" creator="ActionCam Utils"'
+                  ' xmlns="http://www.topografix.com/GPX/1/1">\n'
+                  f'<trk><name>{track_name}</name><trkseg>\n')
+        gpx.write('\n'.join(points))
+        gpx.write('\n</trkseg></trk>\n</gpx>\n')
+
+
+def export_telemetry(path: str, output_directory: str) -> List[str]:
+    """Extract the telemetry of a clip and write it next to each other in a directory.
+
+    Every stream is written as <clip>_<KEY>.csv and <clip>_<KEY>.npz, and the GPS
+    track also as <clip>.gpx.
+
+    Args:
+        path (str): The clip.
+        output_directory (str): The directory to write the files to.
+
+    Returns:
+        List[str]: The files that were written.
+
+    Raises:
+        Mp4Error: If the clip has no readable telemetry.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    streams = extract_telemetry(path)
+    written = []
+    for key, stream in streams.items():
+        base = os.path.join(output_directory, f"{stem}_{key}")
+        export_csv(stream, f"{base}.csv")
+        export_columns(stream, f"{base}.npz")
+        written.extend([f"{base}.csv", f"{base}.npz"])
+    gps = streams.get('GPS9') or streams.get('GPS5')
+    if gps is not None:
+        gpx_path = os.path.join(output_directory, f"{stem}.gpx")
+        export_gpx(gps, gpx_path, stem)
+        written.append(gpx_path)
+    logger.info("Wrote %d telemetry files for %s", len(written), path)
+    return written
@@ -0,0 +1,408 @@
+"""Module to transfer files using the cheapest method the filesystems allow."""
+
+import errno
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Set, Tuple
+from iotune import ChunkTuner, advise_sequential, drop_cached, preallocate
+from journal import ImportJournal, partial_path
+from logging_setup import setup_logger
+from metrics import span
+
+logger = setup_logger(__name__)
+
+RENAME = "rename"
+REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+SENDFILE = "sendfile"
+CHUNKED = "chunked"
+HASHED = "hashed"
+
+CHUNK_SIZE = 1024 * 1024
+KERNEL_CHUNK_SIZE = 8 * 1024 * 1024
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+# ioctl request number for FICLONE (_IOW(0x94, 9, int)) on Linux
+FICLONE = 0x40049409
+
+# Errors meaning "this method is not available here", as opposed to real I/O failures
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                       errno.ENOTTY, errno.EBADF, errno.ENOTSUP}
+
+_unsupported_lock = threading.Lock()
+_unsupported: Set[Tuple[str, int, int]] = set()
+
+ProgressCallback = Callable[[int], None]
+
+
+class VerificationError(OSError):
+    """Raised when a copied file does not match its source checksum."""
+
+
+class TransferResult(NamedTuple):
+    """The method used for a transfer and, when verified, the SHA-256 of the file."""
+    method: str
+    sha256: Optional[str] = None
+
+
+class TransferSettings(NamedTuple):
+    """How a file is transferred.
+
+    Attributes:
+        move (bool): Whether to remove the source once it has been copied.
+        verify (bool): Whether to verify the copy against a checksum of the source.
+    """
+    move: bool = True
+    verify: bool = False
+
+
+def _is_unsupported(method: str, src_dev: int, dst_dev: int) -> bool:
+    with _unsupported_lock:
+        return (method, src_dev, dst_dev) in _unsupported
+
+
+def _mark_unsupported(method: str, src_dev: int, dst_dev: int) -> None:
+    with _unsupported_lock:
+        _unsupported.add((method, src_dev, dst_dev))
+    logger.info("%s unavailable between devices %d and %d", method, src_dev, dst_dev)
+
+
+def _destination_device(destination: str) -> int:
+    return os.stat(os.path.dirname(os.path.abspath(destination))).st_dev
+
+
+def transfer_file(source: str, destination: str, progress: Optional[ProgressCallback] = None,
+                  journal: Optional[ImportJournal] = None,
+                  settings: Optional[TransferSettings] = None) -> TransferResult:
+    """Copy or move a file using the cheapest available method.
+
+    A move on the same device is a rename. Otherwise a reflink is tried, then a
+    kernel-side copy with copy_file_range or sendfile, and finally a chunked copy
+    in Python. The progress callback receives byte counts in every mode.
+
+    Copies are written to a temporary name and renamed into place once complete.
+    With a journal, flushed offsets are recorded as the copy goes, and a partial
+    file left by an interrupted session is resumed instead of copied again.
+
+    With verify, the data is hashed while it streams through the copy, the
+    destination is read back from disk rather than the page cache, and the
+    source is only removed once both checksums match. A rename moves no data, so
+    it is not verified.
+
+    Args:
+        source (str): The source file path.
+        destination (str): The destination file path.
+        progress (Optional[ProgressCallback]): Called with the number of bytes transferred.
+        journal (Optional[ImportJournal]): The journal of the current import session.
+        settings (Optional[TransferSettings]): Whether to move and verify. Defaults to
+            an unverified move.
+
+    Returns:
+        TransferResult: The method used and, when a verified copy was made, the SHA-256
+        of the file.
+    """
+    progress = progress or (lambda num_bytes: None)
+    settings = settings or TransferSettings()
+    src_stat = os.stat(source)
+    dst_dev = _destination_device(destination)
+
+    source_directory = os.path.dirname(os.path.abspath(source))
+    if settings.move and src_stat.st_dev == dst_dev:
+        with span('rename', source_directory, files=1, file=os.path.basename(source)):
+            os.rename(source, destination)
+        progress(src_stat.st_size)
+        logger.debug("Renamed %s to %s", source, destination)
+        return TransferResult(RENAME, None)
+
+    partial = partial_path(destination)
+    offset = journal.resume_offset(source, partial) if journal else 0
+    if offset:
+        logger.info("Resuming %s at byte %d", source, offset)
+        progress(offset)
+    checkpoint = (lambda copied: journal.record_offset(source, copied)) if journal else None
+    digest = None
+    try:
+        with span('transfer', source_directory, src_stat.st_size - offset, 1,
+                  file=os.path.basename(source)) as transfer_span:
+            if settings.verify:
+                digest = hashed_copy(source, partial, progress, offset, checkpoint)
+                method = HASHED
+            else:
+                method = copy_file(source, partial, progress, offset, checkpoint)
+            transfer_span.attributes['method'] = method
+        if settings.verify:
+            copied_digest = verify_checksum(partial)
+            if copied_digest != digest:
+                raise VerificationError(errno.EIO, f"Checksum mismatch for {destination}: "
+                                        f"source {digest}, copy {copied_digest}")
+    except VerificationError:
+        os.remove(partial)
+        raise
+    except BaseException:
+        # Without a journal a partial file can never be resumed, so do not leave it behind
+        if journal is None and os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, destination)
+    if journal:
+        journal.complete(source)
+    if settings.move:
+        os.remove(source)
+    return TransferResult(method, digest)
+
+
+def hashed_copy(source: str, destination: str, progress: ProgressCallback, offset: int = 0,
+                checkpoint: Optional[Callable[[int], None]] = None) -> str:
+    """Copy a file in chunks, computing its SHA-256 as the data streams through.
+
+    When resuming, the already copied prefix is hashed from the source.
+
+    Args:
+        source (str): The source file path.
+        destination (str): The destination file path.
+        progress (ProgressCallback): Called with the number of bytes copied.
+        offset (int): The number of bytes already present in the destination.
+        checkpoint (Optional[Callable[[int], None]]): Called with the copied offset
+            each time the destination has been flushed to disk.
+
+    Returns:
+        str: The hex digest of the source data.
+    """
+    digest = hashlib.sha256()
+    mode = 'r+b' if offset else 'wb'
+    with open(source, 'rb') as src, open(destination, mode) as dst:
+        advise_sequential(src.fileno())
+        remaining = offset
+        while remaining > 0:
+            buffer = src.read(min(CHUNK_SIZE, remaining))
+            if not buffer:
+                break
+            digest.update(buffer)
+            remaining -= len(buffer)
+        dst.seek(offset)
+        dst.truncate()
+        preallocate(dst.fileno(), offset, os.fstat(src.fileno()).st_size - offset)
+        tracker = _CopyTracker(src.fileno(), dst.fileno(), offset, progress, checkpoint)
+        tuner = ChunkTuner()
+        while True:
+            started = time.perf_counter()
+            buffer = src.read(tuner.chunk_size)
+            if not buffer:
+                break
+            digest.update(buffer)
+            dst.write(buffer)
+            tuner.record(len(buffer), time.perf_counter() - started)
+            tracker.update(len(buffer))
+    return digest.hexdigest()
+
+
+def verify_checksum(path: str) -> str:
+    """Read back the checksum of a copy, timed as the verify stage of the running job."""
+    with span('verify', os.path.dirname(os.path.abspath(path)), os.path.getsize(path), 1,
+              file=os.path.basename(path)):
+        return read_checksum(path)
+
+
+def read_checksum(path: str) -> str:
+    """Compute the SHA-256 of a file as stored on disk.
+
+    The file is flushed and its cached pages are dropped before reading, so the
+    checksum reflects what the device returns rather than what is in memory.
+
+    Args:
+        path (str): The file to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        if hasattr(os, 'posix_fadvise'):
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        for buffer in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(buffer)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    return digest.hexdigest()
+
+
+def copy_file(source: str, destination: str, progress: ProgressCallback, offset: int = 0,
+              checkpoint: Optional[Callable[[int], None]] = None) -> str:
+    """Copy a file, trying reflink, kernel-side and chunked copies in that order.
+
+    Args:
+        source (str): The source file path.
+        destination (str): The destination file path.
+        progress (ProgressCallback): Called with the number of bytes copied.
+        offset (int): The number of bytes already present in the destination.
+        checkpoint (Optional[Callable[[int], None]]): Called with the copied offset
+            each time the destination has been flushed to disk.
+
+    Returns:
+        str: The name of the method that was used.
+    """
+    mode = 'r+b' if offset else 'wb'
+    with open(source, 'rb') as src, open(destination, mode) as dst:
+        size = os.fstat(src.fileno()).st_size
+        devices = _devices(src, dst)
+        advise_sequential(src.fileno())
+        tracker = _CopyTracker(src.fileno(), dst.fileno(), offset, progress, checkpoint)
+        for method, copier in ((REFLINK, _reflink), (COPY_FILE_RANGE, _copy_file_range),
+                               (SENDFILE, _sendfile), (CHUNKED, _chunked_copy)):
+            if method == REFLINK and offset:
+                continue
+            if method != CHUNKED and _is_unsupported(method, *devices):
+                continue
+            src.seek(offset)
+            dst.seek(offset)
+            dst.truncate()
+            if method != REFLINK:
+                preallocate(dst.fileno(), offset, size - offset)
+            try:
+                copier(src, dst, size, tracker.update)
+            except OSError as e:
+                if method == CHUNKED or e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                _mark_unsupported(method, *devices)
+                # A kernel copy may have failed part way through; start over
+                tracker.rewind()
+                continue
+            logger.debug("Copied %s to %s using %s", source, destination, method)
+            return method
+    return CHUNKED
+
+
+def _devices(src, dst) -> Tuple[int, int]:
+    """The devices of two open files, which key the methods found not to work between them."""
+    return os.fstat(src.fileno()).st_dev, os.fstat(dst.fileno()).st_dev
+
+
+def _counting(progress: ProgressCallback, copied: List[int]) -> ProgressCallback:
+    """Wrap a progress callback so it also adds up the bytes in copied[0]."""
+    def update(num_bytes: int) -> None:
+        copied[0] += num_bytes
+        progress(num_bytes)
+    return update
+
+
+def copy_range(src, dst, start: int, end: int, progress: ProgressCallback) -> str:
+    """Append a byte range of one open file to another, in the kernel when possible.
+
+    copy_file_range is tried first, then sendfile, then a chunked copy. Anything
+    buffered in dst must be flushed before calling this.
+
+    Args:
+        src: The source file opened in binary mode.
+        dst: The destination file, positioned where the range is to be written.
+        start (int): The offset of the first byte to copy.
+        end (int): The offset after the last byte to copy.
+        progress (ProgressCallback): Called with the number of bytes copied.
+
+    Returns:
+        str: The name of the method that was used.
+    """
+    position = dst.tell()
+    devices = _devices(src, dst)
+    for method, copier in ((COPY_FILE_RANGE, _copy_file_range), (SENDFILE, _sendfile),
+                           (CHUNKED, _chunked_copy)):
+        if method != CHUNKED and _is_unsupported(method, *devices):
+            continue
+        copied = [0]
+        src.seek(start)
+        try:
+            copier(src, dst, end, _counting(progress, copied))
+        except OSError as e:
+            if method == CHUNKED or e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            _mark_unsupported(method, *devices)
+            progress(-copied[0])
+            dst.seek(position)
+            dst.truncate()
+            continue
+        return method
+    return CHUNKED
+
+
+class _CopyTracker:
+    """Forwards progress, drops copied pages from the page cache and flushes the
+    destination every CHECKPOINT_BYTES."""
+
+    def __init__(self, src_fd: int, dst_fd: int, offset: int, progress: ProgressCallback,
+                 checkpoint: Optional[Callable[[int], None]]) -> None:
+        self.src_fd = src_fd
+        self.dst_fd = dst_fd
+        self.start = offset
+        self.offset = offset
+        self.last_checkpoint = offset
+        self.progress = progress
+        self.checkpoint = checkpoint
+
+    def update(self, num_bytes: int) -> None:
+        """Count bytes copied past the current offset."""
+        drop_cached(self.src_fd, self.offset, num_bytes)
+        self.offset += num_bytes
+        self.progress(num_bytes)
+        if self.offset - self.last_checkpoint >= CHECKPOINT_BYTES:
+            if self.checkpoint:
+                os.fdatasync(self.dst_fd)
+                self.checkpoint(self.offset)
+            # Starts writeback of dirty pages and drops those already written
+            drop_cached(self.dst_fd, 0, self.offset)
+            self.last_checkpoint = self.offset
+
+    def rewind(self) -> None:
+        """Take back the progress reported since the start, before the copy is retried."""
+        self.progress(self.start - self.offset)
+        self.offset = self.start
+        self.last_checkpoint = self.start
+
+
+def _reflink(src, dst, size: int, progress: ProgressCallback) -> None:
+    try:
+        import fcntl  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise OSError(errno.ENOTSUP, "reflink is not supported on this platform") from e
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    progress(size)
+
+
+def _copy_file_range(src, dst, size: int, progress: ProgressCallback) -> None:
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    remaining = size - src.tell()
+    while remaining > 0:
+        copied = os.copy_file_range(src.fileno(), dst.fileno(), min(remaining, KERNEL_CHUNK_SIZE))
+        if copied == 0:
+            break
+        remaining -= copied
+        progress(copied)
+
+
+def _sendfile(src, dst, size: int, progress: ProgressCallback) -> None:
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    offset = src.tell()
+    while offset < size:
+        sent = os.sendfile(dst.fileno(), src.fileno(), offset,
+                           min(size - offset, KERNEL_CHUNK_SIZE))
+        if sent == 0:
+            break
+        offset += sent
+        progress(sent)
+
+
+def _chunked_copy(src, dst, size: int, progress: ProgressCallback) -> None:
+    tuner = ChunkTuner()
+    while True:
+        started = time.perf_counter()
+        buffer = src.read(max(0, min(tuner.chunk_size, size - src.tell())))
+        if not buffer:
+            break
+        dst.write(buffer)
+        tuner.record(len(buffer), time.perf_counter() - started)
+        progress(len(buffer))
@@ -2,12 +2,14 @@
 
 import os
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from rich.console import Console
 from rich.prompt import Prompt
 from video_import import select_directory
+from catalog import list_video_files
 from config import save_config, get_config_value
 from logging_setup import setup_logger
+from metrics import span
 
 logger = setup_logger(__name__)
 console = Console()
@@ -40,47 +42,55 @@ def get_unique_filename(directory: str, base_name: str, extension: str) -> str:
 def get_video_files(directory: str) -> List[str]:
     """Get a list of video files in the specified directory.
 
+    The files come from the media catalog, which only lists the directory again
+    if it changed since it was last cataloged.
+
     Args:
         directory (str): The directory to search for video files.
 
     Returns:
-        List[str]: A list of video filenames.
+        List[str]: A list of video filenames, in name order.
     """
     if not os.path.exists(directory):
         logger.error("Directory does not exist: %s", directory)
         return []
 
-    video_extensions = ['.mp4', '.mov', '.avi', '.mkv']
-    video_files = [f for f in os.listdir(directory) if os.path.splitext(f)[
-        1].lower() in video_extensions]
-    logger.info("Found video files in directory '%s': %s",
-                directory, video_files)
+    video_files = list_video_files(directory)
+    logger.info("Found %d video files in directory '%s'", len(video_files), directory)
+    logger.debug("Video files in '%s': %s", directory, video_files)
     return video_files
 
 
-def create_vidlist_file(output_directory: str, video_files: List[str]) -> str:
+def create_vidlist_file(output_directory: str, video_files: List[str],
+                        filename: str = "vidlist.txt",
+                        trims: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None
+                        ) -> str:
     """Create a vidlist.txt file with the list of video files.
 
     Args:
         output_directory (str): The directory to create the vidlist.txt file in.
         video_files (List[str]): The list of video files to include in the vidlist.txt file.
+        filename (str): The name of the list file. Concurrent jobs need distinct names.
+        trims (Optional[Dict[str, Tuple[Optional[float], Optional[float]]]]): The (start, end)
+            in seconds to keep of some files, written as inpoint/outpoint directives.
 
     Returns:
         str: The path to the created vidlist.txt file.
     """
-    vidlist_path = os.path.join(output_directory, "vidlist.txt")
-    with open(vidlist_path, 'w', encoding='utf-8') as vidlist_file:
-        for video_file in video_files:
-            vidlist_file.write(f"file '{video_file}'\n")
+    vidlist_path = os.path.join(output_directory, filename)
+    with span('vidlist', files=len(video_files)):
+        with open(vidlist_path, 'w', encoding='utf-8') as vidlist_file:
+            for video_file in video_files:
+                vidlist_file.write(f"file '{video_file}'\n")
+                start, end = (trims or {}).get(video_file, (None, None))
+                if start:
+                    vidlist_file.write(f"inpoint {start:.6f}\n")
+                if end is not None:
+                    vidlist_file.write(f"outpoint {end:.6f}\n")
 
     logger.info("Created vidlist.txt at %s with %d video files",
                 vidlist_path, len(video_files))
-
-    # Log the contents of the vidlist.txt file
-    with open(vidlist_path, 'r', encoding='utf-8') as vidlist_file:
-        logger.info("Contents of %s:", vidlist_path)
-        logger.info(vidlist_file.read())
-
+    logger.debug("Files in %s: %s", vidlist_path, video_files)
     return vidlist_path
 
 
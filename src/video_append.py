@@ -2,19 +2,47 @@
 
 import os
 import platform
-from tkinter import Tk, filedialog
+import shutil
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import ffmpeg
 from rich.console import Console
+from tqdm import tqdm
 from utils import get_unique_filename, get_video_files, create_vidlist_file
+from chapters import Recording, group_recordings
+from config import get_config_bool, get_config_int
+from encode import (
+    EncodeOptions,
+    EncodeSettings,
+    Segment,
+    default_workers,
+    encode_audio,
+    encode_segment,
+    encode_settings,
+    plan_segments,
+)
+from ffmpeg_job import FFmpegJob, JobCancelled, JobTimeout, wait_cancellable
+from keyframes import TrimRange, snap_trim
 from logging_setup import setup_logger
+from metrics import job, span
+from mp4 import Mp4Error
+from mp4concat import concat_mp4
+from probe import StreamInfo, probe_files
+from scheduler import DeviceScheduler
 
 logger = setup_logger(__name__)
 console = Console()
 
+DEFAULT_CONCAT_WORKERS = 2
+
 
 def select_files(title: str) -> list:
     """Open a file dialog to select multiple files."""
+    from tkinter import Tk, filedialog  # pylint: disable=import-outside-toplevel
     root = Tk()
     root.withdraw()  # Hide the root window
     file_paths = filedialog.askopenfilenames(title=title)
@@ -36,89 +64,518 @@ def change_dir(path):
         os.chdir(origin)
 
 
-def run_ffmpeg(input_directory: str, output_directory: str, select_files_option: bool) -> None:
-    """Run FFmpeg to concatenate video files."""
+@job('concat', console)
+def run_ffmpeg(input_directory: str, output_directory: str, select_files_option: bool,
+               trims: Optional[Dict[str, TrimRange]] = None,
+               video_files: Optional[List[str]] = None) -> List[str]:
+    """Run FFmpeg to concatenate video files.
+
+    The inputs are probed first and split into runs of clips with identical stream
+    parameters. Each run is concatenated losslessly into its own output file, and
+    any mismatches are reported before ffmpeg writes anything.
+
+    Args:
+        input_directory (str): The directory containing the video files.
+        output_directory (str): The directory to write the output to.
+        select_files_option (bool): Whether to pick the files in a file dialog.
+        trims (Optional[Dict[str, TrimRange]]): The (start, end) in seconds to keep of
+            some inputs, keyed by path. Starts are moved back to the nearest keyframe.
+        video_files (Optional[List[str]]): The clips to concatenate, in order, for
+            example the result of a catalog query. Overrides the other ways of
+            choosing files.
+
+    Returns:
+        List[str]: The files that were written, up to a cancel. Callers that show
+        them to a user open the output directory with open_output_directory.
+    """
+    # Paths are made absolute before changing directory, so that relative ones
+    # still name the same files and the trims match the probed clips
+    input_directory = os.path.abspath(input_directory)
+    output_directory = os.path.abspath(output_directory)
+    if video_files is not None:
+        video_files = [os.path.abspath(path) for path in video_files]
+    trims = {os.path.abspath(path): trim for path, trim in (trims or {}).items()}
     with change_dir(input_directory):
-        # Generate filenames
-        concat_filename = os.path.join(
-            output_directory, get_unique_filename(output_directory, "concat", "mp4"))
-        final_filename = os.path.join(
-            output_directory, get_unique_filename(output_directory, "output", "mp4"))
-
-        if select_files_option:
-            video_files = select_files("Select Video Files to Concatenate")
-        else:
-            video_files = [os.path.join(input_directory, f)
-                           for f in get_video_files(input_directory)]
+        if video_files is None and select_files_option:
+            with span('prompt', question='files'):
+                video_files = [os.path.abspath(path)
+                               for path in select_files("Select Video Files to Concatenate")]
+        elif video_files is None:
+            with span('scan', input_directory) as scan_span:
+                video_files = [os.path.join(input_directory, f)
+                               for f in get_video_files(input_directory)]
+                scan_span.add(files=len(video_files))
 
         if not video_files:
             logger.error("No video files found in %s.", input_directory)
             print(f"Error: No video files found in {input_directory}.")
-            return
+            return []
 
         logger.info("Video files to be processed: %s", video_files)
 
-        vidlist_path = create_vidlist_file(output_directory, video_files)
-        logger.info("vidlist.txt path: %s", vidlist_path)
+        groups = [video_files]
+        streams: Dict[str, StreamInfo] = {}
+        try:
+            with span('probe', files=len(video_files)):
+                streams = probe_files(video_files)
+            logger.info("Total input duration: %.1fs",
+                        sum(info.duration for info in streams.values()))
+            groups = split_compatible(video_files, streams)
+        except (ffmpeg.Error, OSError) as e:
+            logger.warning("Could not probe input files: %s", e)
+            console.print("Could not check stream compatibility; concatenating all files together.",
+                          style="bold yellow")
+
+        written = []
+        for group in groups:
+            duration = sum(trimmed_duration(streams[f].duration, trims.get(f))
+                           for f in group) if streams else None
+            try:
+                output = concat_group(input_directory, output_directory, group, duration, trims)
+            except JobCancelled as e:
+                logger.warning("Concatenation stopped: %s", e)
+                console.print(f"Concatenation stopped: {e}", style="bold red")
+                break
+            if output:
+                written.append(output)
+        return written
+
+
+def compatibility_key(info: StreamInfo) -> tuple:
+    """The stream parameters that must match for a lossless concat."""
+    return (info.codec, info.width, info.height, info.frame_rate, info.time_base,
+            info.pixel_format, info.audio_codec, info.audio_layout, info.audio_sample_rate)
+
+
+def describe_mismatch(previous: StreamInfo, current: StreamInfo) -> str:
+    """Describe which stream parameters differ between two clips."""
+    differences = []
+    for field in ('codec', 'width', 'height', 'frame_rate', 'time_base', 'pixel_format',
+                  'audio_codec', 'audio_layout', 'audio_sample_rate'):
+        before, after = getattr(previous, field), getattr(current, field)
+        if before != after:
+            differences.append(f"{field} {before} -> {after}")
+    return ", ".join(differences)
+
+
+def split_compatible(video_files: List[str], streams: Dict[str, StreamInfo]) -> List[List[str]]:
+    """Split a list of clips into consecutive runs with identical stream parameters.
+
+    Every boundary between runs is printed and logged with the parameters that changed.
+
+    Args:
+        video_files (List[str]): The clips in concatenation order.
+        streams (Dict[str, StreamInfo]): The probed info of each clip, keyed by absolute path.
+
+    Returns:
+        List[List[str]]: The runs, in order.
+    """
+    groups: List[List[str]] = []
+    previous = None
+    for video_file in video_files:
+        info = streams[os.path.abspath(video_file)]
+        if previous is not None and compatibility_key(info) == compatibility_key(previous):
+            groups[-1].append(video_file)
+        else:
+            if previous is not None:
+                mismatch = describe_mismatch(previous, info)
+                logger.warning("Stream parameters change at %s: %s", video_file, mismatch)
+                console.print(f"{os.path.basename(video_file)} starts a new output: {mismatch}",
+                              style="bold yellow")
+            groups.append([video_file])
+        previous = info
+    if len(groups) > 1:
+        console.print(f"Inputs will be written to {len(groups)} separate files.",
+                      style="bold yellow")
+    return groups
+
+
+def trimmed_duration(duration: float, trim: Optional[TrimRange]) -> float:
+    """The duration of a clip after trimming."""
+    if trim is None:
+        return duration
+    start, end = trim
+    return max(0.0, min(duration, end if end is not None else duration) - (start or 0.0))
+
+
+def concat_group(input_directory: str, output_directory: str, video_files: List[str],
+                 duration: Optional[float] = None,
+                 trims: Optional[Dict[str, TrimRange]] = None) -> Optional[str]:
+    """Concatenate one run of compatible clips into a new output file.
+
+    MP4 clips are joined in-process when their sample tables can be merged, and
+    with ffmpeg otherwise.
+
+    Args:
+        input_directory (str): The directory containing the video files.
+        output_directory (str): The directory to write the output to.
+        video_files (List[str]): The clips to concatenate, in order.
+        duration (Optional[float]): The total duration of the clips, if known.
+        trims (Optional[Dict[str, TrimRange]]): The ranges to keep of some clips, keyed
+            by absolute path. Trimmed clips are always joined with ffmpeg.
+
+    Returns:
+        Optional[str]: The output file, or None if ffmpeg failed.
+
+    Raises:
+        JobCancelled: If the concatenation was cancelled or timed out.
+    """
+    final_filename = os.path.join(
+        output_directory, get_unique_filename(output_directory, "output", "mp4"))
+    group_trims = {}
+    for video_file in video_files:
+        trim = (trims or {}).get(os.path.abspath(video_file))
+        if trim is not None:
+            group_trims[video_file] = snap_trim(video_file, trim)
+    if not group_trims and join_natively(video_files, final_filename):
+        return final_filename
+
+    concat_filename = os.path.join(
+        output_directory, get_unique_filename(output_directory, "concat", "mp4"))
+
+    vidlist_path = create_vidlist_file(output_directory, video_files, trims=group_trims)
+    logger.info("vidlist.txt path: %s", vidlist_path)
+
+    # Concatenate videos
+    try:
+        concat_videos(input_directory, vidlist_path, concat_filename, duration)
+    except ffmpeg.Error as e:
+        logger.error("Error concatenating videos: %s", e, exc_info=True)
+        print(f"Error: {e}")
+        return None
+    except JobCancelled:
+        raise
+    except Exception as e:  # Catch any other unexpected exceptions
+        logger.error(
+            "Unexpected error during concatenation: %s", e, exc_info=True)
+        print(f"Unexpected error: {e}")
+        return None
+
+    final_filename = os.path.join(
+        output_directory, get_unique_filename(output_directory, "output", "mp4"))
+    try:
+        with span('rename', output_directory, files=1):
+            os.rename(concat_filename, final_filename)
+    except Exception as e:
+        logger.error("Error renaming file: %s", e)
+        raise
+    return final_filename
+
+
+def _recording_jobs(recordings: List[Recording], output_directory: str
+                    ) -> Dict[str, Tuple[List[str], Optional[float]]]:
+    """Plan the joins of a batch: the chapters and duration of each output to write.
+
+    A recording whose chapters change stream parameters is written to one output
+    per compatible run, <recording>_1.mp4 and so on. Outputs that exist are skipped.
+    """
+    streams: Dict[str, StreamInfo] = {}
+    try:
+        with span('probe', files=sum(len(recording.chapters) for recording in recordings)):
+            streams = probe_files(chapter for recording in recordings
+                                  for chapter in recording.chapters)
+    except (ffmpeg.Error, OSError) as e:
+        logger.warning("Could not probe input files: %s", e)
+
+    jobs: Dict[str, Tuple[List[str], Optional[float]]] = {}
+    for recording in recordings:
+        runs = split_compatible(recording.chapters, streams) if streams else [recording.chapters]
+        for index, run in enumerate(runs):
+            suffix = f"_{index + 1}" if len(runs) > 1 else ""
+            output = os.path.join(output_directory, f"{recording.name}{suffix}.mp4")
+            if os.path.exists(output):
+                logger.info("Skipping %s: %s already exists", recording.name, output)
+                continue
+            duration = sum(streams[os.path.abspath(f)].duration for f in run) if streams else None
+            jobs[output] = (run, duration)
+    return jobs
+
 
-        # Concatenate videos
+@job('concat', console)
+def batch_concat(input_directory: str, output_directory: str, workers: Optional[int] = None,
+                 cancel_event: Optional[threading.Event] = None) -> List[str]:
+    """Join the chapters of every recording in a directory, several recordings at once.
+
+    Chapter files are grouped into recordings by the camera's naming scheme, and each
+    recording is written to <recording>.mp4 in the output directory. Recordings are
+    scheduled per device: up to concat_workers joins read from each source device and
+    write to each destination device at a time, so a batch uses every disk
+    without making one of them seek between many streams. Single-file recordings are
+    already whole and are skipped, as are recordings whose output exists, so a batch
+    can be run again after more footage is added. Press Ctrl+C to cancel the batch.
+
+    Args:
+        input_directory (str): The directory containing the chapter files.
+        output_directory (str): The directory to write the joined recordings to.
+        workers (Optional[int]): The number of recordings joined at once per device.
+            Defaults to the concat_workers setting.
+        cancel_event (Optional[threading.Event]): Set it to stop the batch.
+
+    Returns:
+        List[str]: The files that were written.
+    """
+    with span('scan', input_directory) as scan_span:
+        paths = [os.path.join(input_directory, f) for f in get_video_files(input_directory)]
+        scan_span.add(files=len(paths))
+    recordings = [recording for recording in group_recordings(paths)
+                  if len(recording.chapters) > 1]
+    if not recordings:
+        console.print(f"No recordings split into chapters in {input_directory}.",
+                      style="bold yellow")
+        return []
+
+    jobs = _recording_jobs(recordings, output_directory)
+    if not jobs:
+        console.print("All recordings have already been joined.", style="bold green")
+        return []
+
+    workers = workers or get_config_int('concat_workers', DEFAULT_CONCAT_WORKERS)
+    cancel_event = cancel_event or threading.Event()
+    written: List[str] = []
+    lock = threading.Lock()
+    console.print(f"Joining {len(jobs)} recordings, {workers} at a time per device.",
+                  style="bold green")
+
+    def join_recording(_source: str, destination: str, _lane: str) -> None:
+        if cancel_event.is_set():
+            return
+        chapters, duration = jobs[destination]
+        name = os.path.splitext(os.path.basename(destination))[0]
+        if join_natively(chapters, destination, cancel_event):
+            with lock:
+                written.append(destination)
+            console.print(f"Joined {len(chapters)} chapters into {os.path.basename(destination)}",
+                          style="bold green")
+            return
+        concat_filename = os.path.join(output_directory, f"concat_{name}.mp4")
+        vidlist_path = create_vidlist_file(output_directory, chapters, f"vidlist_{name}.txt")
         try:
-            concat_videos(input_directory, vidlist_path, concat_filename)
-        except ffmpeg.Error as e:
-            logger.error("Error concatenating videos: %s", e, exc_info=True)
-            print(f"Error: {e}")
-        except Exception as e:  # Catch any other unexpected exceptions
-            logger.error(
-                "Unexpected error during concatenation: %s", e, exc_info=True)
-            print(f"Unexpected error: {e}")
+            concat_videos(input_directory, vidlist_path, concat_filename, duration, cancel_event)
+        except (ffmpeg.Error, JobTimeout) as e:
+            logger.error("Could not join %s: %s", name, e)
+            console.print(f"Could not join {name}: {e}", style="bold red")
+            if os.path.exists(concat_filename):
+                os.remove(concat_filename)
             return
+        finally:
+            os.remove(vidlist_path)
+        with span('rename', output_directory, files=1):
+            os.replace(concat_filename, destination)
+        with lock:
+            written.append(destination)
+        console.print(f"Joined {len(chapters)} chapters into {os.path.basename(destination)}",
+                      style="bold green")
 
-        if os.path.exists(final_filename):
-            logger.warning(
-                "File %s already exists. Appending timestamp.", final_filename)
-            final_filename = get_unique_filename(
-                output_directory, "output", "mp4")
-
+    transfers = [(chapters[0], output) for output, (chapters, _) in jobs.items()]
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch") as executor:
+        future = executor.submit(DeviceScheduler(workers, workers).run, transfers, join_recording)
         try:
-            os.rename(concat_filename, final_filename)
-        except Exception as e:
-            logger.error("Error renaming file: %s", e)
-            raise
+            wait_cancellable(future, cancel_event, lambda: console.print(
+                "Cancelling the running jobs...", style="bold red"))
+        except JobCancelled as e:
+            logger.warning("Batch concatenation stopped: %s", e)
+
+    logger.info("Joined %d of %d recordings", len(written), len(jobs))
+    return sorted(written)
+
+
+class _EncodeParts(NamedTuple):
+    """Where the parts of a re-encode are written before they are joined.
+
+    Attributes:
+        directory (str): The work directory.
+        segments (List[Segment]): The segments of the timeline.
+        segment_paths (List[str]): The encoded video of each segment.
+        audio_path (Optional[str]): The encoded audio, None if a clip has no audio.
+        total (Optional[float]): The duration of the timeline, if known.
+    """
+    directory: str
+    segments: List[Segment]
+    segment_paths: List[str]
+    audio_path: Optional[str]
+    total: Optional[float]
+
+
+def _encode_parts(video_files: List[str], parts: _EncodeParts, settings: EncodeSettings,
+                  workers: int, cancel_event: threading.Event) -> None:
+    """Encode the audio and every segment in parallel, with one progress bar for all."""
+    lock = threading.Lock()
+    with tqdm(total=round(parts.total, 1) if parts.total else None, unit='s',
+              desc="Encoding") as pbar:
+        def advance(seconds: float) -> None:
+            with lock:
+                pbar.update(seconds)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode") as executor:
+            futures = []
+            if parts.audio_path:
+                futures.append(executor.submit(encode_audio, video_files, parts.audio_path,
+                                               cancel_event, lambda seconds: None))
+            futures.extend(executor.submit(encode_segment, segment, path, settings,
+                                           cancel_event, advance)
+                           for segment, path in zip(parts.segments, parts.segment_paths))
+            try:
+                for future in futures:
+                    wait_cancellable(future, cancel_event, lambda: console.print(
+                        "Cancelling the encode...", style="bold red"))
+            except BaseException:
+                cancel_event.set()
+                raise
+
+
+def _join_parts(parts: _EncodeParts, output_directory: str,
+                cancel_event: threading.Event) -> str:
+    """Join the encoded segments and audio losslessly into a new output file."""
+    list_path = create_vidlist_file(parts.directory, parts.segment_paths, "segments.txt")
+    inputs = [ffmpeg.input(list_path, format='concat', safe=0)]
+    if parts.audio_path:
+        inputs.append(ffmpeg.input(parts.audio_path))
+    final_filename = os.path.join(
+        output_directory, get_unique_filename(output_directory, "encoded", "mp4"))
+    stream = ffmpeg.output(*inputs, final_filename, c='copy', movflags='+faststart')
+    FFmpegJob(stream, os.path.basename(final_filename), parts.total,
+              cancel_event=cancel_event).run()
+    return final_filename
+
+
+@job('reencode', console)
+def reencode_videos(input_directory: str, output_directory: str,
+                    video_files: Optional[List[str]] = None,
+                    options: Optional[EncodeOptions] = None,
+                    cancel_event: Optional[threading.Event] = None) -> Optional[str]:
+    """Re-encode clips into one file, encoding keyframe-aligned segments in parallel.
 
-        open_output_directory(output_directory)
+    The timeline is split into segments that start on keyframes, and up to
+    encode_workers ffmpeg processes encode them at once with encode_threads
+    threads each. Every segment is scaled and padded to the first clip's size and
+    frame rate, so clips that cannot be stream-copied together can still be joined.
+    The audio is encoded once in parallel with the video, and the segments are
+    joined losslessly at the end. Press Ctrl+C to cancel.
 
+    Args:
+        input_directory (str): The directory containing the video files.
+        output_directory (str): The directory to write the output to.
+        video_files (Optional[List[str]]): The clips in order. Defaults to all video
+            files in the input directory.
+        options (Optional[EncodeOptions]): The codec, quality and number of segments
+            encoded at once. Defaults to the encode_* settings.
+        cancel_event (Optional[threading.Event]): Set it to stop the encode.
 
-def concat_videos(directory: str, vidlist_path: str, concat_filename: str) -> None:
-    """Concatenate video files using FFmpeg."""
+    Returns:
+        Optional[str]: The output file, or None if there was nothing to encode.
+
+    Raises:
+        ffmpeg.Error: If an encode fails.
+        JobCancelled: If the encode is cancelled or times out.
+    """
+    options = options or EncodeOptions()
+    if video_files is None:
+        with span('scan', input_directory) as scan_span:
+            video_files = [os.path.join(input_directory, f)
+                           for f in get_video_files(input_directory)]
+            scan_span.add(files=len(video_files))
+    if not video_files:
+        console.print(f"No video files found in {input_directory}.", style="bold red")
+        return None
+
+    streams: Dict[str, StreamInfo] = {}
+    try:
+        with span('probe', files=len(video_files)):
+            streams = probe_files(video_files)
+    except (ffmpeg.Error, OSError) as e:
+        logger.warning("Could not probe input files: %s", e)
+    settings = encode_settings(streams.get(os.path.abspath(video_files[0])),
+                               options.codec, options.crf)
+    segments = plan_segments(video_files)
+    workers = options.workers or default_workers(settings.threads)
+    cancel_event = cancel_event or threading.Event()
+    console.print(f"Encoding {len(segments)} segments with {settings.codec}, {workers} at a time "
+                  f"with {settings.threads} threads each.", style="bold green")
+
+    work_directory = tempfile.mkdtemp(prefix=".encode_", dir=output_directory)
+    try:
+        has_audio = all(info.audio_codec for info in streams.values()) if streams else True
+        parts = _EncodeParts(
+            directory=work_directory,
+            segments=segments,
+            segment_paths=[os.path.join(work_directory, f"segment_{index:05d}.mp4")
+                           for index in range(len(segments))],
+            audio_path=os.path.join(work_directory, "audio.m4a") if has_audio else None,
+            total=sum(info.duration for info in streams.values()) if streams else None)
+        _encode_parts(video_files, parts, settings, workers, cancel_event)
+        final_filename = _join_parts(parts, output_directory, cancel_event)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+    logger.info("Encoded %d clips into %s", len(video_files), final_filename)
+    return final_filename
+
+
+def join_natively(video_files: List[str], destination: str,
+                  cancel_event: Optional[threading.Event] = None) -> bool:
+    """Join clips in-process by merging their MP4 sample tables, if they allow it.
+
+    Args:
+        video_files (List[str]): The clips to join, in order.
+        destination (str): The output file.
+        cancel_event (Optional[threading.Event]): Set it to stop the join.
+
+    Returns:
+        bool: True if the clips were joined, False if ffmpeg is needed.
+    """
+    if not get_config_bool('native_concat', True):
+        return False
+    try:
+        with span('join', os.path.dirname(os.path.abspath(destination)),
+                  files=len(video_files)) as join_span:
+            concat_mp4(video_files, destination, cancel_event)
+            join_span.add(os.path.getsize(destination))
+    except (Mp4Error, struct.error) as e:
+        logger.info("Joining with ffmpeg instead of natively: %s", e)
+        return False
+    return True
+
+
+def concat_videos(directory: str, vidlist_path: str, concat_filename: str,
+                  duration: Optional[float] = None,
+                  cancel_event: Optional[threading.Event] = None) -> None:
+    """Concatenate video files using FFmpeg.
+
+    The streams are copied without re-encoding, so ffmpeg runs as fast as the disks
+    allow. Nothing is decoded, so no hardware acceleration is requested.
+
+    Args:
+        directory (str): The directory containing the video files.
+        vidlist_path (str): The concat list file.
+        concat_filename (str): The output file.
+        duration (Optional[float]): The expected output duration, used for the progress bar.
+        cancel_event (Optional[threading.Event]): Set it to stop the concatenation.
+
+    Raises:
+        ffmpeg.Error: If ffmpeg fails.
+        JobCancelled: If the job is cancelled or times out. The partial output is removed.
+    """
     input_args = ffmpeg.input(vidlist_path, format='concat', safe=0)
     concat_output_args = (
         ffmpeg
         .output(input_args, concat_filename, vcodec='copy', acodec='copy')
-        .global_args("-reset_timestamps", "1", "-avoid_negative_ts", "1", "-re")
+        .global_args("-reset_timestamps", "1", "-avoid_negative_ts", "1")
     )
 
-    # Attempt to use CUDA acceleration if available
-    try:
-        concat_output_args = concat_output_args.global_args(
-            '-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda')
-    except ffmpeg.Error:
-        logger.warning("CUDA acceleration not available. Falling back to CPU.")
-
-    logger.info("Constructed FFmpeg concat command: %s",
-                concat_output_args.compile())
     logger.info("Running FFmpeg concat command in directory: %s", directory)
 
+    concat_job = FFmpegJob(concat_output_args, os.path.basename(concat_filename), duration,
+                           cancel_event=cancel_event)
     try:
-        ffmpeg.run(concat_output_args)
+        concat_job.run()
     except ffmpeg.Error as e:
         error_message = e.stderr.decode() if e.stderr else str(e)
         logger.error("Error running FFmpeg concat script: %s",
                      error_message, exc_info=True)
         print(f"Error running FFmpeg concat script: {error_message}")
         raise
-    except Exception as e:
-        logger.error("Unexpected error: %s", e, exc_info=True)
-        print(f"Unexpected error: {e}")
+    except JobCancelled:
+        if os.path.exists(concat_filename):
+            os.remove(concat_filename)
         raise
 
 
@@ -1,13 +1,28 @@
 """Module to handle video import."""
 
 import os
-from typing import Optional
-from tkinter import Tk, filedialog
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
 from rich.prompt import Prompt
 from rich.console import Console
+from rich.table import Table
 from tqdm import tqdm
-from config import get_config_value, save_config
+from config import get_config_bool, get_config_value, get_config_int, save_config
 from organize import organize_videos_by_date
+from dedup import ImportIndex, fingerprint
+from iotune import check_free_space
+from journal import ImportJournal, journal_path, partial_path
+from logging_setup import setup_logger
+from metrics import job, span
+from proxies import Sidecars, build_missing, carry_sidecars, find_sidecars
+from scheduler import DeviceScheduler
+from transfer import TransferResult, TransferSettings, transfer_file
+
+logger = setup_logger(__name__)
+
+DEFAULT_IMPORT_WORKERS = 4
+MANIFEST_FILENAME = "checksums.sha256"
 
 
 def select_directory(title: str) -> str:
@@ -19,6 +34,7 @@ def select_directory(title: str) -> str:
     Returns:
         str: The selected directory path.
     """
+    from tkinter import Tk, filedialog  # pylint: disable=import-outside-toplevel
     root = Tk()
     root.withdraw()  # Hide the root window
     directory = filedialog.askdirectory(title=title)
@@ -26,18 +42,139 @@ def select_directory(title: str) -> str:
     return directory
 
 
-def import_videos(input_directory: str, console: Optional[Console] = None, organize_by_date: bool = False) -> None:
+class TransferStats:
+    """Thread-safe byte and time counters for each import worker."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.bytes_by_worker: Dict[str, int] = {}
+        self.seconds_by_worker: Dict[str, float] = {}
+        self.files_by_worker: Dict[str, int] = {}
+        self.elapsed = 0.0
+
+    def record(self, worker: str, num_bytes: int, seconds: float) -> None:
+        """Record a finished file transfer for a worker."""
+        with self._lock:
+            self.bytes_by_worker[worker] = self.bytes_by_worker.get(worker, 0) + num_bytes
+            self.seconds_by_worker[worker] = self.seconds_by_worker.get(worker, 0.0) + seconds
+            self.files_by_worker[worker] = self.files_by_worker.get(worker, 0) + 1
+
+    @property
+    def total_bytes(self) -> int:
+        """Total number of bytes transferred by all workers."""
+        return sum(self.bytes_by_worker.values())
+
+    @property
+    def aggregate_mbps(self) -> float:
+        """Aggregate throughput in MB/s over the wall time of the import."""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.total_bytes / self.elapsed / (1024 * 1024)
+
+
+class ImportSettings(NamedTuple):
+    """How videos are imported.
+
+    Attributes:
+        resume (bool): Whether to resume an interrupted import instead of starting over.
+        verify (Optional[bool]): Whether to verify each copy before deleting its source.
+            Defaults to the verify_imports setting.
+        delete_source (Optional[bool]): Whether to delete the videos from the source
+            directory. The user is asked when this is None.
+        files (Optional[List[str]]): Filenames to import from each input directory.
+            Defaults to every .mp4 file.
+        output_directory (Optional[str]): The directory to import into. Defaults to the
+            output_directory setting; the user is asked when neither is set.
+    """
+    resume: bool = True
+    verify: Optional[bool] = None
+    delete_source: Optional[bool] = None
+    files: Optional[List[str]] = None
+    output_directory: Optional[str] = None
+
+
+class ImportPlan(NamedTuple):
+    """The transfers an import still has to make.
+
+    Attributes:
+        journal (ImportJournal): The journal recording progress of the import.
+        transfers (List[Tuple[str, str]]): (source, destination) path pairs.
+        fingerprints (Dict[str, str]): The fingerprint of each source that was
+            checked against the import index.
+    """
+    journal: ImportJournal
+    transfers: List[Tuple[str, str]]
+    fingerprints: Dict[str, str]
+
+
+def import_videos(input_directory: Union[str, Sequence[str]], console: Optional[Console] = None,
+                  organize_by_date: bool = False,
+                  settings: Optional[ImportSettings] = None) -> None:
     """Import videos from the selected directory and ask whether to delete or keep the videos.
 
+    Several source directories can be imported at once. Sources on different devices
+    are read in parallel, while transfers from the same device are limited to
+    import_workers at a time.
+
+    Progress is recorded in a journal in the output directory. If an earlier import
+    from the same directories was interrupted, only the missing bytes are copied.
+
+    The .LRV proxies and .THM thumbnails cameras write next to their clips are
+    carried along into a Proxy folder. With generate_proxies enabled, the ones a
+    camera did not write are generated afterwards.
+
+    Each stage, down to the copy and verification of every file, is timed and
+    reported when the import ends; see metrics.job.
+
     Args:
-        input_directory (str): The directory containing the video files.
+        input_directory (Union[str, Sequence[str]]): The directory or directories
+            containing the video files.
         console (Optional[Console]): The rich console instance for printing messages.
         organize_by_date (bool): Whether to organize videos by date.
+        settings (Optional[ImportSettings]): How to import. Defaults to resuming an
+            interrupted import and asking the rest.
+    """
+    with job('import', console):
+        if isinstance(input_directory, str):
+            input_directories = [input_directory]
+        else:
+            input_directories = list(input_directory)
+        settings = resolve_settings(settings or ImportSettings(), console)
+        if settings is None:
+            return
+        sidecars = scan_sources(input_directories, settings.files)
+
+        # Organize by date if the user chose to do so
+        if organize_by_date:
+            organize_videos_by_date(settings.output_directory)
+
+        index = ImportIndex()
+        try:
+            plan = plan_import(input_directories, list(sidecars), index, settings, console)
+            stats = run_import(plan, sidecars, index, settings, console)
+        finally:
+            index.close()
+        plan.journal.remove()
+        report_import(stats, plan, settings, console)
+
+
+def resolve_settings(settings: ImportSettings,
+                     console: Optional[Console] = None) -> Optional[ImportSettings]:
+    """Fill in the settings left open from config.ini, asking the user where it has none.
+
+    Args:
+        settings (ImportSettings): The settings given to import_videos.
+        console (Optional[Console]): The rich console instance for printing messages.
+
+    Returns:
+        Optional[ImportSettings]: The settings with an output directory and a decision
+        on deleting and verifying, or None if the user selected no output directory.
     """
-    output_directory = get_config_value('output_directory')
+    output_directory = settings.output_directory or get_config_value('output_directory')
     if not output_directory:
-        output_directory = select_directory(
-            "Select Output Directory for Imported Videos")
+        with span('prompt', question='output directory'):
+            output_directory = select_directory(
+                "Select Output Directory for Imported Videos")
         if output_directory:
             save_config('output_directory', output_directory)
             if console:
@@ -47,32 +184,166 @@ def import_videos(input_directory: str, console: Optional[Console] = None, organ
             if console:
                 console.print("No output directory selected.",
                               style="bold red")
-            return
+            return None
+
+    delete_source = settings.delete_source
+    if delete_source is None:
+        with span('prompt', question='delete source'):
+            delete_choice = Prompt.ask(
+                "Do you want to delete the videos from the source directory after "
+                "importing them?", choices=["yes", "no"])
+        delete_source = delete_choice.lower() == "yes"
+    verify = settings.verify
+    if verify is None:
+        verify = get_config_bool('verify_imports', False)
+    return settings._replace(output_directory=output_directory, delete_source=delete_source,
+                             verify=verify)
+
+
+def scan_sources(input_directories: List[str],
+                 files: Optional[List[str]] = None) -> Dict[str, Sidecars]:
+    """Find the videos to import and the sidecar files next to each of them.
+
+    Args:
+        input_directories (List[str]): The directories containing the video files.
+        files (Optional[List[str]]): Filenames to import from each directory.
+            Defaults to every .mp4 file.
+
+    Returns:
+        Dict[str, Sidecars]: The sidecars of each video, in import order.
+    """
+    sidecars: Dict[str, Sidecars] = {}
+    for directory in input_directories:
+        with span('scan', directory) as scan_span:
+            listing = os.listdir(directory)
+            if files is None:
+                names = listing
+            else:
+                names = [f for f in files if os.path.isfile(os.path.join(directory, f))]
+            for name in names:
+                if name.lower().endswith('.mp4'):
+                    source_path = os.path.join(directory, name)
+                    sidecars[source_path] = find_sidecars(source_path, listing)
+                    scan_span.add(files=1)
+    return sidecars
 
-    delete_choice = Prompt.ask(
-        "Do you want to delete the videos from the source directory after importing them?", choices=["yes", "no"])
-    mp4_files = [f for f in os.listdir(
-        input_directory) if f.lower().endswith('.mp4')]
 
-    # Organize by date if the user chose to do so
-    if organize_by_date:
-        organize_videos_by_date(output_directory)
+def plan_import(input_directories: List[str], sources: List[str], index: ImportIndex,
+                settings: ImportSettings, console: Optional[Console] = None) -> ImportPlan:
+    """Work out which videos still have to be transferred and where each one goes.
 
-    with tqdm(total=len(mp4_files), desc="Overall Progress", unit="file") as overall_pbar:
-        for filename in mp4_files:
-            source_path = os.path.join(input_directory, filename)
+    Videos the journal records as imported, and videos the import index already
+    holds, are skipped; when moving, their sources are deleted.
+
+    Args:
+        input_directories (List[str]): The directories containing the video files.
+        sources (List[str]): The videos to import.
+        index (ImportIndex): The index of every video imported before.
+        settings (ImportSettings): The resolved import settings.
+        console (Optional[Console]): The rich console instance for printing messages.
+
+    Returns:
+        ImportPlan: The journal of the import and the transfers left to make.
+    """
+    output_directory = settings.output_directory
+    with span('plan', files=len(sources)):
+        journal = ImportJournal(journal_path(input_directories, output_directory))
+        if journal.has_entries and not settings.resume:
+            journal.remove()
+        elif journal.has_entries and console:
+            console.print("Resuming an interrupted import.", style="bold yellow")
+
+        fingerprints: Dict[str, str] = {}
+        transfers = []
+        duplicates = 0
+        planned_names: Set[str] = set()
+        for source_path in sources:
+            filename = os.path.basename(source_path)
             destination_path = os.path.join(output_directory, filename)
-            move_file_with_progress(source_path, destination_path)
-            overall_pbar.update(1)
-            if console:
-                console.print(
-                    f"Moved {filename} to {output_directory}/", style="bold green")
+            if journal.is_complete(source_path, destination_path):
+                logger.info("Skipping %s, already imported", filename)
+                if settings.delete_source:
+                    os.remove(source_path)
+                continue
+            if not settings.resume and os.path.exists(partial_path(destination_path)):
+                os.remove(partial_path(destination_path))
+            if not journal.resume_offset(source_path, partial_path(destination_path)):
+                fingerprints[source_path] = fingerprint(source_path)
+                # Sources are deleted when moving, so only a full hash proves the copy exists
+                duplicate_of = index.find_duplicate(source_path, fingerprints[source_path],
+                                                    confirm=settings.delete_source)
+                if duplicate_of:
+                    logger.info("Skipping %s, already imported as %s", filename, duplicate_of)
+                    duplicates += 1
+                    if settings.delete_source and os.path.exists(duplicate_of):
+                        os.remove(source_path)
+                    continue
+                destination_path = unique_destination(output_directory, filename, planned_names)
+            planned_names.add(os.path.basename(destination_path))
+            transfers.append((source_path, destination_path))
+    if duplicates and console:
+        console.print(f"Skipped {duplicates} videos that were already imported.",
+                      style="bold yellow")
+    return ImportPlan(journal, transfers, fingerprints)
+
 
-    if delete_choice.lower() == "yes":
-        for filename in mp4_files:
-            file_path = os.path.join(input_directory, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
+def run_import(plan: ImportPlan, sidecars: Dict[str, Sidecars], index: ImportIndex,
+               settings: ImportSettings, console: Optional[Console] = None) -> TransferStats:
+    """Make the planned transfers, recording each imported video as it completes.
+
+    Every finished video is added to the import index and, when verified, to the
+    checksum manifest, and its sidecars are carried along.
+
+    Args:
+        plan (ImportPlan): The plan returned by plan_import.
+        sidecars (Dict[str, Sidecars]): The sidecars of each video.
+        index (ImportIndex): The index of every video imported before.
+        settings (ImportSettings): The resolved import settings.
+        console (Optional[Console]): The rich console instance for printing messages.
+
+    Returns:
+        TransferStats: Per-worker byte counts and timings.
+    """
+    move = settings.delete_source
+    fingerprints = dict(plan.fingerprints)
+    manifest_lock = threading.Lock()
+
+    def record_import(source: str, destination: str, result: TransferResult) -> None:
+        if source not in fingerprints:
+            fingerprints[source] = fingerprint(destination)
+        index.record(fingerprints[source], os.path.basename(source), destination, result.sha256)
+        if result.sha256:
+            with manifest_lock:
+                append_manifest(settings.output_directory, destination, result.sha256)
+        carry_sidecars(sidecars[source], destination, move=move)
+        if console:
+            action = "Moved" if move else "Copied"
+            verified = " (verified)" if result.sha256 else ""
+            console.print(f"{action} {os.path.basename(source)} to "
+                          f"{os.path.dirname(destination)}/{verified}", style="bold green")
+
+    return transfer_files(plan.transfers, get_config_int('import_workers', DEFAULT_IMPORT_WORKERS),
+                          plan.journal, record_import,
+                          TransferSettings(move=move, verify=settings.verify))
+
+
+def report_import(stats: TransferStats, plan: ImportPlan, settings: ImportSettings,
+                  console: Optional[Console] = None) -> None:
+    """Print the import throughput, generate missing proxies and say what became of the sources.
+
+    Args:
+        stats (TransferStats): The statistics returned by run_import.
+        plan (ImportPlan): The plan the import carried out.
+        settings (ImportSettings): The resolved import settings.
+        console (Optional[Console]): The rich console instance for printing messages.
+    """
+    if console and stats.files_by_worker:
+        print_worker_stats(stats, console)
+    if get_config_bool('generate_proxies', False):
+        with span('proxies', files=len(plan.transfers)):
+            build_missing([destination for _, destination in plan.transfers], console)
+
+    if settings.delete_source:
         if console:
             console.print(
                 "Videos deleted from the source directory.", style="bold green")
@@ -82,20 +353,187 @@ def import_videos(input_directory: str, console: Optional[Console] = None, organ
                           style="bold green")
 
 
-def move_file_with_progress(source: str, destination: str) -> None:
+def append_manifest(output_directory: str, destination: str, sha256: str) -> None:
+    """Append a verified checksum to the manifest in the output directory.
+
+    The manifest uses the sha256sum format, so it can be checked with `sha256sum -c`.
+
+    Args:
+        output_directory (str): The directory videos are imported into.
+        destination (str): The imported file.
+        sha256 (str): The verified SHA-256 of the file.
+    """
+    manifest_path = os.path.join(output_directory, MANIFEST_FILENAME)
+    relative_path = os.path.relpath(destination, output_directory).replace(os.sep, '/')
+    with open(manifest_path, 'a', encoding='utf-8') as manifest:
+        manifest.write(f"{sha256}  {relative_path}\n")
+
+
+def unique_destination(output_directory: str, filename: str, planned_names: Set[str]) -> str:
+    """Get a destination path that neither exists nor is planned for another file.
+
+    Args:
+        output_directory (str): The directory videos are imported into.
+        filename (str): The original filename.
+        planned_names (Set[str]): Filenames already assigned in this import.
+
+    Returns:
+        str: The destination path, with a numeric suffix if the name is taken.
+    """
+    stem, extension = os.path.splitext(filename)
+    candidate = filename
+    count = 1
+    while candidate in planned_names or os.path.exists(os.path.join(output_directory, candidate)):
+        candidate = f"{stem}_{count}{extension}"
+        count += 1
+    if candidate != filename:
+        logger.info("%s already exists in %s, importing as %s", filename, output_directory,
+                    candidate)
+    return os.path.join(output_directory, candidate)
+
+
+def transfer_files(transfers: List[Tuple[str, str]], workers: int,
+                   journal: Optional[ImportJournal] = None,
+                   on_complete: Optional[Callable[[str, str, TransferResult], None]] = None,
+                   settings: Optional[TransferSettings] = None) -> TransferStats:
+    """Move files using bounded pools of parallel transfers, one pool per source device.
+
+    The files written at once to each destination device are limited by the
+    destination_workers setting, which defaults to workers.
+
+    Args:
+        transfers (List[Tuple[str, str]]): (source, destination) path pairs.
+        workers (int): The maximum number of files transferred at once from each
+            source device.
+        journal (Optional[ImportJournal]): The journal recording progress of this import.
+        on_complete (Optional[Callable[[str, str, TransferResult], None]]): Called with
+            the source, destination and result of each finished transfer.
+        settings (Optional[TransferSettings]): Whether to move and verify. Defaults to
+            an unverified move.
+
+    Returns:
+        TransferStats: Per-worker byte counts and timings.
+    """
+    stats = TransferStats()
+    if not transfers:
+        return stats
+    settings = settings or TransferSettings()
+    total_size = sum(os.path.getsize(source) for source, _ in transfers)
+    check_destination_space(transfers, settings.move, journal)
+    logger.info("Transferring %d files (%d bytes) with %d workers per device",
+                len(transfers), total_size, workers)
+
+    pbar_lock = threading.Lock()
+    start = time.perf_counter()
+    with tqdm(total=total_size, unit='B', unit_scale=True, desc="Overall Progress") as overall_pbar:
+        def update_progress(num_bytes: int) -> None:
+            with pbar_lock:
+                overall_pbar.update(num_bytes)
+
+        def run_transfer(source: str, destination: str, worker: str) -> None:
+            file_start = time.perf_counter()
+            size = os.path.getsize(source)
+            result = move_file_with_progress(source, destination, update_progress, journal,
+                                             settings)
+            if on_complete:
+                on_complete(source, destination, result)
+            stats.record(worker, size,
+                         time.perf_counter() - file_start)
+
+        destination_workers = get_config_int('destination_workers', workers)
+        DeviceScheduler(workers, destination_workers).run(transfers, run_transfer)
+    stats.elapsed = time.perf_counter() - start
+    logger.info("Transferred %d bytes in %.2fs (%.1f MB/s)",
+                stats.total_bytes, stats.elapsed, stats.aggregate_mbps)
+    return stats
+
+
+def check_destination_space(transfers: List[Tuple[str, str]], move: bool,
+                            journal: Optional[ImportJournal] = None) -> None:
+    """Fail before copying if the planned transfers will not fit on their destinations.
+
+    Moves within a device are renames and need no space, and bytes already in a
+    resumable partial file are not counted again.
+
+    Args:
+        transfers (List[Tuple[str, str]]): (source, destination) path pairs.
+        move (bool): Whether the sources are moved rather than copied.
+        journal (Optional[ImportJournal]): The journal recording progress of this import.
+
+    Raises:
+        InsufficientSpaceError: If a destination does not have enough free space.
+    """
+    required: Dict[int, Tuple[str, int]] = {}
+    for source, destination in transfers:
+        directory = os.path.dirname(os.path.abspath(destination))
+        dst_dev = os.stat(directory).st_dev
+        source_stat = os.stat(source)
+        if move and source_stat.st_dev == dst_dev:
+            continue
+        needed = source_stat.st_size
+        if journal:
+            needed -= journal.resume_offset(source, partial_path(destination))
+        planned = required.get(dst_dev, (directory, 0))
+        required[dst_dev] = (planned[0], planned[1] + needed)
+    for directory, needed in required.values():
+        check_free_space(directory, needed)
+
+
+def print_worker_stats(stats: TransferStats, console: Console) -> None:
+    """Print the throughput of each import worker.
+
+    Args:
+        stats (TransferStats): The statistics returned by transfer_files.
+        console (Console): The rich console instance for printing messages.
+    """
+    table = Table(title="Import Throughput")
+    table.add_column("Worker")
+    table.add_column("Files", justify="right")
+    table.add_column("MB", justify="right")
+    table.add_column("MB/s", justify="right")
+    for worker in sorted(stats.bytes_by_worker):
+        megabytes = stats.bytes_by_worker[worker] / (1024 * 1024)
+        seconds = stats.seconds_by_worker[worker]
+        rate = megabytes / seconds if seconds > 0 else 0.0
+        table.add_row(worker, str(stats.files_by_worker[worker]),
+                      f"{megabytes:.1f}", f"{rate:.1f}")
+    table.add_row("Total", str(sum(stats.files_by_worker.values())),
+                  f"{stats.total_bytes / (1024 * 1024):.1f}", f"{stats.aggregate_mbps:.1f}")
+    console.print(table)
+
+
+def move_file_with_progress(source: str, destination: str,
+                            progress: Optional[Callable[[int], None]] = None,
+                            journal: Optional[ImportJournal] = None,
+                            settings: Optional[TransferSettings] = None) -> TransferResult:
     """Move a file with a progress bar.
 
+    The data is written to a temporary name and renamed into place when complete,
+    so an interrupted move never leaves a truncated file at the destination.
+
     Args:
         source (str): The source file path.
         destination (str): The destination file path.
+        progress (Optional[Callable[[int], None]]): Called with the number of bytes
+            transferred. When omitted, a per-file progress bar is shown.
+        journal (Optional[ImportJournal]): The journal used to resume partial copies.
+        settings (Optional[TransferSettings]): Whether to move and verify. Defaults to
+            an unverified move.
+
+    Returns:
+        TransferResult: The transfer method that was used and, when verifying, the SHA-256.
     """
+    settings = settings or TransferSettings()
     total_size = os.path.getsize(source)
-    with tqdm(total=total_size, unit='B', unit_scale=True, desc=os.path.basename(source)) as pbar:
-        with open(source, 'rb') as src, open(destination, 'wb') as dst:
-            while True:
-                buffer = src.read(1024 * 1024)  # Read in chunks of 1MB
-                if not buffer:
-                    break
-                dst.write(buffer)
-                pbar.update(len(buffer))
-    os.remove(source)
+    pbar = None
+    if progress is None:
+        pbar = tqdm(total=total_size, unit='B', unit_scale=True, desc=os.path.basename(source))
+        progress = pbar.update
+    try:
+        result = transfer_file(source, destination, progress, journal, settings)
+    finally:
+        if pbar is not None:
+            pbar.close()
+    logger.info("%s %s to %s using %s", "Moved" if settings.move else "Copied", source,
+                destination, result.method)
+    return result
@@ -0,0 +1,248 @@
+"""Module to import new footage automatically as soon as it appears."""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, Optional, Set, Tuple
+from rich.console import Console
+from config import get_config_bool, get_config_int, get_config_value, load_config
+from logging_setup import setup_logger
+from organize import organize_videos_by_date
+from video_import import ImportSettings, import_videos
+
+logger = setup_logger(__name__)
+console = Console()
+
+DEFAULT_SETTLE_SECONDS = 5
+DEFAULT_POLL_SECONDS = 2
+
+# inotify event flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT)
+EVENT_HEADER = struct.Struct('iIII')
+
+FileState = Tuple[int, int]
+
+
+class DirectoryGone(Exception):
+    """Raised when the watched directory is removed or unmounted."""
+
+
+class InotifyWatcher:
+    """Reports changed filenames in a directory using Linux inotify."""
+
+    def __init__(self, directory: str) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout: float) -> Optional[Set[str]]:
+        """Wait for changes.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            Optional[Set[str]]: The names that changed, or None if events were lost
+            and the directory has to be listed again.
+
+        Raises:
+            DirectoryGone: If the directory was removed or unmounted.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        names: Set[str] = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        position = 0
+        while position < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, position)
+            position += EVENT_HEADER.size
+            name = data[position:position + length].rstrip(b'\0')
+            position += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED):
+                raise DirectoryGone()
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self) -> None:
+        """Stop watching."""
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Reports changed filenames by comparing top-level listings of a directory."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.states = list_clips(directory)
+
+    def wait(self, timeout: float) -> Optional[Set[str]]:
+        """Wait one poll interval and return the names whose size or mtime changed."""
+        time.sleep(timeout)
+        if not os.path.isdir(self.directory):
+            raise DirectoryGone()
+        states = list_clips(self.directory)
+        changed = {name for name, state in states.items() if self.states.get(name) != state}
+        self.states = states
+        return changed
+
+    def close(self) -> None:
+        """Stop watching."""
+
+
+def list_clips(directory: str) -> Dict[str, FileState]:
+    """List the .mp4 files at the top level of a directory with their size and mtime."""
+    with os.scandir(directory) as entries:
+        return {entry.name: _state(entry.stat()) for entry in entries
+                if entry.name.lower().endswith('.mp4') and entry.is_file()}
+
+
+def _state(stat_result: os.stat_result) -> FileState:
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+
+def create_watcher(directory: str):
+    """Create an inotify watcher, falling back to polling where inotify is unavailable."""
+    if get_config_bool('watch_polling', False):
+        return PollingWatcher(directory)
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        logger.info("inotify unavailable for %s, polling instead: %s", directory, e)
+        return PollingWatcher(directory)
+
+
+def wait_for_directory(directory: str, poll_seconds: float) -> int:
+    """Block until a directory exists, for example until a card is mounted.
+
+    Returns:
+        int: The device the directory lives on.
+    """
+    announced = False
+    while not os.path.isdir(directory):
+        if not announced:
+            console.print(f"Waiting for {directory} to appear...", style="bold yellow")
+            announced = True
+        time.sleep(poll_seconds)
+    return os.stat(directory).st_dev
+
+
+def watch_and_import(input_directory: str, organize_by_date: bool = False,
+                     delete_source: bool = False, max_batches: Optional[int] = None) -> None:
+    """Watch a directory and import new clips once they have finished being written.
+
+    A clip is imported once its size and mtime have not changed for the configured
+    settle time. Only clips that changed since they were last seen are re-checked,
+    so the directory is never rescanned in full while inotify is available. When
+    the directory disappears or a different filesystem is mounted on it, every
+    clip on the new card is treated as new.
+
+    Args:
+        input_directory (str): The directory or mount point to watch.
+        organize_by_date (bool): Whether to organize the output directory after each import.
+        delete_source (bool): Whether to delete clips from the source after importing them.
+        max_batches (Optional[int]): Stop after this many imports. Runs forever when None.
+    """
+    settle_seconds = get_config_int('watch_settle_seconds', DEFAULT_SETTLE_SECONDS)
+    poll_seconds = get_config_int('watch_poll_seconds', DEFAULT_POLL_SECONDS)
+    output_directory = get_config_value('output_directory')
+    batches = 0
+    handled: Dict[str, FileState] = {}
+
+    while max_batches is None or batches < max_batches:
+        device = wait_for_directory(input_directory, poll_seconds)
+        watcher = create_watcher(input_directory)
+        console.print(f"Watching {input_directory} for new footage.", style="bold green")
+        logger.info("Watching %s using %s", input_directory, type(watcher).__name__)
+        pending: Dict[str, Tuple[FileState, float]] = {}
+        changed: Optional[Set[str]] = None
+        try:
+            while max_batches is None or batches < max_batches:
+                if changed is None:
+                    changed = set(list_clips(input_directory))
+                _update_pending(input_directory, changed, pending, handled)
+                ready = [name for name, (_, seen) in pending.items()
+                         if time.monotonic() - seen >= settle_seconds]
+                if ready:
+                    for name in ready:
+                        handled[name] = pending.pop(name)[0]
+                    logger.info("Importing %d new clips: %s", len(ready), ready)
+                    import_videos(input_directory, console,
+                                  settings=ImportSettings(delete_source=delete_source,
+                                                          files=sorted(ready)))
+                    if organize_by_date:
+                        organize_videos_by_date(output_directory)
+                    batches += 1
+                if os.stat(input_directory).st_dev != device:
+                    raise DirectoryGone()
+                changed = watcher.wait(settle_seconds if pending else poll_seconds)
+        except (DirectoryGone, FileNotFoundError):
+            console.print(f"{input_directory} was removed or unmounted.", style="bold yellow")
+            handled.clear()
+        finally:
+            watcher.close()
+
+
+def _update_pending(directory: str, names: Set[str], pending: Dict[str, Tuple[FileState, float]],
+                    handled: Dict[str, FileState]) -> None:
+    """Re-stat changed clips and reset the settle timer of any that are still growing."""
+    now = time.monotonic()
+    for name in set(names) | set(pending):
+        if not name.lower().endswith('.mp4'):
+            continue
+        try:
+            state = _state(os.stat(os.path.join(directory, name)))
+        except FileNotFoundError:
+            pending.pop(name, None)
+            continue
+        if handled.get(name) == state:
+            continue
+        previous = pending.get(name)
+        if previous is None or previous[0] != state:
+            pending[name] = (state, now)
+
+
+def main() -> None:
+    """Run the watcher on the configured input directory."""
+    load_config()
+    input_directory = get_config_value('input_directory')
+    if not input_directory or not get_config_value('output_directory'):
+        console.print("Set the input and output directories in config.ini before watching.",
+                      style="bold red")
+        return
+    try:
+        watch_and_import(input_directory,
+                         organize_by_date=get_config_bool('watch_organize_by_date', False),
+                         delete_source=get_config_bool('watch_delete_source', False))
+    except KeyboardInterrupt:
+        console.print("Stopped watching.", style="bold red")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Tests for joining MP4 files by merging their sample tables."""
+
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from mp4 import iter_boxes  # pylint: disable=wrong-import-position
+from mp4concat import Mp4Input, UINT32_MAX, _build_header  # pylint: disable=wrong-import-position
+
+GIB = 1024 ** 3
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type: bytes, payload: bytes) -> bytes:
+    return _box(box_type, b'\0\0\0\0' + payload)
+
+
+def write_sparse_clip(path: str, media_bytes: int, samples: int = 4) -> None:
+    """Write a one-track MP4 whose media data is a hole of `media_bytes`, one sample per chunk."""
+    ftyp = _box(b'ftyp', b'mp41' + struct.pack('>I', 0) + b'mp41isom')
+    data_start = len(ftyp) + 8
+    sample_size = media_bytes // samples
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = _full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, samples * 1000)
+                     + struct.pack('>IH10x', 0x10000, 0x100) + matrix + b'\0' * 24
+                     + struct.pack('>I', 2))
+    tkhd = _full_box(b'tkhd', struct.pack('>IIIII', 0, 0, 1, 0, samples * 1000)
+                     + b'\0' * 16 + matrix + struct.pack('>II', 1920 << 16, 1080 << 16))
+    mdhd = _full_box(b'mdhd', struct.pack('>IIIIHH', 0, 0, 30, samples * 30, 0x55c4, 0))
+    hdlr = _full_box(b'hdlr', struct.pack('>I4s12x', 0, b'vide') + b'Video\0')
+    avc1 = _box(b'avc1', b'\0' * 6 + struct.pack('>H', 1) + b'\0' * 16
+                + struct.pack('>HHIIIH', 1920, 1080, 0x480000, 0x480000, 0, 1)
+                + b'\0' * 32 + struct.pack('>Hh', 0x18, -1))
+    stbl = _box(b'stbl', _full_box(b'stsd', struct.pack('>I', 1) + avc1)
+                + _full_box(b'stts', struct.pack('>III', 1, samples, 30))
+                + _full_box(b'stsc', struct.pack('>IIII', 1, 1, 1, 1))
+                + _full_box(b'stsz', struct.pack('>II', sample_size, samples))
+                + _full_box(b'stco', struct.pack('>I', samples)
+                            + b''.join(struct.pack('>I', data_start + index * sample_size)
+                                       for index in range(samples))))
+    minf = _box(b'minf', _full_box(b'vmhd', b'\0' * 8) + stbl)
+    moov = _box(b'moov', mvhd + _box(b'trak', tkhd + _box(b'mdia', mdhd + hdlr + minf)))
+    with open(path, 'wb') as f:
+        f.write(ftyp + struct.pack('>I4s', 8 + media_bytes, b'mdat'))
+        f.seek(media_bytes, os.SEEK_CUR)
+        f.write(moov)
+
+
+def chunk_offsets(header: bytes) -> list:
+    """The chunk offsets written in the moov of a joined file's header."""
+    moov = next(box for box in iter_boxes(header) if box.type == b'moov')
+    stack = [moov]
+    while stack:
+        box = stack.pop()
+        for child in iter_boxes(header, box.payload_offset, box.end):
+            if child.type in (b'trak', b'mdia', b'minf', b'stbl'):
+                stack.append(child)
+            elif child.type in (b'stco', b'co64'):
+                typecode = '>Q' if child.type == b'co64' else '>I'
+                count = struct.unpack_from('>I', header, child.payload_offset + 4)[0]
+                start = child.payload_offset + 8
+                step = struct.calcsize(typecode)
+                return [child.type] + [struct.unpack_from(typecode, header, start + i * step)[0]
+                                       for i in range(count)]
+    raise AssertionError("No chunk offsets in the moov")
+
+
+@pytest.mark.parametrize('media_gib, expected', [(1, b'stco'), (3, b'co64')])
+def test_join_picks_offset_width(tmp_path, media_gib, expected):
+    paths = [str(tmp_path / f"GX0{index}0042.MP4") for index in (1, 2)]
+    for path in paths:
+        write_sparse_clip(path, media_gib * GIB)
+    inputs = [Mp4Input(path) for path in paths]
+    try:
+        header, total_mdat = _build_header(inputs)
+    finally:
+        for source in inputs:
+            source.close()
+
+    assert total_mdat == 2 * media_gib * GIB
+    box_type, *offsets = chunk_offsets(header)
+    assert box_type == expected
+    assert offsets[0] == len(header)
+    assert offsets[4] == len(header) + media_gib * GIB
+    assert (offsets[-1] > UINT32_MAX) == (expected == b'co64')